@@ -12,5 +12,6 @@ calculations.
    subpix
    interpolate
    smooth_clean
+   deform
 
 """
@@ -36,6 +36,14 @@ different methods.
    :members:
    :private-members:
 
+.. autoclass:: CorrelFFTWMulti
+   :members:
+   :private-members:
+
+.. autoclass:: CorrelFFTWMultiPythran
+   :members:
+   :private-members:
+
 .. autoclass:: CorrelCuFFT
    :members:
    :private-members:
@@ -53,20 +61,30 @@ from scipy.signal import correlate2d
 from scipy.ndimage import correlate
 from numpy.fft import fft2, ifft2
 
-from .fft import FFTW2DReal2Complex, CUFFT2DReal2Complex, SKCUFFT2DReal2Complex
+from .fft import (
+    nthreads,
+    FFTW2DReal2Complex,
+    FFTWMulti2DReal2Complex,
+    CUFFT2DReal2Complex,
+    SKCUFFT2DReal2Complex,
+)
 
 from .correl_pythran import correl_pythran
 
 from .correl_pycuda import correl_pycuda
 
+from . import peaks_pythran
+
 from .subpix import SubPix
-from .errors import PIVError
+from .errors import PIVError, NO_ERROR, ERROR_PEAK_BOUNDARY, ERROR_PEAK_NAN
 
 try:
     import theano
 except ImportError:
     pass
 
+is_peaks_pythran_compiled = hasattr(peaks_pythran, "__pythran__")
+
 
 def compute_indices_from_displacement(dx, dy, indices_no_displ):
     return indices_no_displ[1] - dx, indices_no_displ[0] - dy
@@ -108,10 +126,63 @@ def _compute_indices_max(correl, norm):
     return ix, iy, correl_max
 
 
+def _compute_indices_max_multi(correls, norms):
+    """Vectorized version of :func:`_compute_indices_max`
+
+    Compute the indices of the maxima of a stack of correlations. No
+    exception is raised: errors are returned as integer error codes (see
+    :mod:`fluidimage.calcul.errors`).
+
+    """
+    nb_correls, ny, nx = correls.shape
+    tmp = correls.reshape(nb_correls, ny * nx)
+    inds_max = np.argmax(np.where(np.isnan(tmp), -np.inf, tmp), axis=1)
+    iys, ixs = np.unravel_index(inds_max, (ny, nx))
+    ivecs = np.arange(nb_correls)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correls_max = np.where(
+            norms == 0, 0.0, correls[ivecs, iys, ixs] / norms
+        )
+
+    errors = np.zeros(nb_correls, dtype=np.int32)
+
+    touching_boundary = (iys == 0) | (iys == ny - 1) | (ixs == 0) | (ixs == nx - 1)
+    errors[touching_boundary] = ERROR_PEAK_BOUNDARY
+
+    inside = ~touching_boundary
+    ivecs, iy, ix = ivecs[inside], iys[inside], ixs[inside]
+    touching_nan = np.isnan(
+        correls[ivecs, iy - 1, ix - 1]
+        + correls[ivecs, iy - 1, ix + 1]
+        + correls[ivecs, iy + 1, ix - 1]
+        + correls[ivecs, iy + 1, ix + 1]
+    )
+    errors[ivecs[touching_nan]] = ERROR_PEAK_NAN
+
+    return ixs, iys, correls_max, errors
+
+
+def _put_nan_around_peaks(correls, ixs, iys, radius, selection):
+    """Put nan around the peaks of the selected correlations (in place)."""
+    nb_correls, ny, nx = correls.shape
+    around_peaks = (
+        abs(np.arange(ny)[np.newaxis, :, np.newaxis] - iys[:, None, None])
+        <= radius
+    ) & (
+        abs(np.arange(nx)[np.newaxis, np.newaxis, :] - ixs[:, None, None])
+        <= radius
+    )
+    around_peaks &= selection[:, np.newaxis, np.newaxis]
+    correls[around_peaks] = np.nan
+
+
 class CorrelBase:
     """This class is meant to be subclassed, not instantiated directly."""
 
     _tag = "base"
+    # True for the classes computing the correlations of stacks of images
+    multi = False
 
     def __init__(
         self,
@@ -155,6 +226,14 @@ class CorrelBase:
     def get_indices_no_displacement(self):
         return self.iy0, self.ix0
 
+    def _put_nan_around_peak(self, correl, ix, iy):
+        """Put nan around a peak (in place, as :func:`_put_nan_around_peaks`)"""
+        radius = self.particle_radius
+        correl[
+            max(iy - radius, 0) : iy + radius + 1,
+            max(ix - radius, 0) : ix + radius + 1,
+        ] = np.nan
+
     def compute_displacements_from_correl(self, correl, norm=1.0):
         """Compute the displacement from a correlation."""
 
@@ -163,10 +242,7 @@ class CorrelBase:
         except PIVError as e:
             ix, iy, correl_max = e.results
             # second chance to find a better peak...
-            correl[
-                iy - self.particle_radius : iy + self.particle_radius + 1,
-                ix - self.particle_radius : ix + self.particle_radius + 1,
-            ] = np.nan
+            self._put_nan_around_peak(correl, ix, iy)
             try:
                 ix2, iy2, correl_max2 = _compute_indices_max(correl, norm)
             except PIVError as e2:
@@ -184,10 +260,7 @@ class CorrelBase:
         elif self.nb_peaks_to_search >= 1:
             other_peaks = []
             for ip in range(0, self.nb_peaks_to_search - 1):
-                correl[
-                    iy - self.particle_radius : iy + self.particle_radius + 1,
-                    ix - self.particle_radius : ix + self.particle_radius + 1,
-                ] = np.nan
+                self._put_nan_around_peak(correl, ix, iy)
                 try:
                     ix, iy, correl_max_other = _compute_indices_max(correl, norm)
                 except PIVError:
@@ -209,6 +282,128 @@ class CorrelBase:
         ix, iy = self.subpix.compute_subpix(correl, ix, iy)
         return self.compute_displacement_from_indices(ix, iy)
 
+    def compute_displacements_from_correls(self, correls, norms):
+        """Compute the displacements from a stack of correlations.
+
+        Vectorized version of :func:`compute_displacements_from_correl` (the
+        array ``correls`` can be modified).
+
+        Returns
+        -------
+
+        dxs, dys, correls_max : np.ndarray
+
+        errors : np.ndarray
+
+          Integer error codes (see :mod:`fluidimage.calcul.errors`).
+
+        other_peaks : None or list
+
+        """
+        ixs, iys, correls_max, errors = _compute_indices_max_multi(
+            correls, norms
+        )
+
+        has_error = errors != NO_ERROR
+        if has_error.any():
+            # second chance to find a better peak...
+            _put_nan_around_peaks(
+                correls, ixs, iys, self.particle_radius, has_error
+            )
+            ivecs = np.nonzero(has_error)[0]
+            ixs2, iys2, correls_max2, errors2 = _compute_indices_max_multi(
+                correls[ivecs], norms[ivecs]
+            )
+            better = errors2 == NO_ERROR
+            ivecs = ivecs[better]
+            ixs[ivecs] = ixs2[better]
+            iys[ivecs] = iys2[better]
+            correls_max[ivecs] = correls_max2[better]
+            errors[ivecs] = NO_ERROR
+
+        dxs, dys = self.compute_displacement_from_indices(ixs, iys)
+
+        if self.nb_peaks_to_search == 1:
+            other_peaks = None
+        elif self.nb_peaks_to_search >= 1:
+            other_peaks = [
+                [] if error == NO_ERROR else None for error in errors
+            ]
+            searching = errors == NO_ERROR
+            for ip in range(0, self.nb_peaks_to_search - 1):
+                _put_nan_around_peaks(
+                    correls, ixs, iys, self.particle_radius, searching
+                )
+                ixs, iys, correls_max_other, errors_other = _compute_indices_max_multi(
+                    correls, norms
+                )
+                searching &= errors_other == NO_ERROR
+                dxs_other, dys_other = self.compute_displacement_from_indices(
+                    ixs, iys
+                )
+                for ivec in np.nonzero(searching)[0]:
+                    other_peaks[ivec].append(
+                        (
+                            dxs_other[ivec],
+                            dys_other[ivec],
+                            correls_max_other[ivec],
+                        )
+                    )
+        else:
+            raise ValueError
+
+        return dxs, dys, correls_max, errors, other_peaks
+
+    def compute_displacements_subpix_from_correls(
+        self, correls, norms, apply_subpix=True
+    ):
+        """Compute the displacements (with subpix) from a stack of correlations.
+
+        Returns
+        -------
+
+        dxs, dys, correls_max : np.ndarray
+
+        errors : np.ndarray
+
+          Integer error codes (see :mod:`fluidimage.calcul.errors`).
+
+        other_peaks : None or list
+
+        """
+        dxs, dys, correls_max, errors, other_peaks = self.compute_displacements_from_correls(
+            correls, norms
+        )
+
+        if apply_subpix:
+            dxs_subpix, dys_subpix, errors_subpix = self.apply_subpix_multi(
+                dxs, dys, correls
+            )
+            no_error = errors == NO_ERROR
+            dxs = np.where(no_error, dxs_subpix, dxs)
+            dys = np.where(no_error, dys_subpix, dys)
+            errors[no_error] = errors_subpix[no_error]
+
+        return dxs, dys, correls_max, errors, other_peaks
+
+    def apply_subpix_multi(self, dxs, dys, correls):
+        """Compute the displacements with the subpix method (vectorized).
+
+        Returns
+        -------
+
+        dxs, dys : np.ndarray
+
+        errors : np.ndarray
+
+          Integer error codes (see :mod:`fluidimage.calcul.errors`).
+
+        """
+        ixs, iys = self.compute_indices_from_displacement(dxs, dys)
+        ixs, iys, errors = self.subpix.compute_subpix_multi(correls, ixs, iys)
+        dxs, dys = self.compute_displacement_from_indices(ixs, iys)
+        return dxs, dys, errors
+
 
 class CorrelPythran(CorrelBase):
     """Correlation using pythran.
@@ -566,6 +761,15 @@ class CorrelFFTBase(CorrelBase):
 
         return super().compute_displacements_from_correl(correl, norm=norm)
 
+    def compute_displacements_from_correls(self, correls, norms):
+        """Compute the displacements from a stack of correlations."""
+
+        if self.displacement_max is not None:
+            correls = correls.copy()
+            correls[:, self.where_large_displacement] = np.nan
+
+        return super().compute_displacements_from_correls(correls, norms)
+
 
 class CorrelFFTNumpy(CorrelFFTBase):
     """Correlations using numpy.fft."""
@@ -590,15 +794,196 @@ class CorrelFFTW(CorrelFFTBase):
         CorrelFFTBase._init2(self)
         n0, n1 = self.im0_shape
         self.op = self.FFTClass(n1, n0)
+        self._init_indices_shift()
+
+    def _init_indices_shift(self):
+        """Compute the flat indices used to shift the correlations.
+
+        The correlation obtained by fft (index ``i`` for the displacement
+        ``i % n``) is shifted so that the displacement is ``i0 - i`` (as for
+        the other correlation classes). This is equivalent to
+        ``np.fft.fftshift(corr[::-1, ::-1])`` but done in only one pass.
+
+        """
+        n0, n1 = self.im0_shape
+        inds0 = (self.iy0 - np.arange(n0)) % n0
+        inds1 = (self.ix0 - np.arange(n1)) % n1
+        self._indices_shift = inds0[:, np.newaxis] * n1 + inds1
 
     def __call__(self, im0, im1):
         """Compute the correlation from images."""
-        norm = np.sqrt(np.sum(im1 ** 2) * np.sum(im0 ** 2)) * im0.size
-        op = self.op
-        corr = op.ifft(op.fft(im0).conj() * op.fft(im1))
-        correl = np.fft.fftshift(corr[::-1, ::-1])
+        norm = np.sqrt(np.vdot(im1, im1) * np.vdot(im0, im0)) * im0.size
+        corr = self.op.ifft_conj_product(im0, im1)
+        correl = np.take(corr.ravel(), self._indices_shift, mode="clip")
         return correl, norm
 
+    def compute_spectrum0(self, im0):
+        """Compute the data used for the image 0 by :func:`call_with_spectrum0`.
+
+        This is useful when the same image 0 is correlated with many images 1
+        (for example for BOS, with the reference image).
+
+        """
+        return self.op.fft(im0).conj(), np.vdot(im0, im0)
+
+    def call_with_spectrum0(self, spectrum0, im1):
+        """Compute the correlation from the spectrum of the image 0.
+
+        ``spectrum0`` is computed with :func:`compute_spectrum0`, so only the
+        image 1 is transformed.
+
+        """
+        spectrum_conj, sum_squares0 = spectrum0
+        norm = np.sqrt(np.vdot(im1, im1) * sum_squares0) * im1.size
+        corr = self.op.ifft_product_with_fft(spectrum_conj, im1)
+        correl = np.take(corr.ravel(), self._indices_shift, mode="clip")
+        return correl, norm
+
+
+class CorrelFFTWMulti(CorrelFFTW):
+    """Correlations of stacks of images using fftw.
+
+    The images are stacked along the first axis (3D arrays of shape
+    ``(nb_images, ny, nx)``) and all the correlations are computed with only
+    one (multi-axes) fft for each stack and one inverse fft.
+
+    """
+
+    FFTClass = FFTWMulti2DReal2Complex
+    _tag = "fftw.multi"
+    multi = True
+
+    def _init2(self):
+        CorrelFFTBase._init2(self)
+        self.ops = {}
+        self._init_indices_shift()
+
+    def _get_op(self, nb_images):
+        try:
+            return self.ops[nb_images]
+
+        except KeyError:
+            n0, n1 = self.im0_shape
+            op = self.ops[nb_images] = self.FFTClass(n1, n0, nb_images)
+            return op
+
+    def __call__(self, ims0, ims1):
+        """Compute the correlations from stacks of images.
+
+        For 2D arrays (only one couple of images), the correlation (2D array)
+        and the norm (float) are returned.
+
+        """
+        if ims0.ndim == 2:
+            correls, norms = self(ims0[np.newaxis], ims1[np.newaxis])
+            return correls[0], norms[0]
+
+        norms = np.sqrt(
+            np.einsum("ijk,ijk->i", ims1, ims1)
+            * np.einsum("ijk,ijk->i", ims0, ims0)
+        ) * (ims0.shape[1] * ims0.shape[2])
+        nb_images = ims0.shape[0]
+        corrs = self._get_op(nb_images).ifft_conj_product(ims0, ims1)
+        correls = np.take(
+            corrs.reshape(nb_images, -1),
+            self._indices_shift,
+            axis=1,
+            mode="clip",
+        )
+        return correls, norms
+
+    def compute_spectrum0(self, ims0):
+        """Compute the data used for the images 0 by :func:`call_with_spectrum0`.
+
+        """
+        op = self._get_op(ims0.shape[0])
+        return op.fft(ims0).conj(), np.einsum("ijk,ijk->i", ims0, ims0)
+
+    def call_with_spectrum0(self, spectrum0, ims1):
+        """Compute the correlations from the spectra of the images 0.
+
+        ``spectrum0`` is computed with :func:`compute_spectrum0` from a stack
+        of images 0, so only the images 1 are transformed.
+
+        """
+        spectra_conj, sums_squares0 = spectrum0
+        norms = np.sqrt(np.einsum("ijk,ijk->i", ims1, ims1) * sums_squares0) * (
+            ims1.shape[1] * ims1.shape[2]
+        )
+        nb_images = ims1.shape[0]
+        corrs = self._get_op(nb_images).ifft_product_with_fft(
+            spectra_conj, ims1
+        )
+        correls = np.take(
+            corrs.reshape(nb_images, -1),
+            self._indices_shift,
+            axis=1,
+            mode="clip",
+        )
+        return correls, norms
+
+
+class CorrelFFTWMultiPythran(CorrelFFTWMulti):
+    """Correlations of stacks of images using fftw and Pythran.
+
+    The peaks and the subpixel displacements of all the correlations are
+    computed with only one call of the Pythran function
+    :func:`fluidimage.calcul.peaks_pythran.compute_displacements_multi`.
+    When this function is compiled, it releases the GIL and its loop over the
+    correlations is split between ``nthreads`` OpenMP threads (section
+    ``[fft]`` of ``~/.fluidimagerc``, see :mod:`fluidimage.calcul.fft`), so
+    that the thread-based executors can use many cores.
+
+    Only the subpix methods 'centroid', '2d_gaussian2' and 'no_subpix' and
+    ``nb_peaks_to_search == 1`` are supported by the Pythran function. For
+    the other cases and when the Pythran extension is not compiled, the
+    vectorized numpy functions of :class:`CorrelFFTWMulti` are used.
+
+    """
+
+    _tag = "fftw.multi.pythran"
+    _codes_method_subpix = {"no_subpix": 0, "centroid": 1, "2d_gaussian2": 2}
+
+    def _init2(self):
+        CorrelFFTWMulti._init2(self)
+        if self.displacement_max is None:
+            self._mask = np.zeros(self.im0_shape, dtype=bool)
+        else:
+            self._mask = self.where_large_displacement
+
+    def compute_displacements_subpix_from_correls(
+        self, correls, norms, apply_subpix=True
+    ):
+        """Compute the displacements (with subpix) from a stack of correlations.
+
+        """
+        if (
+            not is_peaks_pythran_compiled
+            or self.nb_peaks_to_search != 1
+            or self.subpix.method not in self._codes_method_subpix
+        ):
+            return super().compute_displacements_subpix_from_correls(
+                correls, norms, apply_subpix
+            )
+
+        if apply_subpix:
+            code_method_subpix = self._codes_method_subpix[self.subpix.method]
+        else:
+            code_method_subpix = 0
+
+        dxs, dys, correls_max, errors = peaks_pythran.compute_displacements_multi(
+            correls.astype(np.float32, copy=False),
+            norms.astype(np.float32, copy=False),
+            self._mask,
+            int(self.ix0),
+            int(self.iy0),
+            int(self.particle_radius),
+            code_method_subpix,
+            int(self.subpix.n),
+            nthreads,
+        )
+        return dxs, dys, correls_max, errors, None
+
 
 class CorrelCuFFT(CorrelFFTBase):
     _tag = "cufft"
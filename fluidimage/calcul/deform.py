@@ -0,0 +1,181 @@
+"""Image deformation (:mod:`fluidimage.calcul.deform`)
+=====================================================
+
+Functions used for the window deformation method of the multipass PIV. A
+displacement field known on the PIV grid is interpolated on all the pixels
+and the two images are deformed by plus and minus half this displacement
+field (one remap for each image).
+
+The interpolation from the grid to the pixels is separable, so it is done
+with two small matrices (see :func:`compute_interp_matrices`) which depend
+only on the grid and on the shape of the images and can be reused for all
+the couples of images.
+
+.. autofunction:: compute_interp_matrices
+
+.. autofunction:: compute_dense_field
+
+.. autofunction:: deform_images
+
+"""
+
+import numpy as np
+
+from scipy.ndimage import map_coordinates
+from scipy.interpolate import CubicSpline
+
+orders_interp = {"linear": 1, "cubic": 3}
+
+
+def _get_order(method):
+    try:
+        return orders_interp[method]
+    except KeyError:
+        raise ValueError("method should be in " + str(list(orders_interp)))
+
+
+def _compute_interp_matrix_1d(ivecs, nb_pixels, method):
+    """Matrix of the 1d interpolation from the grid to the pixels."""
+    # constant extrapolation outside the grid
+    coords = np.clip(np.arange(nb_pixels), ivecs[0], ivecs[-1])
+    # the interpolation of the unit vectors gives the columns of the matrix
+    identity = np.eye(len(ivecs))
+    if method == "linear":
+        return np.array([np.interp(coords, ivecs, unit) for unit in identity]).T
+    elif method == "cubic":
+        return CubicSpline(ivecs, identity)(coords)
+    else:
+        raise ValueError("method should be in " + str(list(orders_interp)))
+
+
+def compute_interp_matrices(ixvecs, iyvecs, shape, method="linear"):
+    """Compute the matrices of the interpolation from the grid to the pixels.
+
+    Parameters
+    ----------
+
+    ixvecs, iyvecs : np.array
+
+      1d arrays of the indices of the grid (for example ``WorkPIV.ixvecs``).
+
+    shape : tuple
+
+      Shape of the images.
+
+    method : str {'linear', 'cubic'}
+
+      Bilinear or cubic spline interpolation (the grid can be irregular).
+
+    Returns
+    -------
+
+    matrix_x : np.array
+
+      ``[nx, nb_ixvecs]``
+
+    matrix_y : np.array
+
+      ``[ny, nb_iyvecs]``
+
+    """
+    matrix_x = _compute_interp_matrix_1d(ixvecs, shape[1], method)
+    matrix_y = _compute_interp_matrix_1d(iyvecs, shape[0], method)
+    return matrix_x, matrix_y
+
+
+def compute_dense_field(
+    values, ixvecs, iyvecs, interp_matrices, gradients=None
+):
+    """Interpolate on all the pixels a field known on the PIV grid.
+
+    Parameters
+    ----------
+
+    values : np.array
+
+      Values on the grid, with the order of ``WorkPIV.ixvecs_grid`` (x index
+      varying the slowest).
+
+    ixvecs, iyvecs : np.array
+
+      1d arrays of the indices of the grid.
+
+    interp_matrices : tuple
+
+      Matrices computed with :func:`compute_interp_matrices`.
+
+    gradients : None or tuple
+
+      Gradients (dx_values, dy_values) on the grid (for example computed with
+      the thin plate spline method). If they are given, the interpolation
+      blends the first order Taylor expansions around the grid points
+      surrounding each pixel.
+
+    Returns
+    -------
+
+    field : np.array
+
+      ``[ny, nx]`` float32 array.
+
+    """
+    matrix_x, matrix_y = interp_matrices
+    shape_grid = (len(ixvecs), len(iyvecs))
+    values = values.reshape(shape_grid).T
+
+    field = matrix_y.dot(values).dot(matrix_x.T)
+
+    if gradients is not None:
+        dx_values, dy_values = (
+            grad.reshape(shape_grid).T for grad in gradients
+        )
+        nx = matrix_x.shape[0]
+        ny = matrix_y.shape[0]
+        # matrix_x[i, j] * (x_i - x_j)
+        matrix_dx = matrix_x * np.subtract.outer(np.arange(nx), ixvecs)
+        matrix_dy = matrix_y * np.subtract.outer(np.arange(ny), iyvecs)
+        field += 0.5 * matrix_y.dot(dx_values).dot(matrix_dx.T)
+        field += 0.5 * matrix_dy.dot(dy_values).dot(matrix_x.T)
+
+    return field.astype(np.float32)
+
+
+def deform_images(im0, im1, deltaxs, deltays, method="linear"):
+    """Deform the images 0 and 1 by minus and plus half a displacement field.
+
+    Parameters
+    ----------
+
+    im0, im1 : np.array
+
+    deltaxs, deltays : np.array
+
+      Dense displacement field (same shape as the images).
+
+    method : str {'linear', 'cubic'}
+
+    Returns
+    -------
+
+    im0_deformed, im1_deformed : np.array
+
+      float32 arrays.
+
+    """
+    order = _get_order(method)
+    ny, nx = im0.shape
+    iys, ixs = np.mgrid[:ny, :nx].astype(np.float32)
+
+    half_dxs = 0.5 * deltaxs
+    half_dys = 0.5 * deltays
+
+    ims_deformed = []
+    for im, sign in ((im0, -1), (im1, 1)):
+        coords = np.array([iys + sign * half_dys, ixs + sign * half_dxs])
+        ims_deformed.append(
+            map_coordinates(
+                im, coords, output=np.float32, order=order, mode="nearest"
+            )
+        )
+
+    return tuple(ims_deformed)
@@ -1,9 +1,27 @@
 """Errors (:mod:`fluidimage.calcul.errors`)
 ===========================================
 
+The functions working on stacks of correlations do not raise
+:class:`PIVError` but return integer error codes (0 means no error). The
+corresponding explanations are in the dictionary ``error_explanations``.
 
 """
 
+NO_ERROR = 0
+ERROR_PEAK_BOUNDARY = 1
+ERROR_PEAK_NAN = 2
+ERROR_SUBPIX_BOUNDARY = 3
+ERROR_SUBPIX_WRONG = 4
+ERROR_BAD_SHAPE = 5
+
+error_explanations = {
+    ERROR_PEAK_BOUNDARY: "Correlation peak touching boundary.",
+    ERROR_PEAK_NAN: "Correlation peak touching nan.",
+    ERROR_SUBPIX_BOUNDARY: "close boundary",
+    ERROR_SUBPIX_WRONG: "wrong subpix",
+    ERROR_BAD_SHAPE: "Bad im_crop shape.",
+}
+
 
 class PIVError(Exception):
     """No peak"""
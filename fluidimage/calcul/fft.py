@@ -4,6 +4,30 @@
 Warning: it is more efficient to use not normalized FFT, so we'll do
 that.
 
+The fftw plans are stored in a cache shared by all the objects used in a
+thread (see :func:`get_fftw_plan`). The planner effort (default
+``FFTW_MEASURE``) can be set in the file ``~/.fluidimagerc``::
+
+  [fft]
+  planner_effort = FFTW_PATIENT
+  use_wisdom = True
+  nthreads = 1
+  nb_max_plans = 16
+
+With ``use_wisdom = True`` (default False), the fftw wisdom is saved at exit
+in the fluidimage directory (``~/.fluidimage/fftw_wisdom.npz``) and loaded
+before the first planning, so that the planning is done only once for each
+shape (and not in each process).
+
+``nthreads`` is also the number of OpenMP threads used by
+:func:`fluidimage.calcul.peaks_pythran.compute_displacements_multi`.
+
+.. autofunction:: get_fftw_plan
+
+.. autofunction:: load_wisdom
+
+.. autofunction:: save_wisdom
+
 .. autoclass:: CUFFT2DReal2Complex
    :members:
    :private-members:
@@ -24,10 +48,22 @@ that.
    :members:
    :private-members:
 
+.. autoclass:: FFTWMulti2DReal2Complex
+   :members:
+   :private-members:
+
 """
 
+import atexit
+import os
+from collections import OrderedDict
+from threading import Lock, local
+from zipfile import BadZipFile
+
 import numpy as np
 
+from ..config import get_config, get_path_dir_config
+
 try:
     import pyfftw
 except ImportError:
@@ -57,9 +93,155 @@ else:
 # else:
 #     pass
 
+_config_fft = get_config().get("fft", {})
+
 # It seems that it is better to used nthreads = 1 for the fft with
-# small size used for PIV
-nthreads = 1
+# small size used for PIV (the parallelism is better obtained with threads
+# working on different images, since pyfftw releases the GIL)
+nthreads = int(_config_fft.get("nthreads", 1))
+planner_effort = _config_fft.get("planner_effort", "FFTW_MEASURE")
+use_wisdom = _config_fft.get("use_wisdom", "false").lower() == "true"
+# maximum number of plans kept by each thread
+nb_max_plans = int(_config_fft.get("nb_max_plans", 16))
+
+path_wisdom = os.path.join(get_path_dir_config(), "fftw_wisdom.npz")
+
+_local_plans = local()
+_lock_plans = Lock()
+_wisdom_loaded = False
+_wisdom_to_be_saved = False
+
+
+def _reset_lock_plans():
+    global _lock_plans
+    _lock_plans = Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    # the lock could have been acquired by another thread during the fork
+    os.register_at_fork(after_in_child=_reset_lock_plans)
+
+
+def load_wisdom(path=None):
+    """Import the fftw wisdom saved in a file."""
+    if path is None:
+        path = path_wisdom
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            wisdom = tuple(
+                data[f"wisdom{index}"].tobytes() for index in range(3)
+            )
+    except (OSError, ValueError, KeyError, BadZipFile):
+        return False
+
+    pyfftw.import_wisdom(wisdom)
+    return True
+
+
+def save_wisdom(path=None):
+    """Save the fftw wisdom (merged with the wisdom already saved).
+
+    The 3 wisdom strings (see :func:`pyfftw.export_wisdom`) are saved as
+    arrays of bytes in a npz file. The file is replaced atomically so that
+    many processes can save the wisdom at the same time.
+
+    """
+    if path is None:
+        path = path_wisdom
+
+    load_wisdom(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    path_tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(path_tmp, "wb") as file:
+        np.savez(
+            file,
+            **{
+                f"wisdom{index}": np.frombuffer(wisdom, dtype=np.uint8)
+                for index, wisdom in enumerate(pyfftw.export_wisdom())
+            },
+        )
+    os.replace(path_tmp, path)
+
+
+def _save_wisdom_at_exit():
+    try:
+        save_wisdom()
+    except OSError:
+        pass
+
+
+def get_fftw_plan(shapeX, type_real, direction):
+    """Get a fftw plan (real to complex 2d transforms over the last 2 axes).
+
+    The plans are cached (keys ``(shapeX, type_real, direction)``) and shared
+    by all the objects used in a thread, with their aligned input and output
+    arrays (``plan.input_array`` and ``plan.output_array``). Each thread has
+    its own plans and arrays, so that the objects (and the works using them)
+    can be used at the same time in different threads. Thanks to the fftw
+    wisdom, the planning of the same shape is very fast for the next threads.
+
+    Each thread keeps at most ``nb_max_plans`` plans (the least recently used
+    plans are discarded).
+
+    If ``use_wisdom`` is True, the wisdom is saved only once, at exit, if new
+    plans have been created.
+
+    """
+    global _wisdom_loaded, _wisdom_to_be_saved
+
+    key = (tuple(shapeX), type_real, direction)
+
+    try:
+        plans = _local_plans.plans
+    except AttributeError:
+        plans = _local_plans.plans = OrderedDict()
+
+    try:
+        plan = plans[key]
+    except KeyError:
+        pass
+    else:
+        plans.move_to_end(key)
+        return plan
+
+    # the fftw planner is not thread safe
+    with _lock_plans:
+        if use_wisdom and not _wisdom_loaded:
+            load_wisdom()
+            _wisdom_loaded = True
+
+        type_complex = np.result_type(type_real, np.complex64)
+        shapeK = list(shapeX[:-1]) + [shapeX[-1] // 2 + 1]
+        arrayX = pyfftw.empty_aligned(shapeX, type_real)
+        arrayK = pyfftw.empty_aligned(shapeK, type_complex)
+
+        if direction == "FFTW_FORWARD":
+            input_array, output_array = arrayX, arrayK
+        else:
+            input_array, output_array = arrayK, arrayX
+
+        plan = plans[key] = pyfftw.FFTW(
+            input_array=input_array,
+            output_array=output_array,
+            axes=(-2, -1),
+            direction=direction,
+            flags=(planner_effort,),
+            threads=nthreads,
+        )
+
+        while len(plans) > nb_max_plans:
+            plans.popitem(last=False)
+
+        if (
+            use_wisdom
+            and planner_effort != "FFTW_ESTIMATE"
+            and not _wisdom_to_be_saved
+        ):
+            _wisdom_to_be_saved = True
+            atexit.register(_save_wisdom_at_exit)
+
+    return plan
 
 
 class CUFFT2DReal2Complex:
@@ -180,35 +362,77 @@ class FFTW2DReal2Complex:
         self.shapeX = shapeX
         self.shapeK = shapeK
 
-        self.arrayX = pyfftw.empty_aligned(shapeX, self.type_real)
-        self.arrayK = pyfftw.empty_aligned(shapeK, self.type_complex)
-
-        self.fftplan = pyfftw.FFTW(
-            input_array=self.arrayX,
-            output_array=self.arrayK,
-            axes=(0, 1),
-            direction="FFTW_FORWARD",
-            threads=nthreads,
-        )
-        self.ifftplan = pyfftw.FFTW(
-            input_array=self.arrayK,
-            output_array=self.arrayX,
-            axes=(0, 1),
-            direction="FFTW_BACKWARD",
-            threads=nthreads,
-        )
+        # plan for the current thread
+        self.fftplan
+        self.ifftplan
 
         self.coef_norm = nx * ny
 
+    @property
+    def fftplan(self):
+        """Forward plan of the current thread"""
+        return get_fftw_plan(self.shapeX, self.type_real, "FFTW_FORWARD")
+
+    @property
+    def ifftplan(self):
+        """Backward plan of the current thread"""
+        return get_fftw_plan(self.shapeX, self.type_real, "FFTW_BACKWARD")
+
+    @property
+    def arrayX(self):
+        return self.fftplan.input_array
+
+    @property
+    def arrayK(self):
+        return self.fftplan.output_array
+
     def fft(self, ff):
-        self.arrayX[:] = ff
-        self.fftplan(normalise_idft=False)
-        return self.arrayK.copy()
+        fftplan = self.fftplan
+        fftplan.input_array[:] = ff
+        fftplan.execute()
+        return fftplan.output_array.copy()
 
     def ifft(self, ff_fft):
-        self.arrayK[:] = ff_fft
-        self.ifftplan(normalise_idft=False)
-        return self.arrayX.copy()
+        ifftplan = self.ifftplan
+        ifftplan.input_array[:] = ff_fft
+        ifftplan.execute()
+        return ifftplan.output_array.copy()
+
+    def ifft_conj_product(self, ff0, ff1):
+        """Compute ``ifft(fft(ff0).conj() * fft(ff1))`` without temporary arrays.
+
+        The product is written directly in the input array of the inverse
+        plan and the result is a view of the output array of the inverse plan
+        (overwritten by the next transforms!).
+
+        """
+        fftplan = self.fftplan
+        ifftplan = self.ifftplan
+        product = ifftplan.input_array
+        fftplan.input_array[:] = ff0
+        fftplan.execute()
+        np.conjugate(fftplan.output_array, out=product)
+        fftplan.input_array[:] = ff1
+        fftplan.execute()
+        product *= fftplan.output_array
+        ifftplan.execute()
+        return ifftplan.output_array
+
+    def ifft_product_with_fft(self, ff0_fft, ff1):
+        """Compute ``ifft(ff0_fft * fft(ff1))`` without temporary arrays.
+
+        Same as :func:`ifft_conj_product` (with ``ff0_fft = fft(ff0).conj()``)
+        but only one forward transform is computed, which is useful when the
+        same ``ff0`` is used many times.
+
+        """
+        fftplan = self.fftplan
+        ifftplan = self.ifftplan
+        fftplan.input_array[:] = ff1
+        fftplan.execute()
+        np.multiply(ff0_fft, fftplan.output_array, out=ifftplan.input_array)
+        ifftplan.execute()
+        return ifftplan.output_array
 
     def compute_energy_from_Fourier(self, ff_fft):
         return (
@@ -228,3 +452,28 @@ class FFTW2DReal2ComplexFloat64(FFTW2DReal2Complex):
 
     type_real = "float64"
     type_complex = "complex128"
+
+
+class FFTWMulti2DReal2Complex(FFTW2DReal2Complex):
+    """A class to compute with fftw the 2D ffts of a stack of arrays (float32).
+
+    The arrays are stacked along the first axis (shape ``(nb_arrays, ny,
+    nx)``) and all the 2D transforms are computed with only one call to fftw.
+
+    These ffts are NOT normalized (faster)!
+
+    """
+
+    def __init__(self, nx, ny, nb_arrays):
+
+        shapeX = [nb_arrays, ny, nx]
+        shapeK = [nb_arrays, ny, nx // 2 + 1]
+
+        self.shapeX = shapeX
+        self.shapeK = shapeK
+
+        # plan for the current thread
+        self.fftplan
+        self.ifftplan
+
+        self.coef_norm = nx * ny
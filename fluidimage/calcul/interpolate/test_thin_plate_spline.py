@@ -5,6 +5,8 @@ from .thin_plate_spline import (
     ThinPlateSpline,
     ThinPlateSplineNumpy,
 )
+from .thin_plate_spline_subdom import ThinPlateSplineSubdom
+from ...util import LRUCache
 
 
 pi = np.pi
@@ -37,3 +39,85 @@ def test_tps():
     tps.compute_gradient(U_tps)
 
     ThinPlateSplineNumpy(new_positions, centers)
+
+
+def test_tps_gradient():
+    x = 2 * pi * np.random.rand(40)
+    y = 2 * pi * np.random.rand(40)
+    # with the convention of fluidimage (centers = [ys, xs])
+    centers = np.vstack([y, x])
+    U = 1 + 2 * x - 3 * y
+    U_smooth, U_tps = compute_tps_coeff(centers, U, 0)
+    new_positions = np.array([[1.0, 2.0, 3.0], [3.0, 1.0, 2.0]])
+    tps = ThinPlateSpline(new_positions, centers)
+    dx_U, dy_U = tps.compute_gradient(U_tps)
+    assert np.allclose(dx_U, 2)
+    assert np.allclose(dy_U, -3)
+
+
+def test_tps_subdom_multi():
+    x = 2 * pi * np.random.rand(200)
+    y = 2 * pi * np.random.rand(200)
+    centers = np.vstack([y, x])
+    U = np.sin(x) * np.cos(y)
+    V = np.cos(x) + np.random.rand(200)
+
+    tps = ThinPlateSplineSubdom(centers, 50, 0.5, threshold=0.5)
+    Us_smooth, Us_tps = tps.compute_tps_coeffs_subdom((U, V))
+
+    for field, field_smooth, field_tps in zip((U, V), Us_smooth, Us_tps):
+        field_smooth1, field_tps1 = tps.compute_tps_coeff_subdom(field)
+        assert np.allclose(field_smooth, field_smooth1)
+        for tps_subdom, tps_subdom1 in zip(field_tps, field_tps1):
+            assert np.allclose(tps_subdom, tps_subdom1)
+
+    # without threshold: same as compute_tps_coeff
+    tps = ThinPlateSplineSubdom(centers, 50, 0.5)
+    U_smooth, U_tps = tps.compute_tps_coeff_subdom(U)
+    for ind, U_tps_subdom in zip(tps.ind_v_subdom, U_tps):
+        U_smooth1, U_tps1 = compute_tps_coeff(centers[:, ind], U[ind], 0.5)
+        assert np.allclose(U_tps_subdom, U_tps1)
+
+
+def test_tps_subdom_cache():
+    x = 2 * pi * np.random.rand(200)
+    y = 2 * pi * np.random.rand(200)
+    centers = np.vstack([y, x])
+    new_positions = np.vstack([y[::2] + 0.1, x[::2]])
+    U = np.sin(x) * np.cos(y)
+
+    cache = LRUCache()
+    results = []
+    for _ in range(2):
+        tps = ThinPlateSplineSubdom(centers, 50, 0.5, cache=cache)
+        U_smooth, U_tps = tps.compute_tps_coeff_subdom(U)
+        tps.init_with_new_positions(new_positions)
+        results.append((tps, tps.compute_eval(U_tps)))
+
+    (tps0, U_eval0), (tps1, U_eval1) = results
+    assert np.allclose(U_eval0, U_eval1)
+    # the matrices have been reused
+    assert all(EM0 is EM1 for EM0, EM1 in zip(tps0.EM, tps1.EM))
+    assert tps0._factorizations[0] is tps1._factorizations[0]
+
+
+def test_tps_subdom_threads():
+    x = 2 * pi * np.random.rand(300)
+    y = 2 * pi * np.random.rand(300)
+    centers = np.vstack([y, x])
+    new_positions = np.vstack([y[::2] + 0.1, x[::2]])
+    U = np.sin(x) * np.cos(y)
+
+    results = []
+    for nb_workers in (1, 3):
+        tps = ThinPlateSplineSubdom(
+            centers, 50, 0.5, threshold=0.5, nb_workers=nb_workers
+        )
+        U_smooth, U_tps = tps.compute_tps_coeff_subdom(U)
+        tps.init_with_new_positions(new_positions)
+        results.append(
+            (U_smooth, tps.compute_eval(U_tps), *tps.compute_gradient(U_tps))
+        )
+
+    for arr, arr_threads in zip(*results):
+        assert np.allclose(arr, arr_threads)
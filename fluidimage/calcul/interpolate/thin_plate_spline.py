@@ -17,6 +17,10 @@ obtained as ``dot(U_tps, EMDX)`` and ``dot(U_tps, EMDY)``, where
 
 .. autofunction:: compute_tps_coeff
 
+.. autofunction:: factorize_tps_system
+
+.. autofunction:: solve_tps_system
+
 .. autoclass:: ThinPlateSpline
    :members:
 
@@ -27,7 +31,10 @@ obtained as ``dot(U_tps, EMDX)`` and ``dot(U_tps, EMDY)``, where
 
 """
 
+import warnings
+
 import numpy as np
+from scipy.linalg import lu_factor, lu_solve, LinAlgWarning
 
 from . import tps_pythran
 
@@ -58,10 +65,36 @@ def compute_tps_coeff(centers, U, smoothing_coef):
     U_tps : np.array
          TPS weights of the centres and columns of the linear.
 
+    """
+    factorization = factorize_tps_system(centers, smoothing_coef)
+    return solve_tps_system(factorization, U)
+
+
+def factorize_tps_system(centers, smoothing_coef):
+    """Compute the LU factorization of the TPS linear system
+
+    The factorization depends only on the centers and on the smoothing
+    coefficient, so it can be used for different fields (and for the
+    iterations of :func:`ThinPlateSplineSubdom.compute_tps_coeff_iter`) with
+    :func:`solve_tps_system`.
+
+    Parameters
+    ----------
+
+    centers : np.array
+        ``[nb_dim,  N]`` array representing the positions of the N centers.
+
+    smoothing_coef : float
+
+    Returns
+    -------
+
+    factorization : tuple
+        ``(EM, lu_and_piv)``, where ``EM`` is the ``[N, N+nb_dim+1]`` matrix
+        giving the smoothed values from the TPS coefficients.
+
     """
     nb_dim, N = centers.shape
-    U = np.hstack([U, np.zeros(nb_dim + 1)])
-    U = U.reshape([U.size, 1])
     try:
         EM = compute_tps_matrix(centers, centers).T
     except TypeError as e:
@@ -81,11 +114,47 @@ def compute_tps_coeff(centers, U, smoothing_coef):
     # print('det(IM)', np.linalg.det(IM))
     # print('cond(IM)', np.linalg.cond(IM))
 
-    # U_tps, r, r2, r3 = np.linalg.lstsq(IM, U)
-    U_tps = np.linalg.solve(IM, U)
+    with warnings.catch_warnings():
+        # singular matrices are detected just after
+        warnings.simplefilter("ignore", LinAlgWarning)
+        lu_and_piv = lu_factor(IM, overwrite_a=True)
 
+    if not np.all(np.diag(lu_and_piv[0])):
+        raise np.linalg.LinAlgError("Singular matrix")
+
+    return EM, lu_and_piv
+
+
+def solve_tps_system(factorization, U):
+    """Compute the TPS coefficients from a factorization
+
+    Parameters
+    ----------
+
+    factorization : tuple
+        Result of :func:`factorize_tps_system`.
+
+    U : np.array
+        ``[N]`` or ``[nb_fields, N]`` array (one solve for all the fields).
+
+    Returns
+    -------
+
+    U_smooth : np.array
+         ``[N]`` or ``[nb_fields, N]``
+
+    U_tps : np.array
+         ``[N+nb_dim+1]`` or ``[nb_fields, N+nb_dim+1]``
+
+    """
+    EM, lu_and_piv = factorization
+    nb_coefs = EM.shape[1]
+    U = np.asarray(U)
+    rhs = np.zeros((nb_coefs,) + U.shape[:-1])
+    rhs[: U.shape[-1]] = U.T
+    U_tps = lu_solve(lu_and_piv, rhs)
     U_smooth = np.dot(EM, U_tps)
-    return U_smooth.ravel(), U_tps.ravel()
+    return U_smooth.T, U_tps.T
 
 
 def compute_tps_matrix_numpy(dsites, centers):
@@ -183,8 +252,9 @@ def compute_tps_matrices_dxy(dsites, centers):
     DY = Dsites - Centers
     DM = DX * DX + DY * DY
     DM[DM != 0] = np.log(DM[DM != 0]) + 1
-    DMX = np.vstack([DX * DM, np.zeros(M), np.ones(M), np.zeros(M)])
-    DMY = np.vstack([DY * DM, np.zeros(M), np.zeros(M), np.ones(M)])
+    # the linear part of EM is [1, dsites[0], dsites[1]] = [1, y, x]
+    DMX = np.vstack([DX * DM, np.zeros(M), np.zeros(M), np.ones(M)])
+    DMY = np.vstack([DY * DM, np.zeros(M), np.ones(M), np.zeros(M)])
     return DMX, DMY
 
 
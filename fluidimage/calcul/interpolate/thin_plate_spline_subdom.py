@@ -21,14 +21,62 @@ obtained as ``dot(U_tps, EMDX)`` and ``dot(U_tps, EMDY)``, where
 """
 
 from logging import debug
+import hashlib
 
 import numpy as np
 
-from .thin_plate_spline import compute_tps_coeff, compute_tps_matrix
+from ...util.util import get_thread_pool
+
+from .thin_plate_spline import (
+    factorize_tps_system,
+    solve_tps_system,
+    compute_tps_matrix,
+    compute_tps_matrices_dxy,
+)
+
+
+def _digest(arr):
+    """Key identifying the values of an array"""
+    arr = np.ascontiguousarray(arr)
+    return arr.shape, hashlib.sha1(arr.tobytes()).hexdigest()
 
 
 class ThinPlateSplineSubdom:
-    """Helper class for thin plate interpolation."""
+    """Helper class for thin plate interpolation.
+
+    Parameters
+    ----------
+
+    centers : np.array
+
+    subdom_size : int
+
+    smoothing_coef : float
+
+    threshold : None or float
+
+    percent_buffer_area : float
+
+    cache : None or :class:`fluidimage.util.LRUCache`
+
+      If a cache is given, the decompositions in subdomains, the
+      factorizations and the evaluation matrices are stored in it, so that
+      they can be reused for other fields with the same centers (for example
+      for a time series of PIV fields with the same grid). The matrices of
+      the subdomains are identified by their centers (and new positions), so
+      only the subdomains containing masked or nan vectors are recomputed.
+      A growable cache (see :class:`fluidimage.util.LRUCache`) is enlarged
+      so that the matrices of ``nb_fields_cache`` fields can be kept.
+
+    nb_workers : int
+
+      Number of threads used to process the subdomains in parallel (the
+      LAPACK and BLAS functions release the GIL).
+
+    """
+
+    #: Number of fields whose matrices can be kept in a growable cache
+    nb_fields_cache = 4
 
     def __init__(
         self,
@@ -37,15 +85,67 @@ class ThinPlateSplineSubdom:
         smoothing_coef,
         threshold=None,
         percent_buffer_area=0.2,
+        cache=None,
+        nb_workers=1,
     ):
 
         self.centers = centers
         self.subdom_size = subdom_size
         self.smoothing_coef = smoothing_coef
         self.threshold = threshold
+        self.cache = cache
+        self.nb_workers = nb_workers
         self.compute_indices(percent_buffer_area)
 
+    def _map_subdom(self, func):
+        """Compute ``[func(i) for i in range(self.nb_subdom)]``
+
+        The subdomains are processed in parallel if ``self.nb_workers > 1``.
+
+        """
+        if self.nb_workers == 1 or self.nb_subdom == 1:
+            return [func(i) for i in range(self.nb_subdom)]
+        # computed here (and not in the threads) only once
+        self._get_digests_centers_subdom()
+        pool = get_thread_pool(self.nb_workers, "tps")
+        return list(pool.map(func, range(self.nb_subdom)))
+
+    def _get_from_cache(self, key, func, *args):
+        if self.cache is None:
+            return func(*args)
+        return self.cache.get_or_compute(key, func, *args)
+
+    def _get_digests_centers_subdom(self):
+        if self._digests_centers_subdom is None:
+            self._digests_centers_subdom = [
+                _digest(self.centers[:, inds]) for inds in self.ind_v_subdom
+            ]
+        return self._digests_centers_subdom
+
     def compute_indices(self, percent_buffer_area=0.25):
+        """Compute the decomposition in subdomains"""
+        key = (
+            "indices",
+            _digest(self.centers),
+            self.subdom_size,
+            percent_buffer_area,
+        )
+        self.__dict__.update(
+            self._get_from_cache(
+                key, self._compute_indices, percent_buffer_area
+            )
+        )
+        # the data of the subdomains depend on the decomposition
+        self._digests_centers_subdom = None
+        self._factorizations = [None] * self.nb_subdom
+
+        if self.cache is not None:
+            # 3 matrices per subdomain (factorization, EM and DMXY)
+            self.cache.ensure_maxsize(
+                self.nb_fields_cache * (1 + 3 * self.nb_subdom)
+            )
+
+    def _compute_indices(self, percent_buffer_area):
         xs = self.centers[1]
         ys = self.centers[0]
         max_coord = np.max(self.centers, 1)
@@ -63,9 +163,6 @@ class ThinPlateSplineSubdom:
 
         nb_subdom = nb_subdomx * nb_subdomy
 
-        self.nb_subdomx = nb_subdomx
-        self.nb_subdomy = nb_subdomy
-
         x_dom = np.linspace(min_coord[1], max_coord[1], nb_subdomx + 1)
         y_dom = np.linspace(min_coord[0], max_coord[0], nb_subdomy + 1)
 
@@ -82,11 +179,6 @@ class ThinPlateSplineSubdom:
             * np.ones_like(y_dom)
         )
 
-        self.x_dom = x_dom
-        self.y_dom = y_dom
-        self.buffer_area_x = buffer_area_x
-        self.buffer_area_y = buffer_area_y
-
         ind_subdom = np.zeros([nb_subdom, 2])
         ind_v_subdom = []
 
@@ -105,33 +197,96 @@ class ThinPlateSplineSubdom:
                 )
 
                 i_subdom += 1
-        self.ind_v_subdom = ind_v_subdom
-        self.nb_subdom = nb_subdom
+
+        return dict(
+            nb_subdomx=nb_subdomx,
+            nb_subdomy=nb_subdomy,
+            x_dom=x_dom,
+            y_dom=y_dom,
+            buffer_area_x=buffer_area_x,
+            buffer_area_y=buffer_area_y,
+            ind_v_subdom=ind_v_subdom,
+            nb_subdom=nb_subdom,
+        )
 
     def compute_tps_coeff_subdom(self, U):
+        """Compute the TPS coefficients of a field for all subdomains.
 
-        U_smooth = [None] * self.nb_subdom
-        U_tps = [None] * self.nb_subdom
+        Returns
+        -------
 
-        for i in range(self.nb_subdom):
+        U_smooth : np.array
 
-            centers_tmp = self.centers[:, self.ind_v_subdom[i]]
+        U_tps : list
+
+          TPS coefficients for each subdomain.
+
+        """
+        Us_smooth, Us_tps = self.compute_tps_coeffs_subdom([U])
+        return Us_smooth[0], Us_tps[0]
 
-            U_tmp = U[self.ind_v_subdom[i]]
-            U_smooth[i], U_tps[i] = self.compute_tps_coeff_iter(
-                centers_tmp, U_tmp
+    def compute_tps_coeffs_subdom(self, Us):
+        """Compute the TPS coefficients of several fields (e.g. x and y).
+
+        The matrix of each subdomain is factorized only once (see
+        :meth:`_get_factorization`) and all the fields are solved together.
+
+        Parameters
+        ----------
+
+        Us : sequence of np.array
+
+        Returns
+        -------
+
+        Us_smooth : list of np.array
+
+        Us_tps : list of list
+
+          TPS coefficients for each field and each subdomain.
+
+        """
+        Us = np.array(Us, dtype=np.float64, ndmin=2)
+        nb_fields = Us.shape[0]
+
+        def compute_subdom(i):
+            return self.compute_tps_coeff_iter(
+                None,
+                Us[:, self.ind_v_subdom[i]],
+                factorization=self._get_factorization(i),
             )
 
-        U_smooth_tmp = np.zeros(self.centers[1].shape)
+        Us_smooth_subdom, Us_tps_subdom = zip(*self._map_subdom(compute_subdom))
+        Us_tps = [
+            [U_tps[ifield] for U_tps in Us_tps_subdom]
+            for ifield in range(nb_fields)
+        ]
+
+        Us_smooth = np.zeros((nb_fields,) + self.centers[1].shape)
         nb_tps = np.zeros(self.centers[1].shape, dtype=int)
 
         for i in range(self.nb_subdom):
-            U_smooth_tmp[self.ind_v_subdom[i]] += U_smooth[i]
+            Us_smooth[:, self.ind_v_subdom[i]] += Us_smooth_subdom[i]
             nb_tps[self.ind_v_subdom[i]] += 1
 
-        U_smooth_tmp /= nb_tps
+        Us_smooth /= nb_tps
+
+        return list(Us_smooth), Us_tps
 
-        return U_smooth_tmp, U_tps
+    def _get_factorization(self, i):
+        """Get the (cached) factorization of the TPS system of a subdomain"""
+        factorization = self._factorizations[i]
+        if factorization is None:
+            centers_tmp = self.centers[:, self.ind_v_subdom[i]]
+            key = (
+                "factorization",
+                self._get_digests_centers_subdom()[i],
+                self.smoothing_coef,
+            )
+            factorization = self._factorizations[i] = self._get_from_cache(
+                key, factorize_tps_system, centers_tmp, self.smoothing_coef
+            )
+        return factorization
 
     def init_with_new_positions(self, new_positions):
         npos = self.new_positions = new_positions
@@ -159,36 +314,90 @@ class ThinPlateSplineSubdom:
 
         self.ind_new_positions_subdom = ind_new_positions_subdom
         self._init_EM_subdom()
+        # the matrices for the gradient are computed only if needed
+        self.DMX = self.DMY = None
+
+    def _get_key_subdom(self, name, i):
+        new_positions_tmp = self.new_positions[
+            :, self.ind_new_positions_subdom[i]
+        ]
+        return (
+            name,
+            self._get_digests_centers_subdom()[i],
+            _digest(new_positions_tmp),
+        )
 
     def _init_EM_subdom(self):
 
-        EM = [None] * self.nb_subdom
-
-        for i in range(self.nb_subdom):
+        def compute_EM(i):
             centers_tmp = self.centers[:, self.ind_v_subdom[i]]
             new_positions_tmp = self.new_positions[
                 :, self.ind_new_positions_subdom[i]
             ]
-            EM[i] = compute_tps_matrix(new_positions_tmp, centers_tmp)
+            return self._get_from_cache(
+                self._get_key_subdom("EM", i),
+                compute_tps_matrix,
+                new_positions_tmp,
+                centers_tmp,
+            )
 
-        self.EM = EM
+        self.EM = self._map_subdom(compute_EM)
 
     def compute_eval(self, U_tps):
 
         U_eval = np.zeros(self.new_positions[1].shape)
         nb_tps = np.zeros(self.new_positions[1].shape, dtype=int)
 
+        U_eval_subdom = self._map_subdom(lambda i: np.dot(U_tps[i], self.EM[i]))
+
         for i in range(self.nb_subdom):
-            U_eval[self.ind_new_positions_subdom[i]] += np.dot(
-                U_tps[i], self.EM[i]
-            )
+            U_eval[self.ind_new_positions_subdom[i]] += U_eval_subdom[i]
             nb_tps[self.ind_new_positions_subdom[i]] += 1
 
         U_eval /= nb_tps
 
         return U_eval
 
-    def compute_tps_coeff_iter(self, centers, U):
+    def compute_gradient(self, U_tps):
+        """Compute the gradient (dx_U, dy_U) at the new positions."""
+
+        if self.DMX is None:
+
+            def compute_DMXY(i):
+                centers_tmp = self.centers[:, self.ind_v_subdom[i]]
+                new_positions_tmp = self.new_positions[
+                    :, self.ind_new_positions_subdom[i]
+                ]
+                return self._get_from_cache(
+                    self._get_key_subdom("DMXY", i),
+                    compute_tps_matrices_dxy,
+                    new_positions_tmp,
+                    centers_tmp,
+                )
+
+            self.DMX, self.DMY = zip(*self._map_subdom(compute_DMXY))
+
+        def compute_gradient_subdom(i):
+            return np.dot(U_tps[i], self.DMX[i]), np.dot(U_tps[i], self.DMY[i])
+
+        gradients_subdom = self._map_subdom(compute_gradient_subdom)
+
+        dx_U = np.zeros(self.new_positions[1].shape)
+        dy_U = np.zeros(self.new_positions[1].shape)
+        nb_tps = np.zeros(self.new_positions[1].shape, dtype=int)
+
+        for i, (dx_U_subdom, dy_U_subdom) in enumerate(gradients_subdom):
+            inds = self.ind_new_positions_subdom[i]
+            dx_U[inds] += dx_U_subdom
+            dy_U[inds] += dy_U_subdom
+            nb_tps[inds] += 1
+
+        dx_U /= nb_tps
+        dy_U /= nb_tps
+
+        return dx_U, dy_U
+
+    def compute_tps_coeff_iter(self, centers, U, factorization=None):
         """Compute the thin plate spline (tps) coefficients removing erratic
         vectors
 
@@ -196,21 +405,29 @@ class ThinPlateSplineSubdom:
         result to the initial data and remove it if difference is
         larger than the given threshold
 
+        The erratic values are replaced by the smoothed values, so that the
+        matrix of the system does not change between the iterations: it is
+        factorized only once (or the factorization can be given). ``U`` can
+        be a ``[nb_fields, N]`` array (the iterations are then done
+        independently for each field).
+
         """
-        U_smooth, U_tps = compute_tps_coeff(centers, U, self.smoothing_coef)
+        if factorization is None:
+            factorization = factorize_tps_system(centers, self.smoothing_coef)
+
+        U = np.array(U, dtype=np.float64)
+        U_smooth, U_tps = solve_tps_system(factorization, U)
+        count = 1
         if self.threshold is not None:
             Udiff = np.sqrt((U_smooth - U) ** 2)
-            ind_erratic_vector = np.argwhere(Udiff > self.threshold)
+            ind_erratic_vector = np.nonzero(Udiff > self.threshold)
 
-            count = 1
-            while ind_erratic_vector.size != 0:
+            while ind_erratic_vector[0].size != 0:
                 U[ind_erratic_vector] = U_smooth[ind_erratic_vector]
-                U_smooth, U_tps = compute_tps_coeff(
-                    centers, U, self.smoothing_coef
-                )
+                U_smooth, U_tps = solve_tps_system(factorization, U)
 
                 Udiff = np.sqrt((U_smooth - U) ** 2)
-                ind_erratic_vector = np.argwhere(Udiff > self.threshold)
+                ind_erratic_vector = np.nonzero(Udiff > self.threshold)
                 count += 1
 
                 if count > 10:
@@ -0,0 +1,219 @@
+"""Peaks and subpix for stacks of correlations (Pythran)
+========================================================
+
+The whole stack is processed in one call (no Python code per window). When
+compiled with Pythran and OpenMP, the loop over the correlations is split
+between ``nb_threads`` OpenMP threads (``OMP_NUM_THREADS`` is not used since
+it is set to 1 in :mod:`fluidimage`).
+
+As in the numpy functions of :mod:`fluidimage.calcul.correl`, the points
+excluded by the mask and the nan values of the correlations are both
+considered as nan.
+
+The error codes are the same as in :mod:`fluidimage.calcul.errors`.
+
+"""
+
+import numpy as np
+
+
+# pythran export compute_displacements_multi(
+#     float32[:, :, :], float32[:], bool[:, :], int, int, int, int, int, int)
+
+
+def _is_nan(correl, mask, iy, ix, iy_excl, ix_excl, radius):
+    """True if the point is excluded or if the correlation is nan"""
+    return (
+        mask[iy, ix]
+        or (abs(iy - iy_excl) <= radius and abs(ix - ix_excl) <= radius)
+        or np.isnan(correl[iy, ix])
+    )
+
+
+def _find_peak(correl, mask, iy_excl, ix_excl, radius):
+    """Find the peak of a correlation
+
+    The points where mask is True, the points of the square of side
+    ``2*radius+1`` centered on ``(iy_excl, ix_excl)`` and the nan are
+    excluded (as in :func:`fluidimage.calcul.correl._put_nan_around_peaks`
+    and :func:`fluidimage.calcul.correl._compute_indices_max_multi`).
+
+    """
+    ny, nx = correl.shape
+    iy_max = 0
+    ix_max = 0
+    value_max = -np.inf
+    for iy in range(ny):
+        for ix in range(nx):
+            if _is_nan(correl, mask, iy, ix, iy_excl, ix_excl, radius):
+                continue
+            if correl[iy, ix] > value_max:
+                value_max = correl[iy, ix]
+                iy_max = iy
+                ix_max = ix
+
+    if iy_max == 0 or iy_max == ny - 1 or ix_max == 0 or ix_max == nx - 1:
+        return iy_max, ix_max, 1
+
+    for iy in (iy_max - 1, iy_max + 1):
+        for ix in (ix_max - 1, ix_max + 1):
+            if _is_nan(correl, mask, iy, ix, iy_excl, ix_excl, radius):
+                return iy_max, ix_max, 2
+
+    return iy_max, ix_max, 0
+
+
+def _compute_centroid(correl, iy, ix, nsubpix):
+    sum_correl = 0.0
+    deplx = 0.0
+    deply = 0.0
+    for j in range(-nsubpix, nsubpix + 1):
+        for i in range(-nsubpix, nsubpix + 1):
+            value = correl[iy + j, ix + i]
+            sum_correl += value
+            deplx += i * value
+            deply += j * value
+    return deplx / sum_correl, deply / sum_correl
+
+
+def _compute_2d_gaussian2(correl, iy, ix):
+    c10 = 0.0
+    c01 = 0.0
+    c11 = 0.0
+    c20 = 0.0
+    c02 = 0.0
+    for j in range(-1, 2):
+        for i in range(-1, 2):
+            value = correl[iy + j, ix + i]
+            if value < 0:
+                value = 1e-6
+            log_value = np.log(value)
+            c10 += i * log_value
+            c01 += j * log_value
+            c11 += i * j * log_value
+            c20 += (3 * i ** 2 - 2) * log_value
+            c02 += (3 * j ** 2 - 2) * log_value
+    c10 /= 6
+    c01 /= 6
+    c11 /= 4
+    c20 /= 6
+    c02 /= 6
+    denom = 4 * c20 * c02 - c11 ** 2
+    deplx = (c11 * c01 - 2 * c10 * c02) / denom
+    deply = (c11 * c10 - 2 * c01 * c20) / denom
+    return deplx, deply
+
+
+def _compute_subpix(correl, iy, ix, method_subpix, nsubpix):
+    """Subpixel displacement (method_subpix: 1 centroid, 2 2d_gaussian2)"""
+    ny, nx = correl.shape
+    if (
+        iy - nsubpix < 0
+        or iy + nsubpix + 1 > ny
+        or ix - nsubpix < 0
+        or ix + nsubpix + 1 > nx
+    ):
+        return 0.0, 0.0, 3
+
+    limit = 2 * (0.5 + nsubpix) ** 2
+
+    if method_subpix == 2:
+        deplx, deply = _compute_2d_gaussian2(correl, iy, ix)
+        if deplx ** 2 + deply ** 2 > limit:
+            deplx, deply = _compute_centroid(correl, iy, ix, nsubpix)
+    else:
+        deplx, deply = _compute_centroid(correl, iy, ix, nsubpix)
+
+    if deplx ** 2 + deply ** 2 > limit:
+        return 0.0, 0.0, 4
+
+    return deplx, deply, 0
+
+
+def compute_displacements_multi(
+    correls,
+    norms,
+    mask,
+    ix0,
+    iy0,
+    particle_radius,
+    method_subpix,
+    nsubpix,
+    nb_threads,
+):
+    """Compute the displacements (with subpix) from a stack of correlations
+
+    Parameters
+    ----------
+
+    correls : float32[:, :, :]
+
+    norms : float32[:]
+
+    mask : bool[:, :]
+
+      Points excluded (for example because of displacement_max).
+
+    ix0, iy0 : int
+
+      Indices corresponding to no displacement.
+
+    particle_radius : int
+
+      Radius of the region excluded for the second search of the peak.
+
+    method_subpix : int
+
+      0: no subpix, 1: centroid, 2: 2d_gaussian2.
+
+    nsubpix : int
+
+    nb_threads : int
+
+      Number of OpenMP threads.
+
+    Returns
+    -------
+
+    dxs, dys, correls_max : float64[:]
+
+    errors : int32[:]
+
+    """
+    nb_correls = correls.shape[0]
+    dxs = np.empty(nb_correls)
+    dys = np.empty(nb_correls)
+    correls_max = np.empty(nb_correls)
+    errors = np.zeros(nb_correls, dtype=np.int32)
+    no_exclusion = -2 * particle_radius - 2
+
+    #omp parallel for num_threads(nb_threads)
+    for ivec in range(nb_correls):
+        correl = correls[ivec]
+        iy, ix, error = _find_peak(
+            correl, mask, no_exclusion, no_exclusion, particle_radius
+        )
+        if error != 0:
+            # second chance to find a better peak...
+            iy2, ix2, error2 = _find_peak(correl, mask, iy, ix, particle_radius)
+            if error2 == 0:
+                iy, ix, error = iy2, ix2, 0
+
+        norm = norms[ivec]
+        if norm == 0:
+            correls_max[ivec] = 0.0
+        else:
+            correls_max[ivec] = correl[iy, ix] / norm
+
+        deplx = 0.0
+        deply = 0.0
+        if error == 0 and method_subpix != 0:
+            deplx, deply, error = _compute_subpix(
+                correl, iy, ix, method_subpix, nsubpix
+            )
+
+        dxs[ivec] = ix0 - ix - deplx
+        dys[ivec] = iy0 - iy - deply
+        errors[ivec] = error
+
+    return dxs, dys, correls_max, errors
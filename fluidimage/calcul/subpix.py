@@ -9,7 +9,11 @@
 
 import numpy as np
 
-from .errors import PIVError
+from .errors import (
+    PIVError,
+    ERROR_SUBPIX_BOUNDARY,
+    ERROR_SUBPIX_WRONG,
+)
 
 from .subpix_pythran import compute_subpix_2d_gaussian2
 
@@ -170,3 +174,157 @@ class SubPix:
             )
 
         return deplx + ix, deply + iy
+
+    def compute_subpix_multi(self, correls, ixs, iys, method=None, nsubpix=None):
+        """Find the peaks of a stack of correlations (vectorized)
+
+        Parameters
+        ----------
+
+        correls: numpy.ndarray
+
+          Stack of correlations (shape ``(nb_correls, ny, nx)``)
+
+        ixs: numpy.ndarray of integers
+
+        iys: numpy.ndarray of integers
+
+        method: str {'centroid', '2d_gaussian', '2d_gaussian2', 'no_subpix'}
+
+        Returns
+        -------
+
+        ixs, iys : numpy.ndarray
+
+          Subpixel positions of the peaks (the integer positions for the
+          peaks with errors).
+
+        errors : numpy.ndarray
+
+          Integer error codes (see :mod:`fluidimage.calcul.errors`).
+
+        """
+        if method is None:
+            method = self.method
+        if nsubpix is None:
+            nsubpix = self.n
+
+        if method != self.method or nsubpix != self.n:
+            self.prepare_subpix(method, nsubpix)
+
+        if method not in self.methods:
+            raise ValueError("method has to be in {}".format(self.methods))
+
+        ixs = np.asarray(ixs, dtype=int)
+        iys = np.asarray(iys, dtype=int)
+
+        nb_correls, ny, nx = correls.shape
+
+        errors = np.zeros(nb_correls, dtype=np.int32)
+        deplxs = np.zeros(nb_correls)
+        deplys = np.zeros(nb_correls)
+
+        close_boundary = (
+            (iys - nsubpix < 0)
+            | (iys + nsubpix + 1 > ny)
+            | (ixs - nsubpix < 0)
+            | (ixs + nsubpix + 1 > nx)
+        )
+        errors[close_boundary] = ERROR_SUBPIX_BOUNDARY
+
+        ivecs = np.nonzero(~close_boundary)[0]
+
+        if method == "no_subpix" or ivecs.size == 0:
+            return ixs + deplxs, iys + deplys, errors
+
+        if method == "2d_gaussian2":
+            n = 1
+        else:
+            n = nsubpix
+
+        offsets = np.arange(-n, n + 1)
+        correls_crop = correls[
+            ivecs[:, None, None],
+            iys[ivecs, None, None] + offsets[None, :, None],
+            ixs[ivecs, None, None] + offsets[None, None, :],
+        ]
+
+        deplx, deply = self._compute_centroid_multi(correls_crop)
+
+        if method == "2d_gaussian":
+            deplx_gauss, deply_gauss = self._compute_2d_gaussian_multi(
+                correls_crop
+            )
+            ok = ~(np.isnan(deplx_gauss) | np.isnan(deply_gauss))
+            deplx[ok] = deplx_gauss[ok]
+            deply[ok] = deply_gauss[ok]
+
+        elif method == "2d_gaussian2":
+            deplx_gauss, deply_gauss = self._compute_2d_gaussian2_multi(
+                correls_crop
+            )
+            with np.errstate(invalid="ignore"):
+                ok = ~(
+                    deplx_gauss ** 2 + deply_gauss ** 2
+                    > 2 * (0.5 + nsubpix) ** 2
+                )
+            deplx[ok] = deplx_gauss[ok]
+            deply[ok] = deply_gauss[ok]
+
+        with np.errstate(invalid="ignore"):
+            wrong = deplx ** 2 + deply ** 2 > 2 * (0.5 + nsubpix) ** 2
+
+        deplx[wrong] = 0.0
+        deply[wrong] = 0.0
+        errors[ivecs[wrong]] = ERROR_SUBPIX_WRONG
+
+        deplxs[ivecs] = deplx
+        deplys[ivecs] = deply
+
+        return ixs + deplxs, iys + deplys, errors
+
+    def _compute_centroid_multi(self, correls_crop):
+        sum_correl = np.sum(correls_crop, axis=(1, 2))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deplx = np.sum(self.X_centroid * correls_crop, axis=(1, 2)) / sum_correl
+            deply = np.sum(self.Y_centroid * correls_crop, axis=(1, 2)) / sum_correl
+        return deplx, deply
+
+    def _compute_2d_gaussian_multi(self, correls_crop):
+        """Vectorized 2d_gaussian method (nan for the failing fits)"""
+        nb_correls = correls_crop.shape[0]
+        correls_map = correls_crop.reshape(nb_correls, -1).astype(np.float64)
+        correls_map[correls_map <= 0.0] = 1e-6
+        coefs = np.log(correls_map).dot(self.Minv_subpix.T)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sigmax2 = -1 / (2 * coefs[:, 0])
+            sigmay2 = -1 / (2 * coefs[:, 1])
+            deplx = coefs[:, 2] * sigmax2
+            deply = coefs[:, 3] * sigmay2
+
+        bad = (coefs[:, 0] > 0) | (coefs[:, 1] > 0)
+        deplx[bad] = np.nan
+        deply[bad] = np.nan
+        return deplx, deply
+
+    def _compute_2d_gaussian2_multi(self, correls_crop):
+        """Vectorized version of :func:`compute_subpix_2d_gaussian2`"""
+        correls_crop = np.where(correls_crop < 0, 1e-6, correls_crop)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logs = np.log(correls_crop.astype(np.float64))
+
+            # nsubpix == 1 for this method so the arrays have a shape (3, 3)
+            X = self.X_centroid
+            Y = self.Y_centroid
+
+            c10 = np.sum(X * logs, axis=(1, 2)) / 6
+            c01 = np.sum(Y * logs, axis=(1, 2)) / 6
+            c11 = np.sum(X * Y * logs, axis=(1, 2)) / 4
+            c20 = np.sum((3 * X ** 2 - 2) * logs, axis=(1, 2)) / 6
+            c02 = np.sum((3 * Y ** 2 - 2) * logs, axis=(1, 2)) / 6
+
+            denom = 4 * c20 * c02 - c11 ** 2
+            deplx = (c11 * c01 - 2 * c10 * c02) / denom
+            deply = (c11 * c10 - 2 * c01 * c20) / denom
+        return deplx, deply
@@ -11,7 +11,13 @@ from fluidimage.calcul.correl import (
     CorrelPythran,
     CorrelPyCuda,
     CorrelFFTBase,
+    CorrelFFTW,
+    CorrelFFTWMulti,
+    CorrelFFTWMultiPythran,
+    CorrelFFTNumpy,
 )
+from fluidimage.calcul.errors import PIVError, NO_ERROR
+from fluidimage.calcul import peaks_pythran
 
 # config_logging('debug')
 logger = logging.getLogger("fluidimage")
@@ -246,5 +252,155 @@ for k, cls in classes2.items():
 
     exec("TestCorrel2.test_correl_images_diff_sizes" + k + " = _test2")
 
+class TestCorrelMulti(unittest.TestCase):
+    """Compare the vectorized and the not vectorized functions."""
+
+    @classmethod
+    def setUpClass(cls):
+        nx = ny = 32
+        displacements = [(3.3, 5.8), (-2.1, 0.4), (0.0, 0.0), (6.7, -4.2)]
+        ims0 = []
+        ims1 = []
+        for displacement in displacements:
+            im0, im1 = make_synthetic_images(
+                np.array(displacement),
+                (nx // 4) ** 2,
+                shape_im0=(ny, nx),
+                epsilon=0.0,
+            )
+            ims0.append(im0)
+            ims1.append(im1)
+
+        cls.ims0 = np.array(ims0, dtype=np.float32)
+        cls.ims1 = np.array(ims1, dtype=np.float32)
+
+    def _compare(self, method_subpix, nsubpix=None, nb_peaks_to_search=1):
+        correl = CorrelFFTWMulti(
+            self.ims0.shape[1:],
+            self.ims1.shape[1:],
+            method_subpix=method_subpix,
+            nsubpix=nsubpix,
+            displacement_max="50%",
+            nb_peaks_to_search=nb_peaks_to_search,
+        )
+
+        correls, norms = correl(self.ims0, self.ims1)
+        dxs, dys, correls_max, errors, other_peaks = correl.compute_displacements_from_correls(
+            correls, norms
+        )
+        dxs_subpix, dys_subpix, errors_subpix = correl.apply_subpix_multi(
+            dxs, dys, correls
+        )
+
+        for ivec, c in enumerate(correls):
+            (
+                dx,
+                dy,
+                correl_max,
+                other_peaks_vec,
+            ) = correl.compute_displacements_from_correl(c, norms[ivec])
+            self.assertEqual(errors[ivec], NO_ERROR)
+            self.assertEqual((dx, dy), (dxs[ivec], dys[ivec]))
+            self.assertAlmostEqual(correl_max, correls_max[ivec], places=5)
+            if nb_peaks_to_search > 1:
+                self.assertEqual(
+                    len(other_peaks[ivec]), len(other_peaks_vec)
+                )
+                for peak, peak_vec in zip(other_peaks[ivec], other_peaks_vec):
+                    self.assertEqual(peak[:2], peak_vec[:2])
+                    self.assertAlmostEqual(peak[2], peak_vec[2], places=5)
+            else:
+                self.assertIsNone(other_peaks_vec)
+            try:
+                dx, dy = correl.apply_subpix(dx, dy, c)
+            except PIVError:
+                self.assertNotEqual(errors_subpix[ivec], NO_ERROR)
+            else:
+                self.assertEqual(errors_subpix[ivec], NO_ERROR)
+                self.assertAlmostEqual(dx, dxs_subpix[ivec], places=4)
+                self.assertAlmostEqual(dy, dys_subpix[ivec], places=4)
+
+        if nb_peaks_to_search > 1:
+            self.assertEqual(len(other_peaks), len(correls))
+            # the secondary peaks are really compared
+            self.assertTrue(any(other_peaks))
+        else:
+            self.assertIsNone(other_peaks)
+
+    def test_correl_maps(self):
+        shape = self.ims0.shape[1:]
+        correl_numpy = CorrelFFTNumpy(shape, shape)
+        correl_fftw = CorrelFFTW(shape, shape)
+        correl_multi = CorrelFFTWMulti(shape, shape)
+        correls, _ = correl_multi(self.ims0, self.ims1)
+        for im0, im1, c_multi in zip(self.ims0, self.ims1, correls):
+            c_numpy, _ = correl_numpy(im0, im1)
+            c_fftw, _ = correl_fftw(im0, im1)
+            c_numpy *= im0.size
+            self.assertTrue(np.allclose(c_fftw, c_numpy, atol=1e-2))
+            self.assertTrue(np.allclose(c_multi, c_numpy, atol=1e-2))
+
+    def test_centroid(self):
+        self._compare("centroid", nsubpix=1)
+
+    def test_2d_gaussian(self):
+        self._compare("2d_gaussian", nsubpix=1)
+
+    def test_2d_gaussian2(self):
+        self._compare("2d_gaussian2", nb_peaks_to_search=2)
+
+    def test_3_peaks(self):
+        self._compare("centroid", nsubpix=1, nb_peaks_to_search=3)
+
+    def test_pythran(self):
+        shape = self.ims0.shape[1:]
+        for method_subpix in ("centroid", "2d_gaussian2", "no_subpix"):
+            kwargs = dict(
+                method_subpix=method_subpix,
+                nsubpix=None,
+                displacement_max="50%",
+            )
+            correl_multi = CorrelFFTWMulti(shape, shape, **kwargs)
+            correl_pythran = CorrelFFTWMultiPythran(shape, shape, **kwargs)
+            correls, norms = correl_multi(self.ims0, self.ims1)
+            # nan touching some peaks (second chance) and in a subpix crop
+            ixs, iys = correl_multi.compute_indices_from_displacement(
+                *correl_multi.compute_displacements_from_correls(
+                    correls.copy(), norms
+                )[:2]
+            )
+            ixs = ixs.astype(int)
+            iys = iys.astype(int)
+            correls[0, iys[0] + 1, ixs[0] + 1] = np.nan
+            correls[1, iys[1], ixs[1] + 1] = np.nan
+
+            results = correl_multi.compute_displacements_subpix_from_correls(
+                correls.copy(), norms
+            )
+            results_pythran = correl_pythran.compute_displacements_subpix_from_correls(
+                correls.copy(), norms
+            )
+            results_kernel = peaks_pythran.compute_displacements_multi(
+                correls.astype(np.float32),
+                norms.astype(np.float32),
+                correl_pythran._mask,
+                int(correl_pythran.ix0),
+                int(correl_pythran.iy0),
+                int(correl_pythran.particle_radius),
+                correl_pythran._codes_method_subpix[method_subpix],
+                int(correl_pythran.subpix.n),
+                1,
+            )
+            for arr, arr_pythran, arr_kernel in zip(
+                results[:4], results_pythran[:4], results_kernel
+            ):
+                self.assertTrue(
+                    np.allclose(arr, arr_pythran, atol=1e-4, equal_nan=True)
+                )
+                self.assertTrue(
+                    np.allclose(arr, arr_kernel, atol=1e-4, equal_nan=True)
+                )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from fluidimage.calcul.deform import (
+    compute_interp_matrices,
+    compute_dense_field,
+    deform_images,
+)
+
+
+class TestDeform(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.shape = (60, 80)
+        cls.ixvecs = np.array([5, 20, 35, 50, 65, 75])
+        cls.iyvecs = np.array([5, 20, 35, 50, 55])
+        iyvecs_grid, ixvecs_grid = np.meshgrid(cls.iyvecs, cls.ixvecs)
+        cls.ixvecs_grid = ixvecs_grid.flatten()
+        cls.iyvecs_grid = iyvecs_grid.flatten()
+
+    def test_dense_field(self):
+        def func(x, y):
+            return 0.1 * x - 0.05 * y + 1
+
+        values = func(self.ixvecs_grid, self.iyvecs_grid)
+        iys, ixs = np.mgrid[: self.shape[0], : self.shape[1]]
+        field_exact = func(ixs, iys)
+        # inside the grid
+        inside = (slice(5, 56), slice(5, 76))
+        for method in ("linear", "cubic"):
+            matrices = compute_interp_matrices(
+                self.ixvecs, self.iyvecs, self.shape, method
+            )
+            field = compute_dense_field(
+                values, self.ixvecs, self.iyvecs, matrices
+            )
+            self.assertEqual(field.shape, self.shape)
+            self.assertTrue(
+                np.allclose(field[inside], field_exact[inside], atol=1e-4)
+            )
+
+        # with the gradients, the linear extrapolation is exact
+        gradients = (
+            0.1 * np.ones(values.size),
+            -0.05 * np.ones(values.size),
+        )
+        field = compute_dense_field(
+            values,
+            self.ixvecs,
+            self.iyvecs,
+            compute_interp_matrices(self.ixvecs, self.iyvecs, self.shape),
+            gradients,
+        )
+        self.assertTrue(np.allclose(field[inside], field_exact[inside]))
+
+    def test_deform_images(self):
+        iys, ixs = np.mgrid[: self.shape[0], : self.shape[1]]
+
+        def func(x, y):
+            return np.sin(x / 5) * np.cos(y / 7)
+
+        dx, dy = 1.4, -0.6
+        im0 = func(ixs, iys)
+        im1 = func(ixs - dx, iys - dy)
+        deltaxs = dx * np.ones(self.shape, dtype=np.float32)
+        deltays = dy * np.ones(self.shape, dtype=np.float32)
+        # the deformed images are both equal to func(ixs - dx/2, iys - dy/2)
+        im0_deformed, im1_deformed = deform_images(
+            im0, im1, deltaxs, deltays, "cubic"
+        )
+        inside = (slice(5, -5), slice(5, -5))
+        self.assertTrue(
+            np.allclose(im0_deformed[inside], im1_deformed[inside], atol=1e-2)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,17 @@
 import unittest
 import numpy as np
 from time import time
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from threading import Thread
 
+from fluidimage.calcul import fft
 from fluidimage.calcul.correl import FFTW2DReal2Complex, CUFFT2DReal2Complex
+from fluidimage.calcul.fft import (
+    FFTWMulti2DReal2Complex,
+    load_wisdom,
+    save_wisdom,
+)
 
 # from scipy.misc import lena
 # from correl import calcul_correl_norm_scipy, CorrelWithFFT
@@ -55,6 +64,65 @@ class TestFFTW2DReal2Complex(unittest.TestCase):
 
         self.compute_and_check(func_fft, op)
 
+    def test_not_normalized(self):
+        """The transforms are not normalized (whatever the pyfftw version)"""
+        op = FFTW2DReal2Complex(4, 2)
+        ff = np.ones(op.shapeX, dtype=op.type_real)
+        ff_fft = op.fft(ff)
+        self.assertAlmostEqual(ff_fft[0, 0].real, op.coef_norm)
+        self.assertTrue(np.allclose(op.ifft(ff_fft), op.coef_norm))
+
+    def test_plans_cache(self):
+        op0 = FFTW2DReal2Complex(8, 6)
+        op1 = FFTW2DReal2Complex(8, 6)
+        self.assertIs(op0.fftplan, op1.fftplan)
+        self.assertIs(op0.ifftplan, op1.ifftplan)
+
+        op_multi = FFTWMulti2DReal2Complex(8, 6, 3)
+        self.assertIsNot(op0.fftplan, op_multi.fftplan)
+
+        func = np.random.random(op_multi.shapeX).astype(op_multi.type_real)
+        func_fft = op_multi.fft(func)
+        self.assertTrue(np.allclose(func_fft[1], op0.fft(func[1]), atol=1e-5))
+
+    def test_plans_threads(self):
+        op = FFTW2DReal2Complex(8, 6)
+        plans = {}
+
+        def get_plan():
+            plans["thread"] = op.fftplan
+
+        thread = Thread(target=get_plan)
+        thread.start()
+        thread.join()
+        self.assertIsNot(plans["thread"], op.fftplan)
+
+    def test_plans_cache_limit(self):
+        plans = {}
+
+        def get_plans():
+            plans["first"] = FFTW2DReal2Complex(8, 6).fftplan
+            for nb_arrays in range(1, fft.nb_max_plans + 1):
+                FFTWMulti2DReal2Complex(8, 6, nb_arrays)
+            plans["local"] = fft._local_plans.plans
+            plans["last"] = FFTW2DReal2Complex(8, 6).fftplan
+
+        thread = Thread(target=get_plans)
+        thread.start()
+        thread.join()
+        self.assertLessEqual(len(plans["local"]), fft.nb_max_plans)
+        # the least recently used plans have been discarded
+        self.assertIsNot(plans["last"], plans["first"])
+
+    def test_wisdom(self):
+        FFTW2DReal2Complex(10, 12)
+        with TemporaryDirectory() as path_dir:
+            path = Path(path_dir) / "fftw_wisdom.npz"
+            self.assertFalse(load_wisdom(path))
+            save_wisdom(path)
+            self.assertTrue(path.exists())
+            self.assertTrue(load_wisdom(path))
+
     def compute_and_check(self, func_fft, op):
 
         energyK = op.compute_energy_from_Fourier(func_fft)
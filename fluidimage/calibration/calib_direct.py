@@ -10,6 +10,7 @@
    :private-members:
 
 """
+import os
 import glob
 from math import sqrt
 import warnings
@@ -155,29 +156,15 @@ class CalibDirect:
         x, y = np.meshgrid(xtmp, ytmp)
         x = x.transpose()
         y = y.transpose()
-        V = np.zeros((x.shape[0], x.shape[1], 6))
-
-        xtrue = []
-        ytrue = []
-        vtrue = []
-        xfalse = []
-        yfalse = []
-        indi = []
-        indj = []
-
-        for i in range(x.shape[0]):
-            for j in range(x.shape[1]):
-                tmp = self.pixel2line(x[i, j], y[i, j])
-                if np.isnan(tmp[0]):
-                    xfalse.append(x[i, j])
-                    yfalse.append(y[i, j])
-                    indi.append(i)
-                    indj.append(j)
-                else:
-                    V[i, j, :] = tmp
-                    xtrue.append(x[i, j])
-                    ytrue.append(y[i, j])
-                    vtrue.append(tmp)
+        V = self.pixels2lines(x, y)
+
+        isnan = np.isnan(V[:, :, 0])
+        xtrue = x[~isnan]
+        ytrue = y[~isnan]
+        vtrue = V[~isnan]
+        xfalse = x[isnan]
+        yfalse = y[isnan]
+        indi, indj = np.nonzero(isnan)
 
         if test:
             titles = ["X0", "Y0", "Z0", "dx", "dy", "dz"]
@@ -199,17 +186,27 @@ class CalibDirect:
             pylab.colorbar()
             plt.show()
 
-        vtrue = np.array(vtrue)
-        for j in range(6):
-            V[indi, indj, j] = griddata(
-                (xtrue, ytrue), vtrue[:, j], (xfalse, yfalse)
-            )
+        if xfalse.size:
+            V[indi, indj] = griddata((xtrue, ytrue), vtrue, (xfalse, yfalse))
+
+        self.lines_xs = xtmp
+        self.lines_ys = ytmp
+        self.lines = V
+        self._init_interp_lines()
 
-        interp = []
-        for i in range(6):
-            interp.append(RegularGridInterpolator((xtmp, ytmp), V[:, :, i]))
+    def _init_interp_lines(self):
+        self.interp_lines = RegularGridInterpolator(
+            (self.lines_xs, self.lines_ys), self.lines
+        )
+
+    def get_lines(self, indx, indy):
+        """Interpolate the parameters of the optical paths for pixels
 
-        self.interp_lines = interp
+        Returns an array of shape ``indx.shape + (6,)`` (x0, y0, z0, dx, dy,
+        dz).
+
+        """
+        return self.interp_lines((indx, indy))
 
     def pixel2line(self, indx, indy):
         """Compute parameters of the optical path for a pixel
@@ -218,66 +215,110 @@ class CalibDirect:
         dz.
 
         """
+        return self.pixels2lines(np.array([indx]), np.array([indy]))[0]
+
+    def pixels2lines(self, indx, indy):
+        """Compute parameters of the optical paths for arrays of pixels
+
+        All levels are evaluated for all pixels at once and the lines are
+        fitted (principal direction of the points of the different levels)
+        with a stacked SVD. Returns an array of shape ``indx.shape + (6,)``
+        (x0, y0, z0, dx, dy, dz), with NaN for the pixels seen by less than 2
+        levels.
+
+        """
+        indx = np.asarray(indx, dtype=float)
+        indy = np.asarray(indy, dtype=float)
+        shape = indx.shape
+        indx = indx.ravel()
+        indy = indy.ravel()
+
         interp = self.interp_levels
-        X = []
-        Y = []
-        Z = interp.Z
-        for i in range(len(Z)):
-            X.append((interp.indices_pixel2xphys[i]((indx, indy))))
-            Y.append((interp.indices_pixel2yphys[i]((indx, indy))))
-        X = np.array(X)
-        Y = np.array(Y)
-        XYZ = np.vstack([X, Y, Z]).transpose()
+        nb_levels = len(interp.Z)
+        # points of the levels: shape (nb_pixels, nb_levels, 3)
+        XYZ = np.empty((indx.size, nb_levels, 3))
+        for i in range(nb_levels):
+            XYZ[:, i, 0] = interp.indices_pixel2xphys[i]((indx, indy))
+            XYZ[:, i, 1] = interp.indices_pixel2yphys[i]((indx, indy))
+            XYZ[:, i, 2] = interp.Z[i]
+
+        valid = ~np.isnan(XYZ[:, :, 0] + XYZ[:, :, 1])
+        XYZ[~valid] = np.nan
         with warnings.catch_warnings():
             warnings.simplefilter("ignore", category=RuntimeWarning)
-            XYZ0 = np.nanmean(XYZ, 0)
-        XYZ -= XYZ0
-        ind = ~np.isnan(X + Y)
-        XYZ = XYZ[ind, :]
-        if XYZ.shape[0] > 1:
-            arg = np.argsort(XYZ[:, 2])
-            XYZ = XYZ[arg, :]
-            u, s, v = np.linalg.svd(XYZ, full_matrices=True, compute_uv=1)
-            direction = np.cross(v[-1, :], v[-2, :])
-            if direction[2] < 0:
-                direction = -direction
-            return np.hstack([XYZ0, direction])
-
-        else:
-            return np.hstack([np.nan] * 6)
+            XYZ0 = np.nanmean(XYZ, 1)
+        XYZ -= XYZ0[:, np.newaxis, :]
+        # the rows of zeros do not change the right singular vectors
+        XYZ[~valid] = 0.0
+
+        lines = np.full((indx.size, 6), np.nan)
+        fitted = valid.sum(1) > 1
+        if fitted.any():
+            u, s, v = np.linalg.svd(XYZ[fitted], full_matrices=False)
+            direction = v[:, 0, :]
+            direction[direction[:, 2] < 0] *= -1
+            lines[fitted, :3] = XYZ0[fitted]
+            lines[fitted, 3:] = direction
+
+        return lines.reshape(shape + (6,))
 
     def save(self, pth_file):
         """Save calibration
+
+        The parameters of the optical paths on the grid of pixels are saved in
+        a compact numpy file (npz format). As with :func:`numpy.save`, the
+        extension ".npy" is appended to the path if it is not already there.
+
         """
-        np.save(
-            pth_file,
-            [
-                self.interp_lines,
-                self.paths_xml,
-                self.nb_pixels_x,
-                self.nb_pixels_y,
-            ],
-        )
+        pth_file = os.fspath(pth_file)
+        if not pth_file.endswith(".npy"):
+            pth_file += ".npy"
+        with open(pth_file, "wb") as file:
+            np.savez(
+                file,
+                lines=self.lines,
+                xs=self.lines_xs,
+                ys=self.lines_ys,
+                paths_xml=np.array(self.paths_xml, dtype=str),
+                nb_pixels=np.array([self.nb_pixels_x, self.nb_pixels_y]),
+            )
 
     def load(self, pth_file):
         """Load calibration
         """
-        tmp = np.load(pth_file)
-        self.interp_lines = tmp[0]
+        with open(pth_file, "rb") as file:
+            is_npz = file.read(4) == b"PK\x03\x04"
+
+        if not is_npz:
+            self._load_pickled(pth_file)
+            return
+
+        with np.load(pth_file) as data:
+            self.lines = data["lines"]
+            self.lines_xs = data["xs"]
+            self.lines_ys = data["ys"]
+            self.paths_xml = list(data["paths_xml"])
+            self.nb_pixels_x, self.nb_pixels_y = (
+                int(n) for n in data["nb_pixels"]
+            )
+        self._init_interp_lines()
+
+    def _load_pickled(self, pth_file):
+        """Load a calibration saved with pickled interpolators (old format)"""
+        tmp = np.load(pth_file, allow_pickle=True)
+        interp_lines = tmp[0]
+        self.lines_xs, self.lines_ys = interp_lines[0].grid
+        self.lines = np.stack([interp.values for interp in interp_lines], -1)
         self.paths_xml = tmp[1]
         self.nb_pixels_x = tmp[2]
         self.nb_pixels_y = tmp[3]
+        self._init_interp_lines()
 
     def intersect_with_plane(self, indx, indy, a, b, c, d):
         """Find intersection with the line associated to the pixel  indx, indy
         and a plane defined by ax + by + cz + d = 0
         """
-        x0 = self.interp_lines[0]((indx, indy))
-        y0 = self.interp_lines[1]((indx, indy))
-        z0 = self.interp_lines[2]((indx, indy))
-        dx = self.interp_lines[3]((indx, indy))
-        dy = self.interp_lines[4]((indx, indy))
-        dz = self.interp_lines[5]((indx, indy))
+        x0, y0, z0, dx, dy, dz = np.moveaxis(self.get_lines(indx, indy), -1, 0)
         # fmt: off
         t = -(a*x0 + b*y0 + c*z0 + d) / (a*dx + b*dy + c*dz)
         # fmt: on
@@ -302,9 +343,8 @@ class CalibDirect:
             indx = range(self.nb_pixels_x // 2 - 20, self.nb_pixels_x // 2 + 20)
             indy = range(self.nb_pixels_y // 2 - 20, self.nb_pixels_y // 2 + 20)
             indx, indy = np.meshgrid(indx, indy)
-        dx = np.nanmean(self.interp_lines[3]((indx, indy)))
-        dy = np.nanmean(self.interp_lines[4]((indx, indy)))
-        dz = np.nanmean(self.interp_lines[5]((indx, indy)))
+        lines = self.get_lines(indx, indy)
+        dx, dy, dz = (np.nanmean(lines[..., i]) for i in range(3, 6))
         A, B = get_base_from_normal_vector(dx, dy, dz)
         return A, B
 
@@ -349,13 +389,9 @@ class CalibDirect:
         x, y = np.meshgrid(x, y)
         x = x.flatten()
         y = y.flatten()
+        lines = self.get_lines(x, y)
         for i in range(len(x)):
-            X0 = self.interp_lines[0]((x[i], y[i]))
-            Y0 = self.interp_lines[1]((x[i], y[i]))
-            Z0 = self.interp_lines[2]((x[i], y[i]))
-            dx = self.interp_lines[3]((x[i], y[i]))
-            dy = self.interp_lines[4]((x[i], y[i]))
-            dz = self.interp_lines[5]((x[i], y[i]))
+            X0, Y0, Z0, dx, dy, dz = lines[i]
             X = (np.arange(10) - 5) / 20.0 * dx + X0
             Y = (np.arange(10) - 5) / 20.0 * dy + Y0
             Z = (np.arange(10) - 5) / 20.0 * dz + Z0
@@ -372,21 +408,7 @@ class CalibDirect:
         y = range(0, self.nb_pixels_y, self.nb_pixels_y // number)
         x, y = np.meshgrid(x, y)
 
-        X0 = np.zeros(x.shape)
-        Y0 = np.zeros(x.shape)
-        Z0 = np.zeros(x.shape)
-        dx = np.zeros(x.shape)
-        dy = np.zeros(x.shape)
-        dz = np.zeros(x.shape)
-
-        for i in range(x.shape[0]):
-            for j in range(x.shape[1]):
-                X0[i, j] = self.interp_lines[0]((x[i, j], y[i, j]))
-                Y0[i, j] = self.interp_lines[1]((x[i, j], y[i, j]))
-                Z0[i, j] = self.interp_lines[2]((x[i, j], y[i, j]))
-                dx[i, j] = self.interp_lines[3]((x[i, j], y[i, j]))
-                dy[i, j] = self.interp_lines[4]((x[i, j], y[i, j]))
-                dz[i, j] = self.interp_lines[5]((x[i, j], y[i, j]))
+        X0, Y0, Z0, dx, dy, dz = np.moveaxis(self.get_lines(x, y), -1, 0)
 
         pylab.figure()
         pylab.pcolor(x, y, X0)
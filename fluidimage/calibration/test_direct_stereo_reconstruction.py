@@ -1,6 +1,9 @@
 import unittest
 import os
+from tempfile import TemporaryDirectory
+from pathlib import Path
 
+import numpy as np
 import h5py
 import matplotlib.pyplot as plt
 
@@ -19,10 +22,10 @@ def get_piv_field(path):
             keyspiv = [key for key in f.keys() if key.startswith("piv")]
             keyspiv.sort()
             key = keyspiv[-1]
-            X = f[key]["xs"].value
-            Y = f[key]["ys"].value
-            dx = f[key]["deltaxs_final"].value
-            dy = f[key]["deltays_final"].value
+            X = f[key]["xs"][()]
+            Y = f[key]["ys"][()]
+            dx = f[key]["deltaxs_final"][()]
+            dy = f[key]["deltays_final"][()]
     except Exception:
         print(path)
         raise
@@ -30,9 +33,95 @@ def get_piv_field(path):
     return X, Y, dx, dy
 
 
+def pixel2line_svd(calib, indx, indy):
+    """Fit the optical path of one pixel (SVD on the points of the levels
+    seeing the pixel)"""
+    interp = calib.interp_levels
+    XYZ = []
+    for i, z in enumerate(interp.Z):
+        x = interp.indices_pixel2xphys[i]((indx, indy))
+        y = interp.indices_pixel2yphys[i]((indx, indy))
+        if not np.isnan(x + y):
+            XYZ.append((x, y, z))
+    if len(XYZ) < 2:
+        return np.full(6, np.nan)
+    XYZ = np.array(XYZ)
+    XYZ0 = XYZ.mean(0)
+    u, s, v = np.linalg.svd(XYZ - XYZ0)
+    direction = v[0]
+    if direction[2] < 0:
+        direction = -direction
+    return np.hstack([XYZ0, direction])
+
+
 class TestCalib(unittest.TestCase):
     """Test fluidimage.calibration DirectStereoReconstruction, CalibDirect."""
 
+    def test_pixels2lines(self):
+        """Compare the vectorized and the per-pixel fits of the optical paths,
+        and the saved and loaded calibrations"""
+        path_cam1 = pathbase / "E_Calibration_Images" / "Camera_01"
+        calib = CalibDirect(path_cam1 / "img*", (1024, 1024))
+        calib.compute_interpolents()
+
+        indx, indy = np.meshgrid(
+            np.linspace(0, 1024, 128), np.linspace(0, 1024, 128)
+        )
+        lines = calib.pixels2lines(indx, indy)
+        self.assertEqual(lines.shape, indx.shape + (6,))
+
+        interp = calib.interp_levels
+        nb_levels_seeing = sum(
+            ~np.isnan(interp.indices_pixel2xphys[i]((indx, indy)))
+            for i in range(len(interp.Z))
+        )
+        # some pixels are seen by only some levels
+        partial = (nb_levels_seeing > 1) & (nb_levels_seeing < len(interp.Z))
+        self.assertTrue(partial.any())
+
+        # a subset of all pixels and all the pixels seen by some levels
+        checked = np.zeros_like(partial)
+        checked[::7, ::7] = True
+        for iy, ix in zip(*np.nonzero(checked | partial)):
+            line = pixel2line_svd(calib, indx[iy, ix], indy[iy, ix])
+            self.assertTrue(np.allclose(lines[iy, ix], line, equal_nan=True))
+        self.assertTrue(np.isnan(lines[nb_levels_seeing < 2]).all())
+        self.assertTrue(
+            np.allclose(
+                calib.pixel2line(100.5, 600.0),
+                pixel2line_svd(calib, 100.5, 600.0),
+            )
+        )
+
+        calib.compute_interpolents_pixel2line(16, 16)
+        with TemporaryDirectory() as path_dir:
+            # ".npy" is appended (as with np.save)
+            calib.save(Path(path_dir) / "calib")
+            calib_loaded = CalibDirect(path_file=Path(path_dir) / "calib.npy")
+
+        for key in ("lines", "lines_xs", "lines_ys"):
+            self.assertTrue(
+                np.allclose(
+                    getattr(calib_loaded, key),
+                    getattr(calib, key),
+                    rtol=0,
+                    atol=0,
+                    equal_nan=True,
+                )
+            )
+        self.assertEqual(calib_loaded.paths_xml, calib.paths_xml)
+        self.assertEqual(
+            (calib_loaded.nb_pixels_x, calib_loaded.nb_pixels_y),
+            (calib.nb_pixels_x, calib.nb_pixels_y),
+        )
+        self.assertTrue(
+            np.allclose(
+                calib_loaded.get_lines(indx[:10, :10], indy[:10, :10]),
+                calib.get_lines(indx[:10, :10], indy[:10, :10]),
+                equal_nan=True,
+            )
+        )
+
     def test(self):
 
         path_cam1 = pathbase / "E_Calibration_Images" / "Camera_01"
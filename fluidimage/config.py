@@ -3,6 +3,17 @@ import os
 from configparser import ConfigParser
 
 
+def get_path_dir_config():
+    """Return the path of the directory where fluidimage saves its files
+
+    (for example the fftw wisdom). The directory is ``~/.fluidimage`` and it
+    is not created by this function.
+
+    """
+    home = os.path.expanduser("~")
+    return os.path.join(home, ".fluidimage")
+
+
 def get_config():
     config = ConfigParser()
 
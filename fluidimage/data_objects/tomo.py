@@ -37,8 +37,14 @@ class ArrayTomoBase:
     """
 
     _keys_to_save = ["xs", "ys", "zs", "I"]
+    _keys_to_save_sparse = ["xs", "ys", "zs", "indices_active", "I_active"]
     _attrs_to_save = ["nx", "ny", "nz"]
 
+    #: Flat indices of the active (non-zero) voxels (sparse representation)
+    indices_active = None
+    #: Intensities of the active voxels (sparse representation)
+    I_active = None
+
     def __init__(
         self,
         xlims=(0, 10),
@@ -135,7 +141,11 @@ class ArrayTomoBase:
 
         with h5py.File(h5file_path) as f:
             grp = f["tomo"]
-            for k in self._keys_to_save:
+            if grp.attrs.get("sparse", False):
+                keys = self._keys_to_save_sparse
+            else:
+                keys = self._keys_to_save
+            for k in keys:
                 setattr(self, k, grp[k][...])
             for attr in self._attrs_to_save:
                 setattr(self, attr, grp.attrs[attr])
@@ -169,21 +179,79 @@ class ArrayTomoBase:
             raise
         return f, dset, h5file_path
 
+    def open_dataset_chunked(
+        self, chunk_size, h5file_path=None, tag="tomo", key="I"
+    ):
+        """Open (or create) the HDF5 file to update the intensities in place.
+
+        If the file does not exist, it is created with a chunked dataset for
+        the (flattened) intensities, filled with ones. Since ones is the fill
+        value of the dataset, a chunk is only written to the disk when it is
+        modified.
+
+        Returns
+        -------
+        f : h5py.File
+            The file opened in read/write mode (to be closed by the caller)
+
+        dset : h5py.Dataset
+            The intensities
+
+        """
+        if h5file_path is None:
+            h5file_path = self.h5file_path
+
+        if os.path.exists(h5file_path):
+            f = h5py.File(h5file_path, "r+")
+            return f, f[tag][key]
+
+        os.makedirs(os.path.dirname(h5file_path), exist_ok=True)
+        f = h5py.File(h5file_path, "w")
+        self._save_in_hdf5_object(
+            f, tag, keys=[k for k in self._keys_to_save if k != key]
+        )
+        nb_voxels = self.nx * self.ny * self.nz
+        dset = f[tag].create_dataset(
+            key,
+            shape=(nb_voxels,),
+            dtype=self.dtype,
+            chunks=(max(1, min(chunk_size, nb_voxels, 2 ** 24)),),
+            fillvalue=1,
+        )
+        return f, dset
+
     def _get_name(self):
         return os.path.splitext(os.path.basename(self.image_path))[0] + ".h5"
 
     def save(self, path=None, sparse=False):
+        """Save in a HDF5 file. With `sparse=True`, only the active voxels are
+        saved (`indices_active` and `I_active`).
+
+        """
         if path is None:
             path = self.h5file_path
             os.makedirs(os.path.dirname(path), exist_ok=True)
 
         if sparse:
-            raise NotImplementedError("Save the intensity values as sparse")
+            if self.indices_active is None:
+                raise ValueError("No sparse representation of the intensities")
+            keys = self._keys_to_save_sparse
+        else:
+            keys = None
 
         with h5py.File(path, "w") as f:
-            self._save_in_hdf5_object(f)
+            self._save_in_hdf5_object(f, keys=keys)
+            f["tomo"].attrs["sparse"] = sparse
 
-    def _save_in_hdf5_object(self, f, tag="tomo"):
+    def get_dense_intensities(self):
+        """Compute the (flattened) intensities from the active voxels."""
+        intensities = np.zeros(
+            self.nx * self.ny * self.nz, dtype=self.I_active.dtype
+        )
+        intensities[self.indices_active] = self.I_active
+        return intensities
+
+    def _save_in_hdf5_object(self, f, tag="tomo", keys=None):
         if "class_name" not in f.attrs.keys():
             f.attrs["class_name"] = self.__class__.__name__
             f.attrs["module_name"] = self.__module__
@@ -200,7 +268,10 @@ class ArrayTomoBase:
         for attr in self._attrs_to_save:
             grp.attrs[attr] = getattr(self, attr)
 
-        for k in self._keys_to_save:
+        if keys is None:
+            keys = self._keys_to_save
+
+        for k in keys:
             data = getattr(self, k)
             print(f"Saving {type(data)} {k}...")
             if isinstance(data, da.core.Array):
@@ -281,19 +352,46 @@ class ArrayTomoCV(ArrayTomoBase):
 
     """
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        grid = (
-            np.vstack(np.meshgrid(self.zs, self.ys, self.xs, indexing="ij"))
-            .reshape(3, -1)
-            .T
-        )
+    _grid = None
+    _I = None
+
+    @property
+    def grid(self):
+        """Coordinates (x, y, z) of the voxels (computed when needed)."""
+        if self._grid is None:
+            self._grid = self.get_grid()
+        return self._grid
+
+    @grid.setter
+    def grid(self, value):
+        self._grid = value
+
+    @property
+    def I(self):
+        """Intensities of the voxels (ones when not loaded)."""
+        if self._I is None:
+            if self.indices_active is not None:
+                self._I = self.get_dense_intensities()
+            else:
+                self._I = np.ones(self.nx * self.ny * self.nz)
+        return self._I
 
-        # Swap columns to make it back to x, y ,z
-        self.grid = np.empty_like(grid)
-        self.grid[:, 0] = grid[:, 2]
-        self.grid[:, 1] = grid[:, 1]
-        self.grid[:, 2] = grid[:, 0]
+    @I.setter
+    def I(self, value):
+        self._I = value
 
-        if "h5file_path" not in kwargs:
-            self.I = np.ones(len(self.grid))
+    def get_grid(self, start=0, stop=None):
+        """Compute the coordinates of the voxels ``start:stop`` of the flattened
+        array (without computing the whole grid).
+
+        """
+        nx, ny, nz = map(len, (self.xs, self.ys, self.zs))
+        if stop is None:
+            stop = nx * ny * nz
+        # z varies the slowest and x the fastest
+        iz, iy, ix = np.unravel_index(np.arange(start, stop), (nz, ny, nx))
+        grid = np.empty((stop - start, 3), dtype=self.xs.dtype)
+        grid[:, 0] = self.xs[ix]
+        grid[:, 1] = self.ys[iy]
+        grid[:, 2] = self.zs[iz]
+        return grid
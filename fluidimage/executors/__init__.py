@@ -20,6 +20,7 @@ an executor compared to another.
    exec_async_sequential
    multi_exec_async
    exec_async_multiproc
+   exec_async_pool
    exec_async_servers
    servers
 
@@ -30,11 +31,13 @@ from .base import ExecutorBase
 from .exec_sequential import ExecutorSequential
 from .exec_async import ExecutorAsync
 from .exec_async_sequential import ExecutorAsyncSequential
-from .multi_exec_async import MultiExecutorAsync
+from .multi_exec_async import MultiExecutorAsync, MultiExecutorAsyncWorkStealing
 from .exec_async_multiproc import ExecutorAsyncMultiproc
+from .exec_async_pool import ExecutorAsyncPool
 from .exec_async_servers import (
     ExecutorAsyncServers,
     ExecutorAsyncServersThreading,
+    ExecutorAsyncServersSocket,
 )
 
 executors = {
@@ -42,9 +45,12 @@ executors = {
     "exec_async": ExecutorAsync,
     "exec_async_sequential": ExecutorAsyncSequential,
     "multi_exec_async": MultiExecutorAsync,
+    "multi_exec_async_stealing": MultiExecutorAsyncWorkStealing,
     "exec_async_multi": ExecutorAsyncMultiproc,
+    "exec_async_pool": ExecutorAsyncPool,
     "exec_async_servers": ExecutorAsyncServers,
     "exec_async_servers_threading": ExecutorAsyncServersThreading,
+    "exec_async_servers_socket": ExecutorAsyncServersSocket,
 }
 
 __all__ = ["ExecutorBase", "executors"]
@@ -11,6 +11,11 @@ This means that the work will run on one CPU at a time, except if the topology
 uses compiled code releasing the GIL. In this case, the GIL can be bypassed and
 computation can use many CPU at a time.
 
+The async functions do not poll the queues: they wait for a trio event set
+each time a queue of the topology changes (see
+:func:`fluidimage.topologies.base.Queue.set_callback_change`) or the number
+of working workers changes.
+
 .. autoclass:: ExecutorAsync
    :members:
    :private-members:
@@ -35,6 +40,9 @@ class ExecutorAsync(ExecutorBase):
 
     """
 
+    #: Maximum waiting time (in s) of the async functions without notification
+    time_wait_max = 0.5
+
     def __init__(
         self,
         topology,
@@ -54,6 +62,10 @@ class ExecutorAsync(ExecutorBase):
             stop_if_error=stop_if_error,
         )
 
+        self._event_change = trio.Event()
+        for queue in self.topology.queues:
+            queue.set_callback_change(self._notify_change)
+
         self.nb_working_workers_cpu = 0
         self.nb_working_workers_io = 0
 
@@ -94,6 +106,43 @@ class ExecutorAsync(ExecutorBase):
         trio.run(self.start_async_works)
         self._finalize_compute()
 
+    @property
+    def nb_working_workers_cpu(self):
+        """Number of cpu works in progress"""
+        return self._nb_working_workers_cpu
+
+    @nb_working_workers_cpu.setter
+    def nb_working_workers_cpu(self, value):
+        self._nb_working_workers_cpu = value
+        self._notify_change()
+
+    @property
+    def nb_working_workers_io(self):
+        """Number of io works in progress"""
+        return self._nb_working_workers_io
+
+    @nb_working_workers_io.setter
+    def nb_working_workers_io(self, value):
+        self._nb_working_workers_io = value
+        self._notify_change()
+
+    def _notify_change(self):
+        """Wake up the async functions waiting in :func:`_wait_for_change`."""
+        self._event_change.set()
+        self._event_change = trio.Event()
+
+    async def _wait_for_change(self):
+        """Wait for a change of the queues or of the numbers of working workers.
+
+        The functions check their conditions before awaiting this coroutine,
+        so that no change can be missed. For safety (for example for
+        ``_has_to_stop`` set by a signal handler), the waiting time is limited
+        to ``time_wait_max``.
+
+        """
+        with trio.move_on_after(self.time_wait_max):
+            await self._event_change.wait()
+
     async def start_async_works(self):
         """Create a trio nursery and start all async functions.
 
@@ -121,12 +170,17 @@ class ExecutorAsync(ExecutorBase):
             if work.kind is not None and "global" in work.kind:
 
                 async def func(work=work):
+                    if isinstance(work.input_queue, tuple):
+                        input_queues = work.input_queue
+                    else:
+                        input_queues = (work.input_queue,)
+
                     while True:
                         while (
                             isinstance(work.input_queue, tuple)
                             and all(not q for q in work.input_queue)
                         ) or not work.input_queue:
-                            await trio.sleep(self.sleep_time)
+                            await self._wait_for_change()
                             if self._has_to_stop:
                                 return
                         t_start = time.time()
@@ -135,17 +189,22 @@ class ExecutorAsync(ExecutorBase):
                             + work.name_no_space
                             + f" (?). mem usage"
                         )
+                        lengths = [len(queue) for queue in input_queues]
                         work.func_or_cls(work.input_queue, work.output_queue)
                         if self._has_to_stop:
                             return
-                        await trio.sleep(self.sleep_time)
 
                         logger.info(
                             f"work {work.name_no_space} "
                             f"done in {time.time() - t_start:.3f} s"
                         )
 
-                        await trio.sleep(self.sleep_time)
+                        if lengths == [len(queue) for queue in input_queues]:
+                            # nothing has been taken from the input queues
+                            # (for example, a couple is not yet complete)
+                            await self._wait_for_change()
+                        else:
+                            await trio.sleep(0)
 
             # I/O
             elif work.kind is not None and (
@@ -174,9 +233,11 @@ class ExecutorAsync(ExecutorBase):
                 ):
                     if self._has_to_stop:
                         return
-                    await trio.sleep(self.sleep_time)
-                self.nursery.start_soon(self.async_run_work_io, work)
-                await trio.sleep(self.sleep_time)
+                    await self._wait_for_change()
+                # returns when the new task has taken its item
+                await self.nursery.start(
+                    self._start_work, self.async_run_work_io, work
+                )
 
         return func
 
@@ -195,12 +256,26 @@ class ExecutorAsync(ExecutorBase):
                 ):
                     if self._has_to_stop:
                         return
-                    await trio.sleep(self.sleep_time)
-                self.nursery.start_soon(self.async_run_work_cpu, work)
-                await trio.sleep(self.sleep_time)
+                    await self._wait_for_change()
+                # returns when the new task has taken its item
+                await self.nursery.start(
+                    self._start_work, self.async_run_work_cpu, work
+                )
 
         return func
 
+    async def _start_work(
+        self, async_run_work, *args, task_status=trio.TASK_STATUS_IGNORED
+    ):
+        """Start a work with "nursery.start".
+
+        The task continues without checkpoint until its first "await", so the
+        launching function is resumed after the work took its item.
+
+        """
+        task_status.started()
+        await async_run_work(*args)
+
     async def async_run_work_io(self, work):
         """Is destined to be started with a "trio.start_soon".
 
@@ -218,7 +293,7 @@ class ExecutorAsync(ExecutorBase):
         self.nb_working_workers_io += 1
 
         try:
-            key, obj = work.input_queue.pop_first_item()
+            key, obj = work.pop_input()
         except KeyError:
             self.nb_working_workers_io -= 1
             return
@@ -247,8 +322,7 @@ class ExecutorAsync(ExecutorBase):
                 f"done in {time.time() - t_start:.3f} s"
             )
 
-        if work.output_queue is not None:
-            work.output_queue[key] = ret
+        work.put_output(key, ret)
         self.nb_working_workers_io -= 1
 
     async def async_run_work_cpu(self, work):
@@ -268,7 +342,7 @@ class ExecutorAsync(ExecutorBase):
         self.nb_working_workers_cpu += 1
 
         try:
-            key, obj = work.input_queue.pop_first_item()
+            key, obj = work.pop_input()
         except KeyError:
             self.nb_working_workers_cpu -= 1
             return
@@ -297,8 +371,7 @@ class ExecutorAsync(ExecutorBase):
                 f"done in {time.time() - t_start:.3f} s"
             )
 
-        if work.output_queue is not None:
-            work.output_queue[key] = ret
+        work.put_output(key, ret)
         self.nb_working_workers_cpu -= 1
 
     async def update_has_to_stop(self):
@@ -320,6 +393,7 @@ class ExecutorAsync(ExecutorBase):
             if result:
                 self._has_to_stop = True
                 log_debug(f"has_to_stop!")
+                self._notify_change()
 
             if self.logging_level == "debug":
                 log_debug(f"self.topology.queues: {self.topology.queues}")
@@ -330,4 +404,5 @@ class ExecutorAsync(ExecutorBase):
                     f"self.nb_working_workers_io: {self.nb_working_workers_io}"
                 )
 
-            await trio.sleep(self.sleep_time)
+            if not self._has_to_stop:
+                await self._wait_for_change()
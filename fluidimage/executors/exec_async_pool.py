@@ -0,0 +1,373 @@
+"""Executor async/await + pool of processes (:mod:`fluidimage.executors.exec_async_pool`)
+=========================================================================================
+
+A executor using async for IO and a pool of long-lived processes for CPU
+bounded tasks.
+
+Contrary to :class:`fluidimage.executors.exec_async_multiproc.ExecutorAsyncMultiproc`
+(one new process per item), the processes are forked once at the beginning of
+the computation, so that the objects used by the works (for example the
+:class:`fluidimage.works.piv.multipass.WorkPIV` of a PIV topology, with its
+FFT plans) are created only once per process.
+
+The large numpy arrays of the inputs and of the results (for example the
+images of an :class:`fluidimage.data_objects.piv.ArrayCouple`) are not pickled
+through the pipes: they are copied in blocks of shared memory
+(:mod:`multiprocessing.shared_memory`, or files in ``/dev/shm`` for Python <
+3.8) and only the names, shapes and dtypes of the blocks are sent. The
+processes use the input images without copy.
+
+.. autoclass:: ExecutorAsyncPool
+   :members:
+   :private-members:
+
+.. autofunction:: dumps_shared
+
+.. autofunction:: loads_shared
+
+"""
+
+import io
+import os
+import mmap
+import pickle
+import tempfile
+import time
+import multiprocessing
+
+import numpy as np
+import trio
+
+from fluidimage.util import logger, log_memory_usage, log_debug
+
+from .exec_async import ExecutorAsync
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+#: Arrays smaller than this number of bytes are pickled
+nbytes_min_shared = 2 ** 16
+
+if os.path.isdir("/dev/shm"):
+    _path_dir_shm = "/dev/shm"
+else:
+    _path_dir_shm = tempfile.gettempdir()
+
+
+class _SharedBlock:
+    """Block of shared memory created (``name=None``) or attached"""
+
+    def __init__(self, name=None, size=0):
+        if shared_memory is not None:
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=name is None, size=size
+            )
+            self.name = self._shm.name
+            self.buf = self._shm.buf
+            return
+
+        if name is None:
+            fd, name = tempfile.mkstemp(prefix="fluidimage_", dir=_path_dir_shm)
+            os.ftruncate(fd, size)
+        else:
+            fd = os.open(name, os.O_RDWR)
+        try:
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = self._mmap
+
+    def close(self):
+        """Try to close the block (False if arrays still use it)."""
+        try:
+            if shared_memory is not None:
+                self.buf = None
+                self._shm.close()
+            else:
+                self._mmap.close()
+        except BufferError:
+            return False
+        return True
+
+    def unlink(self):
+        try:
+            if shared_memory is not None:
+                self._shm.unlink()
+            else:
+                os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+
+class _PicklerShared(pickle.Pickler):
+    def __init__(self, file, blocks):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.blocks = blocks
+        self._ids = {}
+
+    def persistent_id(self, obj):
+        if (
+            type(obj) is not np.ndarray
+            or obj.nbytes < nbytes_min_shared
+            or obj.dtype.hasobject
+            or obj.dtype.fields is not None
+        ):
+            return None
+
+        try:
+            return self._ids[id(obj)]
+        except KeyError:
+            pass
+
+        block = _SharedBlock(size=obj.nbytes)
+        self.blocks.append(block)
+        np.ndarray(obj.shape, obj.dtype, buffer=block.buf)[...] = obj
+        pid = ("ndarray", block.name, obj.shape, obj.dtype.str)
+        self._ids[id(obj)] = pid
+        return pid
+
+
+class _UnpicklerShared(pickle.Unpickler):
+    def __init__(self, file, blocks, copy):
+        super().__init__(file)
+        self.blocks = blocks
+        self.copy = copy
+        self._arrays = {}
+
+    def persistent_load(self, pid):
+        _, name, shape, dtype = pid
+        try:
+            # an array referenced many times in the object
+            return self._arrays[name]
+        except KeyError:
+            pass
+        dtype = np.dtype(dtype)
+        block = _SharedBlock(name, int(np.prod(shape)) * dtype.itemsize)
+        self.blocks.append(block)
+        arr = np.ndarray(shape, dtype, buffer=block.buf)
+        if self.copy:
+            arr = arr.copy()
+        self._arrays[name] = arr
+        return arr
+
+
+def dumps_shared(obj, blocks):
+    """Pickle an object with its large arrays in blocks of shared memory.
+
+    The created blocks are appended to the list `blocks`.
+
+    """
+    file = io.BytesIO()
+    _PicklerShared(file, blocks).dump(obj)
+    return file.getvalue()
+
+
+def loads_shared(data, blocks, copy=False):
+    """Unpickle an object pickled with :func:`dumps_shared`.
+
+    If `copy` is False, the arrays use the blocks of shared memory (appended
+    to the list `blocks`), which can be closed only when they are no longer
+    used.
+
+    """
+    return _UnpicklerShared(io.BytesIO(data), blocks, copy).load()
+
+
+def _release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+    blocks.clear()
+
+
+def _worker_loop(conn, topology):
+    """Loop of the processes of the pool (forked with the topology)."""
+    blocks_to_close = []
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except EOFError:
+            break
+        if not data:
+            break
+
+        blocks_input = []
+        work_name, obj = loads_shared(data, blocks_input)
+        func = topology.works_dict[work_name].func_or_cls
+        # pylint: disable=W0703
+        try:
+            result = func(obj)
+        except Exception as error:
+            result = error
+
+        blocks_output = []
+        try:
+            data = dumps_shared(result, blocks_output)
+        except Exception as error:
+            _release(blocks_output)
+            data = dumps_shared(
+                RuntimeError(f"Result of {work_name} not picklable: {error}"),
+                blocks_output,
+            )
+        del obj, result
+
+        conn.send_bytes(data)
+
+        # the output blocks are unlinked by the main process
+        blocks_to_close.extend(blocks_output + blocks_input)
+        blocks_to_close = [
+            block for block in blocks_to_close if not block.close()
+        ]
+
+
+class _ProcessDiedError(RuntimeError):
+    """Result of an item whose process died"""
+
+
+class ExecutorAsyncPool(ExecutorAsync):
+    """Async executor using a pool of processes to launch CPU-bounded tasks
+
+    A process which dies (for example killed by the system) is replaced by a
+    new process, forked from the trio thread.
+
+    """
+
+    def compute(self):
+        """Compute the whole topology.
+
+        The pool of processes is started after the one shot jobs.
+
+        """
+        self._init_compute()
+        self.exec_one_shot_works()
+        self._start_pool()
+        try:
+            trio.run(self.start_async_works)
+        finally:
+            self._stop_pool()
+        self._finalize_compute()
+
+    def _start_pool(self):
+        if shared_memory is not None:
+            # the processes have to share the resource tracker
+            from multiprocessing import resource_tracker
+
+            resource_tracker.ensure_running()
+
+        self._context = multiprocessing.get_context("fork")
+        self._processes = [None] * self.nb_max_workers
+        self._conns = [None] * self.nb_max_workers
+        for index in range(self.nb_max_workers):
+            self._start_process(index)
+        self._indices_idle = list(range(self.nb_max_workers))
+
+    def _start_process(self, index):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_loop, args=(child_conn, self.topology)
+        )
+        process.daemon = True
+        process.start()
+        self._processes[index] = process
+        self._conns[index] = parent_conn
+
+    def _restart_process(self, index):
+        log_debug(f"process {index} died, restart it")
+        process = self._processes[index]
+        process.terminate()
+        process.join()
+        self._conns[index].close()
+        self._start_process(index)
+
+    def _stop_pool(self):
+        for conn in self._conns:
+            try:
+                conn.send_bytes(b"")
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(10 * self.sleep_time)
+            if process.exitcode is None:
+                process.terminate()
+
+    def _run_in_process(self, index, work_name, obj):
+        """Send an item to a process and wait for the result (in a thread)."""
+        blocks_input = []
+        conn = self._conns[index]
+        try:
+            conn.send_bytes(dumps_shared((work_name, obj), blocks_input))
+            data = conn.recv_bytes()
+        except (EOFError, OSError) as error:
+            # the process is restarted by the trio thread (forking from this
+            # thread would copy the state of the other threads)
+            return _ProcessDiedError(f"Process of the pool died ({error!r})")
+        finally:
+            _release(blocks_input)
+
+        blocks_output = []
+        try:
+            return loads_shared(data, blocks_output, copy=True)
+        finally:
+            _release(blocks_output)
+
+    async def async_run_work_cpu(self, work):
+        """Is destined to be started with a "trio.start_soon".
+
+        Executes the work on an item (key, obj) in a process of the pool, and
+        add the result on work.output_queue.
+
+        Parameters
+        ----------
+
+        work :
+
+          A work from the topology
+
+        """
+        self.nb_working_workers_cpu += 1
+
+        try:
+            key, obj = work.pop_input()
+        except KeyError:
+            self.nb_working_workers_cpu -= 1
+            return
+
+        if work.check_exception(key, obj):
+            self.nb_working_workers_cpu -= 1
+            return
+
+        t_start = time.time()
+        log_memory_usage(
+            f"{time.time() - self.t_start:.2f} s. Launch work "
+            + work.name_no_space
+            + f" ({key}). mem usage"
+        )
+
+        while not self._indices_idle:
+            await self._wait_for_change()
+        index = self._indices_idle.pop()
+        try:
+            ret = await trio.run_sync_in_worker_thread(
+                self._run_in_process, index, work.name, obj
+            )
+            if isinstance(ret, _ProcessDiedError):
+                self._restart_process(index)
+        finally:
+            self._indices_idle.append(index)
+
+        if isinstance(ret, Exception):
+            self.log_exception(ret, work.name_no_space, key)
+            if self.stop_if_error:
+                raise ret
+        else:
+            logger.info(
+                f"work {work.name_no_space} ({key}) "
+                f"done in {time.time() - t_start:.3f} s"
+            )
+
+        work.put_output(key, ret)
+        self.nb_working_workers_cpu -= 1
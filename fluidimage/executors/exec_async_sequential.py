@@ -42,7 +42,7 @@ class ExecutorAsyncSequential(ExecutorAsync):
         self.nb_working_workers_cpu += 1
 
         try:
-            key, obj = work.input_queue.pop_first_item()
+            key, obj = work.pop_input()
         except KeyError:
             self.nb_working_workers_cpu -= 1
             return
@@ -73,6 +73,5 @@ class ExecutorAsyncSequential(ExecutorAsync):
                 f"done in {time.time() - t_start:.3f} s"
             )
 
-        if work.output_queue is not None:
-            work.output_queue[key] = ret
+        work.put_output(key, ret)
         self.nb_working_workers_cpu -= 1
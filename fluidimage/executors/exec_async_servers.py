@@ -7,10 +7,17 @@ A executor using async for IO and servers for CPU-bounded tasks.
    :members:
    :private-members:
 
+.. autoclass:: ExecutorAsyncServersSocket
+   :members:
+   :private-members:
+
 """
 
 import signal
 import os
+import socket
+import time
+from multiprocessing import AuthenticationError
 from pathlib import Path
 
 import trio
@@ -21,7 +28,16 @@ from fluiddyn import time_as_str
 from fluidimage.util import logger, log_debug
 
 from .exec_async import ExecutorAsync
-from .servers import launch_server
+from .servers import (
+    launch_server,
+    launch_server_socket,
+    SocketConnection,
+    WorkerSocket,
+    ServerLostError,
+    get_authkey_from_env,
+    name_env_authkey,
+    _parse_address,
+)
 
 max_items_in_server = 4
 
@@ -79,22 +95,7 @@ class ExecutorAsyncServers(ExecutorAsync):
         )
 
         # create nb_max_workers servers
-        self.workers = []
-
-        for ind_worker in range(self.nb_max_workers):
-            log_path = Path(
-                str(self._log_path).split(".txt")[0]
-                + f"_multi{ind_worker:03}.txt"
-            )
-            self.workers.append(
-                launch_server(
-                    topology,
-                    log_path,
-                    self._type_server,
-                    sleep_time,
-                    logging_level,
-                )
-            )
+        self.workers = self._launch_workers(sleep_time, logging_level)
 
         def signal_handler(sig, frame):
             del sig, frame
@@ -110,6 +111,24 @@ class ExecutorAsyncServers(ExecutorAsync):
 
         signal.signal(signal.SIGINT, signal_handler)
 
+    def _get_log_path_worker(self, ind_worker):
+        return Path(
+            str(self._log_path).split(".txt")[0] + f"_multi{ind_worker:03}.txt"
+        )
+
+    def _launch_workers(self, sleep_time, logging_level):
+        """Launch the servers and return their clients"""
+        return [
+            launch_server(
+                self.topology,
+                self._get_log_path_worker(ind_worker),
+                self._type_server,
+                sleep_time,
+                logging_level,
+            )
+            for ind_worker in range(self.nb_max_workers)
+        ]
+
     def compute(self):
         """Compute the whole topology.
 
@@ -198,7 +217,7 @@ class ExecutorAsyncServers(ExecutorAsync):
 
         """
         try:
-            key, obj = work.input_queue.pop_first_item()
+            key, obj = work.pop_input()
         except KeyError:
             worker.is_available = True
             return
@@ -220,9 +239,20 @@ class ExecutorAsyncServers(ExecutorAsync):
             return result
 
         ret = await trio.run_sync_in_worker_thread(run_process)
-        if work.output_queue is not None:
-            work.output_queue[key] = ret
-        worker.well_done_thanks()
+        while isinstance(ret, ServerLostError):
+            # the item is sent to another server (the dead server stays
+            # occupied until then, so that the executor does not stop)
+            worker_dead = worker
+            worker = await self._wait_for_available_worker()
+            worker_dead.well_done_thanks()
+            if not worker:
+                break
+            logger.info(f"item {key} sent again ({work.name_no_space})")
+            ret = await trio.run_sync_in_worker_thread(run_process)
+
+        work.put_output(key, ret)
+        if worker:
+            worker.well_done_thanks()
 
     def def_async_func_work_cpu(self, work):
         async def func(work=work):
@@ -236,12 +266,9 @@ class ExecutorAsyncServers(ExecutorAsync):
                         return
                     await trio.sleep(self.sleep_time)
 
-                available_worker = False
-                while not available_worker:
-                    if self._has_to_stop:
-                        return
-                    available_worker = self.get_available_worker()
-                    await trio.sleep(self.sleep_time)
+                available_worker = await self._wait_for_available_worker()
+                if not available_worker:
+                    return
 
                 self.nursery.start_soon(
                     self.async_run_work_cpu, work, available_worker
@@ -250,6 +277,16 @@ class ExecutorAsyncServers(ExecutorAsync):
 
         return func
 
+    async def _wait_for_available_worker(self):
+        """Wait for an available worker (False if the executor has to stop)"""
+        available_worker = False
+        while not available_worker:
+            if self._has_to_stop:
+                return False
+            available_worker = self.get_available_worker()
+            await trio.sleep(self.sleep_time)
+        return available_worker
+
     def get_available_worker(self):
         """Get a worker available to receive a new job"""
         available_workers = [
@@ -260,6 +297,8 @@ class ExecutorAsyncServers(ExecutorAsync):
         ]
 
         if not available_workers:
+            if all(worker.is_dead for worker in self.workers):
+                raise RuntimeError("All servers are dead")
             return False
 
         nb_items_to_process_workers = [
@@ -276,3 +315,147 @@ class ExecutorAsyncServersThreading(ExecutorAsyncServers):
     """Just used to get a better coverage"""
 
     _type_server = "threading"
+
+
+class ExecutorAsyncServersSocket(ExecutorAsyncServers):
+    """Executor async/await using servers connected through sockets
+
+    The executor listens on :attr:`address` and waits for ``nb_max_workers``
+    servers. :attr:`nb_servers_local` of them are launched locally; the other
+    ones have to be launched (for example with ssh or a job scheduler) on
+    other nodes with::
+
+      python -m fluidimage.executors.servers host:port -n <nb_servers>
+
+    The log files of the servers are written in the result directory, which
+    has to be accessible from the other nodes.
+
+    :attr:`address` and :attr:`nb_servers_local` can also be set with the
+    environment variables ``FLUIDIMAGE_SERVERS_ADDRESS`` and
+    ``FLUIDIMAGE_NB_SERVERS_LOCAL``.
+
+    The connections are authenticated with a secret key before any data is
+    unpickled (the connections which fail are closed). With remote servers,
+    the key has to be given (to the executor and to the servers) by the
+    environment variable ``FLUIDIMAGE_SERVERS_AUTHKEY``. Otherwise, a random
+    key is used.
+
+    """
+
+    #: "host:port" (TCP) or path of a Unix socket (default: free local port)
+    address = None
+    #: Number of servers launched locally (default: nb_max_workers)
+    nb_servers_local = None
+    #: Time (in s) between two heartbeats of a server
+    time_heartbeat = 1.0
+    #: Time (in s) without message after which a server is considered dead
+    timeout_heartbeat = 20.0
+    #: Maximum time (in s) to wait for the connection of a server
+    timeout_connection = 60.0
+    #: Secret key (bytes) shared with the servers (see above)
+    authkey = None
+
+    def _launch_workers(self, sleep_time, logging_level):
+        """Listen, launch the local servers and wait for all servers"""
+        address = os.environ.get("FLUIDIMAGE_SERVERS_ADDRESS", self.address)
+        if address is None:
+            address = "127.0.0.1:0"
+        nb_servers_local = os.environ.get(
+            "FLUIDIMAGE_NB_SERVERS_LOCAL", self.nb_servers_local
+        )
+        if nb_servers_local is None:
+            nb_servers_local = self.nb_max_workers
+        nb_servers_local = min(int(nb_servers_local), self.nb_max_workers)
+
+        family, address_bind = _parse_address(address)
+        listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        elif os.path.exists(address_bind):
+            os.remove(address_bind)
+        listener.bind(address_bind)
+        listener.listen(self.nb_max_workers)
+
+        if family == socket.AF_INET:
+            host, port = listener.getsockname()[:2]
+            if host in ("", "0.0.0.0"):
+                address_local = f"127.0.0.1:{port}"
+                address_remote = f"{socket.gethostname()}:{port}"
+            else:
+                address_local = address_remote = f"{host}:{port}"
+        else:
+            address_local = address_remote = address_bind
+
+        nb_servers_remote = self.nb_max_workers - nb_servers_local
+
+        authkey = get_authkey_from_env()
+        if authkey is None:
+            authkey = self.authkey
+        if authkey is None:
+            if nb_servers_remote:
+                listener.close()
+                raise ValueError(
+                    f"The environment variable {name_env_authkey} has to be "
+                    "set (with the same value for the remote servers)"
+                )
+            authkey = os.urandom(32)
+
+        if nb_servers_remote:
+            logger.info(
+                f"waiting for {nb_servers_remote} servers launched with:\n"
+                "python -m fluidimage.executors.servers "
+                f"{address_remote} -n <nb_servers>"
+            )
+
+        self._processes_local = [
+            launch_server_socket(address_local, self._type_server, authkey)
+            for _ in range(nb_servers_local)
+        ]
+
+        workers = []
+        listener.settimeout(self.timeout_connection)
+        try:
+            while len(workers) < self.nb_max_workers:
+                sock, address_peer = listener.accept()
+                sock.settimeout(None)
+                conn = SocketConnection(sock)
+                try:
+                    conn.authenticate(authkey, is_listener=True)
+                except (AuthenticationError, OSError, EOFError) as error:
+                    logger.warning(
+                        f"connection from {address_peer} refused ({error!r})"
+                    )
+                    conn.close()
+                    continue
+                ind_worker = len(workers)
+                conn.send(
+                    (
+                        "__init__",
+                        dict(
+                            topology_cls=type(self.topology),
+                            params=self.topology.params,
+                            log_path=self._get_log_path_worker(ind_worker),
+                            logging_level=logging_level,
+                            sleep_time=sleep_time,
+                            time_heartbeat=self.time_heartbeat,
+                        ),
+                    )
+                )
+                workers.append(WorkerSocket(conn, None, self.timeout_heartbeat))
+        finally:
+            listener.close()
+            if family == socket.AF_UNIX:
+                os.remove(address_bind)
+
+        return workers
+
+    async def start_async_works(self):
+        """Start the async functions and wait for the local servers"""
+        await super().start_async_works()
+        t_start = time.time()
+        for process in self._processes_local:
+            process.join(max(0.0, 1.0 - (time.time() - t_start)))
+            if process.is_alive() and hasattr(process, "kill"):
+                # the server does not answer
+                process.kill()
+                process.join()
@@ -43,7 +43,10 @@ class ExecutorSequential(ExecutorBase):
                     if not work.input_queue:
                         continue
 
-                    key, obj = work.input_queue.pop_first_item()
+                    try:
+                        key, obj = work.pop_input()
+                    except KeyError:
+                        continue
 
                     if work.check_exception(key, obj):
                         continue
@@ -68,5 +71,4 @@ class ExecutorSequential(ExecutorBase):
                             f"done in {time.time() - t_start:.3f} s"
                         )
 
-                    if work.output_queue is not None:
-                        work.output_queue[key] = ret
+                    work.put_output(key, ret)
@@ -2,23 +2,35 @@
 Multi executors async (:mod:`fluidimage.executors.multi_exec_async`)
 ====================================================================
 
+With :class:`MultiExecutorAsync`, the work is split statically in as many
+slices as processes. With :class:`MultiExecutorAsyncWorkStealing`, the work
+is split in small batches (of series indices or of items of the first queue)
+sent to the processes on demand, so that a process with slow items does not
+delay the end of the computation by more than one batch.
+
 .. autoclass:: MultiExecutorAsync
    :members:
    :private-members:
 
+.. autoclass:: MultiExecutorAsyncWorkStealing
+   :members:
+   :private-members:
+
 .. autoclass:: ExecutorAsyncForMulti
    :members:
    :private-members:
 
 """
 
-from multiprocessing import Process, Pipe
+from multiprocessing import Process, Pipe, SimpleQueue
 import copy
 import math
 from time import time
 from pathlib import Path
 import os
 
+import trio
+
 from fluiddyn import time_as_str
 
 from fluidimage.util import logger
@@ -28,7 +40,13 @@ from .exec_async_sequential import ExecutorAsyncSequential
 
 
 class ExecutorAsyncForMulti(ExecutorAsyncSequential):
-    """Slightly modified ExecutorAsync"""
+    """Slightly modified ExecutorAsync
+
+    If ``batches`` (a :class:`multiprocessing.SimpleQueue`) is given, the
+    topology is computed batch after batch until a None is received (see
+    :class:`MultiExecutorAsyncWorkStealing`).
+
+    """
 
     def __init__(
         self,
@@ -38,11 +56,13 @@ class ExecutorAsyncForMulti(ExecutorAsyncSequential):
         sleep_time=0.01,
         logging_level="info",
         stop_if_error=False,
+        batches=None,
     ):
         if stop_if_error:
             raise NotImplementedError
 
         self._log_path = log_path
+        self.batches = batches
         super().__init__(
             topology,
             path_dir_result,
@@ -58,6 +78,37 @@ class ExecutorAsyncForMulti(ExecutorAsyncSequential):
     def _init_compute(self):
         self._init_compute_log()
 
+    def compute(self):
+        """Compute the whole topology (or all batches received)."""
+        if self.batches is None:
+            super().compute()
+            return
+
+        self._init_compute()
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+            self._prepare_batch(batch)
+            self._has_to_stop = False
+            self.exec_one_shot_works()
+            trio.run(self.start_async_works)
+        self._finalize_compute()
+
+    def _prepare_batch(self, batch):
+        """Restrict the series or fill the first queue with a batch."""
+        if hasattr(self.topology, "series"):
+            ind_start, ind_stop = batch
+            logger.info(
+                f"batch of series: ind_start={ind_start}, ind_stop={ind_stop}"
+            )
+            self.topology.series.ind_start = ind_start
+            self.topology.series.ind_stop = ind_stop
+        else:
+            logger.info(f"batch of {len(batch)} items")
+            for key, value in batch:
+                self.topology.first_queue[key] = value
+
     def _finalize_compute(self):
         self._reset_std_as_default()
 
@@ -66,6 +117,11 @@ class ExecutorAsyncForMulti(ExecutorAsyncSequential):
             file.write(txt)
 
 
+def _iter_slices(nb_items, nb_items_slice):
+    for start in range(0, nb_items, nb_items_slice):
+        yield start, min(start + nb_items_slice, nb_items)
+
+
 class MultiExecutorAsync(ExecutorBase):
     """Manage the multi-executor mode
 
@@ -85,12 +141,19 @@ class MultiExecutorAsync(ExecutorBase):
 
     sleep_time : None, float
 
-      defines the waiting time (from trio.sleep) of a function. Async functions
-      await "trio.sleep(sleep_time)" when they have done a work on an item, and
-      when there is nothing in there input_queue.
+      Used by the executors of the processes (for example to wait for the end
+      of their processes). The async functions do not poll the queues (see
+      :mod:`fluidimage.executors.exec_async`).
 
     """
 
+    #: Whether the work is split dynamically (see
+    #: :class:`MultiExecutorAsyncWorkStealing`)
+    work_stealing = False
+    #: Number of series (or items of the first queue) per batch (if None,
+    #: about 4 batches per process)
+    nb_items_batch = None
+
     def __init__(
         self,
         topology,
@@ -115,6 +178,7 @@ class MultiExecutorAsync(ExecutorBase):
         self.sleep_time = sleep_time
         self.nb_processes = self.nb_max_workers
         self.processes = []
+        self._batches = None
 
         # to avoid a pylint warning
         self.log_paths = None
@@ -146,7 +210,10 @@ class MultiExecutorAsync(ExecutorBase):
         self.log_paths = []
 
         if hasattr(self.topology, "series"):
-            self.start_multiprocess_series()
+            if self.work_stealing:
+                self.start_multiprocess_series_work_stealing()
+            else:
+                self.start_multiprocess_series()
         else:
             self.start_mutiprocess_first_queue()
 
@@ -170,12 +237,19 @@ class MultiExecutorAsync(ExecutorBase):
         # split the first queue
         keys = list(first_queue.keys())
 
-        nb_keys_per_process = max(1, int(len(keys) / self.nb_processes))
+        if self.work_stealing:
+            # the keys are sent later by batches
+            self._batches = SimpleQueue()
+            keys_for_processes = [[] for _ in range(self.nb_processes)]
+        else:
+            nb_keys_per_process = max(1, int(len(keys) / self.nb_processes))
 
-        keys_for_processes = []
-        for iproc in range(self.nb_processes):
-            istart = iproc * nb_keys_per_process
-            keys_for_processes.append(keys[istart : istart + nb_keys_per_process])
+            keys_for_processes = []
+            for iproc in range(self.nb_processes):
+                istart = iproc * nb_keys_per_process
+                keys_for_processes.append(
+                    keys[istart : istart + nb_keys_per_process]
+                )
 
         # change topology
         self.topology.first_queue = self.topology.works[0].output_queue
@@ -218,6 +292,15 @@ class MultiExecutorAsync(ExecutorBase):
 
             self.launch_process(topology_this_process, ind_process)
 
+        if self.work_stealing:
+            nb_items_batch = self._get_nb_items_batch(len(keys))
+            self._send_batches(
+                [
+                    [(key, first_queue[key]) for key in keys[start:stop]]
+                    for start, stop in _iter_slices(len(keys), nb_items_batch)
+                ]
+            )
+
         self.wait_for_all_processes()
 
     def start_multiprocess_series(self):
@@ -257,6 +340,37 @@ class MultiExecutorAsync(ExecutorBase):
 
         self.wait_for_all_processes()
 
+    def start_multiprocess_series_work_stealing(self):
+        """Start the processes and send them batches of series indices"""
+        series = self.topology.series
+        self._batches = SimpleQueue()
+        for ind_process in range(self.nb_processes):
+            self.launch_process(self.topology, ind_process)
+
+        indices = range(series.ind_start, series.ind_stop, series.ind_step)
+        nb_items_batch = self._get_nb_items_batch(len(indices))
+        self._send_batches(
+            [
+                (indices[start], min(indices[stop - 1] + 1, series.ind_stop))
+                for start, stop in _iter_slices(len(indices), nb_items_batch)
+            ]
+        )
+
+        self.wait_for_all_processes()
+
+    def _get_nb_items_batch(self, nb_items):
+        if self.nb_items_batch is not None:
+            return self.nb_items_batch
+        return max(1, nb_items // (4 * self.nb_processes))
+
+    def _send_batches(self, batches):
+        """Send the batches and then one None per process"""
+        logger.info(f"{len(batches)} batches for {self.nb_processes} processes")
+        for batch in batches:
+            self._batches.put(batch)
+        for _ in range(self.nb_processes):
+            self._batches.put(None)
+
     def launch_process(self, topology, ind_process):
         """Launch one process"""
 
@@ -268,6 +382,7 @@ class MultiExecutorAsync(ExecutorBase):
                 sleep_time=self.sleep_time,
                 log_path=log_path,
                 logging_level=self.logging_level,
+                batches=self._batches,
             )
             executor.t_start = self.t_start
             executor.compute()
@@ -313,3 +428,15 @@ class MultiExecutorAsync(ExecutorBase):
 
         for process in self.processes:
             process.join()
+
+
+class MultiExecutorAsyncWorkStealing(MultiExecutorAsync):
+    """Multi executor with dynamic load balancing
+
+    The processes are started with the whole topology and receive small
+    batches (of series indices or of items of the first queue) on demand
+    through a :class:`multiprocessing.SimpleQueue`.
+
+    """
+
+    work_stealing = True
@@ -1,8 +1,36 @@
 """Servers for exec_async_servers (:mod:`fluidimage.executors.servers`)
 =======================================================================
 
+The servers communicate with the executor either through
+:func:`multiprocessing.Pipe` (:class:`WorkerServerMultiprocessing`) or through
+TCP or Unix sockets (:class:`WorkerServerSocket`), so that servers running on
+other nodes can be used. A socket server is launched with::
+
+  python -m fluidimage.executors.servers host:port
+
+(or the path of a Unix socket) and receives the topology from the executor
+(see :class:`fluidimage.executors.exec_async_servers.ExecutorAsyncServersSocket`).
+
+With sockets, the numpy arrays are sent without copy after the pickled
+objects (see :class:`SocketConnection`), the servers send heartbeats and the
+items sent to a server considered dead are sent again to other servers.
+
+Since the received data are unpickled, the executor and the servers first
+authenticate each other with a secret key (HMAC challenge, see
+:func:`SocketConnection.authenticate`), which is given for the servers
+launched on other nodes by the environment variable
+``FLUIDIMAGE_SERVERS_AUTHKEY`` (with the same value for the executor).
+
 .. autofunction:: launch_server
 
+.. autofunction:: launch_server_socket
+
+.. autoclass:: SocketConnection
+   :members:
+   :private-members:
+
+.. autoexception:: ServerLostError
+
 .. autoclass:: Worker
    :members:
    :private-members:
@@ -15,19 +43,37 @@
    :members:
    :private-members:
 
+.. autoclass:: WorkerSocket
+   :members:
+   :private-members:
+
 .. autoclass:: WorkerServerMultiprocessing
    :members:
    :private-members:
 
+.. autoclass:: WorkerServerSocket
+   :members:
+   :private-members:
+
 """
 
+import io
+import os
 import sys
 import signal
+import select
 import time
+import pickle
+import socket
+import struct
+import queue
+import argparse
+import hmac
 
-from multiprocessing import Process, Pipe, Event
-from threading import Thread
+from multiprocessing import Process, Pipe, Event, AuthenticationError
+from threading import Thread, Lock
 
+import numpy as np
 import trio
 
 from fluiddyn.io.tee import MultiFile
@@ -80,6 +126,223 @@ def launch_server(
     return worker
 
 
+def launch_server_socket(address, type_server="multiprocessing", authkey=None):
+    """Launch a local socket server connecting to `address`
+
+    Returns the process (or thread) of the server.
+
+    """
+    if type_server == "multiprocessing":
+        Process_ = Process
+    elif type_server == "threading":
+        Process_ = Thread
+    else:
+        raise ValueError
+
+    process = Process_(
+        target=WorkerServerSocket,
+        args=(address,),
+        kwargs={"in_process": Process_ == Process, "authkey": authkey},
+    )
+    process.daemon = True
+    process.start()
+    return process
+
+
+class ServerLostError(Exception):
+    """Raised for the items sent to a server which died"""
+
+
+#: Arrays smaller than this number of bytes are pickled
+nbytes_min_buffer = 2 ** 10
+
+#: Environment variable containing the secret key shared by the executor and
+#: the socket servers
+name_env_authkey = "FLUIDIMAGE_SERVERS_AUTHKEY"
+
+_size_challenge = 32
+_welcome = b"#WELCOME"
+_failure = b"#FAILURE"
+
+
+def get_authkey_from_env():
+    """Get the secret key from the environment (None if not set)"""
+    authkey = os.environ.get(name_env_authkey)
+    if authkey is None:
+        return None
+    return authkey.encode()
+
+
+class _PicklerBuffers(pickle.Pickler):
+    def __init__(self, file, buffers):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.buffers = buffers
+
+    def persistent_id(self, obj):
+        if (
+            type(obj) is not np.ndarray
+            or obj.nbytes < nbytes_min_buffer
+            or obj.dtype.hasobject
+            or obj.dtype.fields is not None
+        ):
+            return None
+        arr = np.ascontiguousarray(obj)
+        self.buffers.append(memoryview(arr.reshape(-1)).cast("B"))
+        return ("ndarray", len(self.buffers) - 1, arr.shape, arr.dtype.str)
+
+
+class _UnpicklerBuffers(pickle.Unpickler):
+    def __init__(self, file, buffers):
+        super().__init__(file)
+        self.buffers = buffers
+
+    def persistent_load(self, pid):
+        _, index, shape, dtype = pid
+        return self.buffers[index].view(dtype).reshape(shape)
+
+
+def _parse_address(address):
+    """Family and address ("host:port" for TCP, else a Unix socket path)"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def connect_socket(address, timeout=60.0):
+    """Connect to a listening executor (retry until `timeout`)"""
+    family, address = _parse_address(address)
+    t_start = time.time()
+    while True:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            if time.time() - t_start > timeout:
+                raise
+            time.sleep(0.1)
+        else:
+            return sock
+
+
+class SocketConnection:
+    """Connection sending pickled objects through a socket
+
+    The numpy arrays are not pickled: their buffers are sent (and received)
+    without copy after the pickled data. A message is made of a header (size
+    of the pickled data, number of buffers and their sizes), the pickled data
+    and the buffers.
+
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._lock_send = Lock()
+
+    def send(self, obj):
+        """Send an object (can be called from different threads)"""
+        buffers = []
+        file = io.BytesIO()
+        _PicklerBuffers(file, buffers).dump(obj)
+        data = file.getbuffer()
+        sizes = [buffer.nbytes for buffer in buffers]
+        header = struct.pack(
+            f"!QQ{len(sizes)}Q", data.nbytes, len(sizes), *sizes
+        )
+        with self._lock_send:
+            self.sock.sendall(header)
+            self.sock.sendall(data)
+            for buffer in buffers:
+                self.sock.sendall(buffer)
+
+    def authenticate(self, authkey, is_listener=False, timeout=10.0):
+        """Check that both sides know the secret key `authkey` (bytes)
+
+        Each side sends a random message and checks the HMAC digest computed
+        by the other side, so that the key is never sent. Only raw bytes are
+        exchanged: this has to be done before any call of :func:`recv` (which
+        unpickles the received data). Raises
+        :class:`multiprocessing.AuthenticationError` if the authentication
+        fails.
+
+        """
+        timeout_old = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            if is_listener:
+                self._deliver_challenge(authkey)
+                self._answer_challenge(authkey)
+            else:
+                self._answer_challenge(authkey)
+                self._deliver_challenge(authkey)
+        finally:
+            self.sock.settimeout(timeout_old)
+
+    def _deliver_challenge(self, authkey):
+        message = os.urandom(_size_challenge)
+        self.sock.sendall(message)
+        digest = hmac.new(authkey, message, "sha256").digest()
+        response = self._recv_exactly(len(digest)).tobytes()
+        if not hmac.compare_digest(response, digest):
+            self.sock.sendall(_failure)
+            raise AuthenticationError("digest received was wrong")
+        self.sock.sendall(_welcome)
+
+    def _answer_challenge(self, authkey):
+        message = self._recv_exactly(_size_challenge).tobytes()
+        self.sock.sendall(hmac.new(authkey, message, "sha256").digest())
+        if self._recv_exactly(len(_welcome)).tobytes() != _welcome:
+            raise AuthenticationError("digest sent was rejected")
+
+    def poll(self, timeout=0.0):
+        """Whether there is data to be received (wait at most `timeout`)"""
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        return bool(readable)
+
+    def recv(self):
+        """Receive an object (EOFError if the connection is closed)"""
+        size_data, nb_buffers = struct.unpack("!QQ", self._recv_exactly(16))
+        sizes = struct.unpack(
+            f"!{nb_buffers}Q", self._recv_exactly(8 * nb_buffers)
+        )
+        data = self._recv_exactly(size_data)
+        buffers = [self._recv_exactly(size) for size in sizes]
+        return _UnpicklerBuffers(io.BytesIO(data), buffers).load()
+
+    def _recv_exactly(self, size):
+        buffer = np.empty(size, dtype=np.uint8)
+        view = memoryview(buffer)
+        while view.nbytes:
+            nbytes = self.sock.recv_into(view)
+            if nbytes == 0:
+                raise EOFError("connection closed")
+            view = view[nbytes:]
+        return buffer
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class _LocalPipe:
+    """One-way channel between threads (replace Pipe without pickling)"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def send(self, obj):
+        self._queue.put(obj)
+
+    def recv(self):
+        return self._queue.get()
+
+
 class Worker:
     def __init__(self, conn, event_has_to_stop, process):
         self.conn = conn
@@ -88,6 +351,7 @@ class Worker:
         self.nb_items_to_process = 0
         self.is_available = True
         self.is_unoccupied = True
+        self.is_dead = False
 
     def well_done_thanks(self):
         self.nb_items_to_process -= 1
@@ -117,6 +381,108 @@ class WorkerMultiprocessing(Worker):
             self.process.terminate()
 
 
+class WorkerSocket(Worker):
+    """Client of a socket server (local or on another node)
+
+    A thread receives the results and the heartbeats of the server. If the
+    connection is lost or if no message is received during
+    `timeout_heartbeat`, the server is considered dead and a
+    :class:`ServerLostError` is returned for the items sent to it. The
+    timeout is only used to wait for the messages: the socket is blocking, so
+    that sending large arrays to a busy server can take longer.
+
+    """
+
+    def __init__(self, conn, process=None, timeout_heartbeat=20.0):
+        self._is_available = True
+        super().__init__(conn, None, process)
+        self._pending = {}
+        self._lock = Lock()
+        self._terminated = False
+        self.timeout_heartbeat = timeout_heartbeat
+        self._thread = Thread(target=self._receive_loop, daemon=True)
+        self._thread.start()
+
+    @property
+    def is_available(self):
+        return self._is_available and not self.is_dead
+
+    @is_available.setter
+    def is_available(self, value):
+        self._is_available = value
+
+    def send_job(self, obj):
+        work_name, key, obj, child_conn = obj
+        self.is_unoccupied = False
+        self.nb_items_to_process += 1
+        with self._lock:
+            if not self.is_dead:
+                self._pending[(work_name, key)] = child_conn
+        if self.is_dead:
+            child_conn.send((work_name, key, ServerLostError()))
+            return
+        try:
+            self.send((work_name, key, obj))
+        except OSError as error:
+            self._set_dead(error)
+
+    def send(self, obj):
+        self.conn.send(obj)
+
+    def new_pipe(self):
+        pipe = _LocalPipe()
+        return pipe, pipe
+
+    def _receive_loop(self):
+        while True:
+            try:
+                if not self.conn.poll(self.timeout_heartbeat):
+                    raise socket.timeout(
+                        f"no message during {self.timeout_heartbeat} s"
+                    )
+                message = self.conn.recv()
+            except (OSError, EOFError) as error:
+                if not self._terminated:
+                    self._set_dead(error)
+                return
+            if message[0] == "__heartbeat__":
+                continue
+            work_name, key, _ = message
+            with self._lock:
+                child_conn = self._pending.pop((work_name, key))
+            child_conn.send(message)
+
+    def _set_dead(self, error):
+        with self._lock:
+            if self.is_dead:
+                return
+            self.is_dead = True
+            pending = self._pending
+            self._pending = {}
+        logger.error(
+            cstring(
+                f"server lost ({error!r}), {len(pending)} items to be sent again",
+                color="FAIL",
+            )
+        )
+        for (work_name, key), child_conn in pending.items():
+            child_conn.send((work_name, key, ServerLostError(repr(error))))
+        self.conn.close()
+
+    def terminate(self):
+        self._terminated = True
+        if not self.is_dead:
+            try:
+                self.send(("__terminate__",))
+            except OSError:
+                pass
+        if self.process is not None and hasattr(self.process, "terminate"):
+            self.process.join(1)
+            if self.process.exitcode is None:
+                self.process.terminate()
+        self.conn.close()
+
+
 class WorkerServer:
     def __init__(self, sleep_time=0.01):
         self.sleep_time = sleep_time
@@ -137,6 +503,26 @@ class WorkerServer:
             self.nursery.start_soon(self.launch_works)
             self.nursery.start_soon(self.send)
 
+    def _init_log(self, log_path, logging_level):
+        self._log_file = open(log_path, "w")
+
+        stdout = sys.stdout
+        if isinstance(stdout, MultiFile):
+            stdout = sys.__stdout__
+
+        stderr = sys.stderr
+        if isinstance(stderr, MultiFile):
+            stderr = sys.__stderr__
+
+        sys.stdout = MultiFile([stdout, self._log_file])
+        sys.stderr = MultiFile([stderr, self._log_file])
+
+        if logging_level:
+            for handler in logger.handlers:
+                logger.removeHandler(handler)
+
+            config_logging(logging_level, file=sys.stdout)
+
     async def check_event_has_to_stop(self):
         raise NotImplementedError
 
@@ -147,7 +533,44 @@ class WorkerServer:
         raise NotImplementedError
 
     async def launch_works(self):
-        raise NotImplementedError
+        while self._has_to_continue:
+            while not self.to_be_processed:
+                await trio.sleep(self.sleep_time)
+
+            # the items can contain other objects (for example a connection)
+            work_name, key, obj, *others = self.to_be_processed.pop(0)
+            work = self.topology.works_dict[work_name]
+
+            def do_the_job(work, obj):
+                return work.func_or_cls(obj)
+
+            t_start = time.time()
+
+            log_memory_usage(
+                f"{time.time() - self.t_start:.2f} s. Launch work "
+                + work.name_no_space
+                + f" ({key}). mem usage"
+            )
+            # pylint: disable=W0703
+            try:
+                result = await trio.run_sync_in_worker_thread(
+                    do_the_job, work, obj
+                )
+            except Exception as error:
+                logger.error(
+                    cstring(
+                        "error during work " f"{work.name_no_space} ({key})",
+                        color="FAIL",
+                    )
+                )
+                result = error
+            else:
+                logger.info(
+                    f"work {work.name_no_space} ({key}) "
+                    f"done in {time.time() - t_start:.3f} s"
+                )
+
+            self.to_be_resent.append((work_name, key, result, *others))
 
 
 class WorkerServerMultiprocessing(WorkerServer):
@@ -179,24 +602,7 @@ class WorkerServerMultiprocessing(WorkerServer):
         self.event_has_to_stop = event_has_to_stop
         self.topology = topology_cls(params)
 
-        self._log_file = open(log_path, "w")
-
-        stdout = sys.stdout
-        if isinstance(stdout, MultiFile):
-            stdout = sys.__stdout__
-
-        stderr = sys.stderr
-        if isinstance(stderr, MultiFile):
-            stderr = sys.__stderr__
-
-        sys.stdout = MultiFile([stdout, self._log_file])
-        sys.stderr = MultiFile([stderr, self._log_file])
-
-        if logging_level:
-            for handler in logger.handlers:
-                logger.removeHandler(handler)
-
-            config_logging(logging_level, file=sys.stdout)
+        self._init_log(log_path, logging_level)
 
         super().__init__(sleep_time=sleep_time)
 
@@ -216,52 +622,158 @@ class WorkerServerMultiprocessing(WorkerServer):
             else:
                 self.to_be_processed.append(ret)
 
-    async def launch_works(self):
+    async def send(self):
         while self._has_to_continue:
-            while not self.to_be_processed:
+            while not self.to_be_resent:
                 await trio.sleep(self.sleep_time)
+            work_name, key, result, child_conn = self.to_be_resent.pop(0)
 
-            work_name, key, obj, child_conn = self.to_be_processed.pop(0)
-            work = self.topology.works_dict[work_name]
+            log_debug(f"send {work_name}, {key}")
+            await trio.run_sync_in_worker_thread(
+                child_conn.send, (work_name, key, result)
+            )
 
-            def do_the_job(work, obj):
-                return work.func_or_cls(obj)
 
-            t_start = time.time()
+class WorkerServerSocket(WorkerServer):
+    """Server connected to an executor through a socket
 
-            log_memory_usage(
-                f"{time.time() - self.t_start:.2f} s. Launch work "
-                + work.name_no_space
-                + f" ({key}). mem usage"
+    The topology, the log path and the parameters of the server are received
+    just after the connection and the authentication with the secret key
+    `authkey` (by default taken from the environment variable
+    ``FLUIDIMAGE_SERVERS_AUTHKEY``).
+
+    """
+
+    def __init__(
+        self, address, in_process=True, timeout_connect=60.0, authkey=None
+    ):
+
+        if in_process:
+
+            def signal_handler(sig, frame):
+                del sig, frame
+                self._stop()
+
+            signal.signal(signal.SIGINT, signal_handler)
+
+        if authkey is None:
+            authkey = get_authkey_from_env()
+        if authkey is None:
+            raise ValueError(
+                f"The environment variable {name_env_authkey} has to be set"
             )
-            # pylint: disable=W0703
+
+        self.conn = SocketConnection(connect_socket(address, timeout_connect))
+        try:
+            self.conn.authenticate(authkey)
+        except (AuthenticationError, OSError, EOFError):
+            self.conn.close()
+            raise
+
+        message, kwargs = self.conn.recv()
+        assert message == "__init__"
+        self.topology = kwargs["topology_cls"](kwargs["params"])
+        self.time_heartbeat = kwargs["time_heartbeat"]
+
+        self._init_log(kwargs["log_path"], kwargs["logging_level"])
+
+        try:
+            super().__init__(sleep_time=kwargs["sleep_time"])
+        finally:
+            self.conn.close()
+
+    def _stop(self):
+        self._has_to_continue = False
+        try:
+            self.nursery.cancel_scope.cancel()
+        except AttributeError:
+            pass
+
+    async def _send_async(self, obj):
+        try:
+            await trio.run_sync_in_worker_thread(self.conn.send, obj)
+        except OSError:
+            self._stop()
+
+    async def check_event_has_to_stop(self):
+        """Send heartbeats (the server stops when the connection is lost)"""
+        while self._has_to_continue:
+            await self._send_async(("__heartbeat__",))
+            await trio.sleep(self.time_heartbeat)
+
+    async def receive(self):
+        while self._has_to_continue:
             try:
-                result = await trio.run_sync_in_worker_thread(
-                    do_the_job, work, obj
-                )
-            except Exception as error:
-                logger.error(
-                    cstring(
-                        "error during work " f"{work.name_no_space} ({key})",
-                        color="FAIL",
-                    )
-                )
-                result = error
-            else:
-                logger.info(
-                    f"work {work.name_no_space} ({key}) "
-                    f"done in {time.time() - t_start:.3f} s"
+                message = await trio.run_sync_in_worker_thread(
+                    self.conn.recv, cancellable=True
                 )
+            except (OSError, EOFError):
+                message = ("__terminate__",)
 
-            self.to_be_resent.append((work_name, key, result, child_conn))
+            if message[0] == "__terminate__":
+                self._stop()
+            elif message[0] == "__t_start__":
+                self.t_start = message[1]
+            else:
+                log_debug(f"receive: {message[:2]}")
+                self.to_be_processed.append(message)
 
     async def send(self):
         while self._has_to_continue:
             while not self.to_be_resent:
                 await trio.sleep(self.sleep_time)
-            work_name, key, result, child_conn = self.to_be_resent.pop(0)
+            work_name, key, result = self.to_be_resent.pop(0)
 
             log_debug(f"send {work_name}, {key}")
-            await trio.run_sync_in_worker_thread(
-                child_conn.send, (work_name, key, result)
-            )
+            # pylint: disable=W0703
+            try:
+                await self._send_async((work_name, key, result))
+            except Exception as error:
+                # the result can not be pickled
+                await self._send_async(
+                    (work_name, key, RuntimeError(f"Unpicklable result: {error}"))
+                )
+
+
+def main():
+    """Launch a socket server (``python -m fluidimage.executors.servers``)"""
+    parser = argparse.ArgumentParser(
+        description=(
+            "Launch a server for ExecutorAsyncServersSocket (the secret key "
+            f"shared with the executor is given by {name_env_authkey})"
+        )
+    )
+    parser.add_argument(
+        "address", help="host:port (TCP) or path (Unix socket) of the executor"
+    )
+    parser.add_argument(
+        "-n", "--nb-servers", type=int, default=1, help="number of servers"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="maximum time (in s) to wait for the executor",
+    )
+    args = parser.parse_args()
+
+    if args.nb_servers == 1:
+        WorkerServerSocket(args.address, timeout_connect=args.timeout)
+        return
+
+    processes = [
+        Process(
+            target=WorkerServerSocket,
+            args=(args.address,),
+            kwargs={"timeout_connect": args.timeout},
+        )
+        for _ in range(args.nb_servers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
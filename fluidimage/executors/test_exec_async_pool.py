@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+
+from fluidimage.topologies.base import TopologyBase
+
+from .exec_async_pool import (
+    _SharedBlock,
+    _release,
+    dumps_shared,
+    loads_shared,
+    nbytes_min_shared,
+)
+
+
+def _block_exists(name):
+    try:
+        block = _SharedBlock(name, 1)
+    except FileNotFoundError:
+        return False
+    block.close()
+    return True
+
+
+def test_dumps_loads_shared():
+    arr_big = np.arange(2 * nbytes_min_shared, dtype=np.uint8).reshape(8, -1)
+    arr_small = np.arange(4)
+    obj = ("str", arr_big, arr_big[:, ::2], arr_small, arr_big)
+
+    blocks_dump = []
+    data = dumps_shared(obj, blocks_dump)
+    # the same array is put only once in shared memory
+    assert len(blocks_dump) == 2
+    names = [block.name for block in blocks_dump]
+
+    blocks_load = []
+    obj_loaded = loads_shared(data, blocks_load)
+    assert len(blocks_load) == 2
+    assert obj_loaded[0] == "str"
+    for arr, arr_loaded in zip(obj[1:], obj_loaded[1:]):
+        assert arr_loaded.dtype == arr.dtype
+        assert np.array_equal(arr_loaded, arr)
+    assert obj_loaded[1] is obj_loaded[4]
+
+    # the blocks used by arrays can not be closed
+    if not blocks_load[0].close():
+        del obj_loaded, arr_loaded
+        assert blocks_load[0].close()
+
+    _release(blocks_load)
+    _release(blocks_dump)
+    assert not blocks_load and not blocks_dump
+    assert not any(_block_exists(name) for name in names)
+
+
+def test_loads_shared_copy():
+    arr = np.ones(nbytes_min_shared, dtype=np.float32)
+    blocks_dump = []
+    data = dumps_shared(arr, blocks_dump)
+    blocks_load = []
+    arr_loaded = loads_shared(data, blocks_load, copy=True)
+    # the blocks can be released even if the array is used
+    _release(blocks_load)
+    _release(blocks_dump)
+    assert np.array_equal(arr_loaded, arr)
+
+
+class TopologyDyingProcess(TopologyBase):
+    """The process computing the number 2 dies"""
+
+    def __init__(self, path_dir_result):
+        super().__init__(path_dir_result=path_dir_result)
+        self.results = {}
+
+        queue_numbers = self.add_queue("numbers")
+        queue_squares = self.add_queue("squares")
+
+        self.add_work(
+            "fill numbers",
+            func_or_cls=self.fill_numbers,
+            output_queue=queue_numbers,
+            kind=("global", "one shot"),
+        )
+        self.add_work(
+            "squares",
+            func_or_cls=self.compute_square,
+            input_queue=queue_numbers,
+            output_queue=queue_squares,
+        )
+        self.add_work(
+            "save", func_or_cls=self.save, input_queue=queue_squares, kind="io"
+        )
+
+    def fill_numbers(self, input_queue, output_queue):
+        for number in range(5):
+            output_queue[f"n{number}"] = number
+
+    def compute_square(self, number):
+        if number == 2:
+            os._exit(1)
+        return number ** 2, os.getpid()
+
+    def save(self, result):
+        square, pid = result
+        self.results[square] = pid
+
+
+def test_process_died(tmp_path):
+    topology = TopologyDyingProcess(tmp_path)
+    topology.compute("exec_async_pool", nb_max_workers=1)
+
+    # the item of the dead process is lost, not the next ones
+    assert sorted(topology.results) == [0, 1, 9, 16]
+    # the process has been restarted
+    assert len(set(topology.results.values())) == 2
@@ -0,0 +1,191 @@
+import os
+import socket
+import time
+from multiprocessing import AuthenticationError
+from threading import Thread
+
+import numpy as np
+import pytest
+
+from fluidimage.topologies.base import TopologyBase
+
+from .servers import (
+    SocketConnection,
+    ServerLostError,
+    WorkerSocket,
+    _LocalPipe,
+)
+
+
+def _make_connections():
+    sock0, sock1 = socket.socketpair()
+    return SocketConnection(sock0), SocketConnection(sock1)
+
+
+def _call_in_thread(func, *args):
+    results = {}
+
+    def target():
+        try:
+            results["result"] = func(*args)
+        except Exception as error:
+            results["error"] = error
+
+    thread = Thread(target=target)
+    thread.start()
+    return thread, results
+
+
+def test_socket_connection_buffers():
+    conn0, conn1 = _make_connections()
+    arr_big = np.arange(200 * 300, dtype=np.float32).reshape(200, 300)
+    obj = {
+        "big": arr_big,
+        "not_contiguous": arr_big[::2, ::3],
+        "small": np.arange(4),
+        "objects": np.array([None, "a"], dtype=object),
+        "other": ("str", 1),
+    }
+    # the send blocks until the data is received
+    thread, _ = _call_in_thread(conn0.send, obj)
+    obj_received = conn1.recv()
+    thread.join()
+
+    assert obj_received.keys() == obj.keys()
+    for key in ("big", "not_contiguous", "small"):
+        assert obj_received[key].dtype == obj[key].dtype
+        assert np.array_equal(obj_received[key], obj[key])
+    assert list(obj_received["objects"]) == [None, "a"]
+    assert obj_received["other"] == obj["other"]
+
+    conn0.close()
+    with pytest.raises(EOFError):
+        conn1.recv()
+    conn1.close()
+
+
+def test_authenticate():
+    conn0, conn1 = _make_connections()
+    thread, results = _call_in_thread(conn1.authenticate, b"key")
+    conn0.authenticate(b"key", is_listener=True)
+    thread.join()
+    assert "error" not in results
+
+    conn0.send("authenticated")
+    assert conn1.recv() == "authenticated"
+    conn0.close()
+    conn1.close()
+
+
+def test_authenticate_wrong_key():
+    conn0, conn1 = _make_connections()
+    thread, results = _call_in_thread(conn1.authenticate, b"bad key")
+    with pytest.raises(AuthenticationError):
+        conn0.authenticate(b"key", is_listener=True)
+    thread.join()
+    assert isinstance(results["error"], AuthenticationError)
+    conn0.close()
+    conn1.close()
+
+
+def test_worker_socket_server_lost():
+    conn_executor, conn_server = _make_connections()
+    worker = WorkerSocket(conn_executor)
+    pipe = _LocalPipe()
+    worker.send_job(("work", "key", np.ones(4), pipe))
+    assert conn_server.recv()[:2] == ("work", "key")
+
+    # the server dies
+    conn_server.close()
+    work_name, key, result = pipe.recv()
+    assert (work_name, key) == ("work", "key")
+    assert isinstance(result, ServerLostError)
+    assert worker.is_dead and not worker.is_available
+
+    # items sent to a dead server are returned immediately
+    worker.send_job(("work", "key1", None, pipe))
+    assert isinstance(pipe.recv()[2], ServerLostError)
+    worker.terminate()
+
+
+def test_worker_socket_heartbeat():
+    conn_executor, conn_server = _make_connections()
+    worker = WorkerSocket(conn_executor, timeout_heartbeat=0.5)
+    pipe = _LocalPipe()
+    # larger than the buffers of the sockets
+    arr = np.ones(2 ** 24)
+
+    def send_heartbeats():
+        for _ in range(10):
+            conn_server.send(("__heartbeat__",))
+            time.sleep(0.1)
+
+    # the server is alive but does not read its socket for 1 s, so the job
+    # can not be sent within timeout_heartbeat
+    thread = Thread(target=send_heartbeats)
+    thread.start()
+    thread_send, _ = _call_in_thread(
+        worker.send_job, ("work", "key", arr, pipe)
+    )
+    thread.join()
+    assert np.array_equal(conn_server.recv()[2], arr)
+    thread_send.join()
+    assert not worker.is_dead
+
+    # no more heartbeats
+    work_name, key, result = pipe.recv()
+    assert (work_name, key) == ("work", "key")
+    assert isinstance(result, ServerLostError)
+    assert worker.is_dead
+    worker.terminate()
+    conn_server.close()
+
+
+class TopologyDyingServer(TopologyBase):
+    """The first server computing an item dies"""
+
+    def __init__(self, params):
+        self.params = params
+        super().__init__(path_dir_result=params["path_dir_result"])
+        self.results = {}
+
+        queue_numbers = self.add_queue("numbers")
+        queue_squares = self.add_queue("squares")
+
+        self.add_work(
+            "fill numbers",
+            func_or_cls=self.fill_numbers,
+            output_queue=queue_numbers,
+            kind=("global", "one shot"),
+        )
+        self.add_work(
+            "squares",
+            func_or_cls=self.compute_square,
+            input_queue=queue_numbers,
+            output_queue=queue_squares,
+        )
+        self.add_work(
+            "save", func_or_cls=self.save, input_queue=queue_squares, kind="io"
+        )
+
+    def fill_numbers(self, input_queue, output_queue):
+        for number in range(4):
+            output_queue[f"n{number}"] = number
+
+    def compute_square(self, number):
+        path_marker = self.params["path_dir_result"] / "server_died"
+        if number == 2 and not path_marker.exists():
+            path_marker.touch()
+            os._exit(1)
+        return number ** 2
+
+    def save(self, square):
+        self.results[square] = square
+
+
+def test_server_lost_items_sent_again(tmp_path):
+    topology = TopologyDyingServer({"path_dir_result": tmp_path})
+    topology.compute("exec_async_servers_socket", nb_max_workers=2)
+
+    assert (tmp_path / "server_died").exists()
+    assert sorted(topology.results) == [0, 1, 4, 9]
@@ -12,6 +12,9 @@ Provides:
 
    base
    toolbox
+   streaming
+   tiles
+   fused
    image2image
 
 """
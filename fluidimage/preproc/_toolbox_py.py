@@ -82,10 +82,12 @@ def sliding_median(
         Mode of handling array borders.
 
     """
-    img_out = img - weight * ndi.median_filter(
+    img_out = weight * ndi.median_filter(
         img, size=window_size, mode=boundary_condition
     )
-    img_out[img_out < 0] = 0
+    # img - weight * filtered, without temporary array
+    np.subtract(img, img_out, out=img_out)
+    np.maximum(img_out, 0, out=img_out)
     return img_out
 
 
@@ -117,10 +119,12 @@ def sliding_percentile(
         Mode of handling array borders.
 
     """
-    img_out = img - weight * ndi.percentile_filter(
+    img_out = weight * ndi.percentile_filter(
         img, percentile, size=window_size, mode=boundary_condition
     )
-    img_out[img_out < 0] = 0
+    # img - weight * filtered, without temporary array
+    np.subtract(img, img_out, out=img_out)
+    np.maximum(img_out, 0, out=img_out)
     return img_out
 
 
@@ -146,10 +150,12 @@ def sliding_minima(
         Mode of handling array borders.
 
     """
-    img_out = img - weight * ndi.minimum_filter(
+    img_out = weight * ndi.minimum_filter(
         img, size=window_size, mode=boundary_condition
     )
-    img_out[img_out < 0] = 0
+    # img - weight * filtered, without temporary array
+    np.subtract(img, img_out, out=img_out)
+    np.maximum(img_out, 0, out=img_out)
     return img_out
 
 
@@ -202,7 +208,8 @@ def temporal_median(img=None, weight=1.0, window_shape=None):
     """
     window_shape = _calcul_windowshape(img.shape, window_shape)
 
-    img_out = img - weight * ndi.median_filter(img, size=window_shape)
+    img_out = weight * ndi.median_filter(img, size=window_shape)
+    np.subtract(img, img_out, out=img_out)
     return img_out
 
 
@@ -228,9 +235,8 @@ def temporal_percentile(img=None, percentile=10.0, weight=1.0, window_shape=None
     """
     window_shape = _calcul_windowshape(img.shape, window_shape)
 
-    img_out = img - weight * ndi.percentile_filter(
-        img, percentile, size=window_shape
-    )
+    img_out = weight * ndi.percentile_filter(img, percentile, size=window_shape)
+    np.subtract(img, img_out, out=img_out)
     return img_out
 
 
@@ -250,7 +256,8 @@ def temporal_minima(img=None, weight=1.0, window_shape=None):
 
     """
     window_shape = _calcul_windowshape(img.shape, window_shape)
-    img_out = img - weight * ndi.minimum_filter(img, size=window_shape)
+    img_out = weight * ndi.minimum_filter(img, size=window_shape)
+    np.subtract(img, img_out, out=img_out)
     return img_out
 
 
@@ -475,5 +482,7 @@ def sharpen(img=None, sigma1=3.0, sigma2=1.0, alpha=30.0):
     blurred = ndi.gaussian_filter(img, sigma1)
     filter_blurred = ndi.gaussian_filter(blurred, sigma2)
 
-    img_out = blurred + alpha * (blurred - filter_blurred)
+    # blurred + alpha * (blurred - filter_blurred), with less temporary arrays
+    img_out = alpha * (blurred - filter_blurred)
+    img_out += blurred
     return img_out
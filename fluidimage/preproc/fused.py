@@ -0,0 +1,265 @@
+"""Fused preprocessing (:mod:`fluidimage.preproc.fused`)
+=======================================================
+
+With ``params.preproc.tools.fused = True``, the images are processed in a
+float32 buffer (instead of the silent promotions to float64 of the tools):
+
+- the consecutive point-wise tools (see :data:`tools_fusable`) are applied
+  in only one pass over the buffer, with the Pythran function
+  :func:`fluidimage.preproc.pointwise_pythran.apply_pointwise_chain` (or
+  with in-place numpy operations if it is not compiled). The tools using
+  statistics of the image (``rescale_intensity`` and
+  ``rescale_intensity_tanh``) need one more (read-only) pass to compute
+  them,
+
+- the sliding filters and ``sharpen`` work in place in the buffer, with only
+  one temporary image (see :func:`apply_tool_inplace`),
+
+- the results of the other tools are converted to float32.
+
+The results are the same as without fusion, except for the rounding (the
+values are not cast to the dtype of the input images after each tool).
+
+.. autodata:: tools_fusable
+
+.. autodata:: tools_keeping_dtype
+
+.. autofunction:: get_dtype_unfused
+
+.. autofunction:: apply_pointwise_tools
+
+.. autofunction:: apply_tool_inplace
+
+"""
+
+import numpy as np
+import scipy.ndimage as ndi
+
+from . import pointwise_pythran
+from .pointwise_pythran import apply_pointwise_chain
+
+#: Tools which can be fused
+tools_fusable = (
+    "global_threshold",
+    "gamma_correction",
+    "rescale_intensity",
+    "rescale_intensity_tanh",
+)
+
+#: Tools which return images with the dtype of their input (without fusion)
+tools_keeping_dtype = (
+    "global_threshold",
+    "gamma_correction",
+    "rescale_intensity",
+)
+
+CODE_CLIP, CODE_GAMMA, CODE_AFFINE, CODE_TANH = range(4)
+
+is_pythran_compiled = hasattr(pointwise_pythran, "__pythran__")
+
+
+def _compute_scale_dtype(dtype):
+    """Scale used for the gamma correction (as in skimage.exposure)."""
+    if np.issubdtype(dtype, np.integer):
+        return float(np.iinfo(dtype).max)
+    return 1.0
+
+
+def get_dtype_unfused(tool, dtype, in_place=False):
+    """dtype of the images after a tool applied without fusion.
+
+    Parameters
+    ----------
+
+    tool : str
+
+    dtype : dtype
+
+      dtype of the images before the tool.
+
+    in_place : bool
+
+      True for a stack of images in an array, for which the results of the
+      spatial tools are written in the input array.
+
+    """
+    if tool in tools_keeping_dtype:
+        return dtype
+    if in_place and not tool.startswith("temporal_"):
+        return dtype
+    return np.dtype(np.float64)
+
+
+def _apply_chain_numpy(arr, codes, coefs):
+    """Same as apply_pointwise_chain with in-place numpy operations."""
+    for code, coef in zip(codes, coefs):
+        if code == CODE_CLIP:
+            np.clip(arr, coef[0], coef[1], out=arr)
+        elif code == CODE_GAMMA:
+            arr /= coef[0]
+            np.power(arr, coef[1], out=arr)
+            arr *= coef[0] * coef[2]
+        elif code == CODE_AFFINE:
+            arr *= coef[0]
+            arr += coef[1]
+        elif code == CODE_TANH:
+            arr /= coef[1]
+            np.tanh(arr, out=arr)
+            arr *= coef[0]
+            np.floor(arr, out=arr)
+
+
+def _apply_chain(arr, codes, coefs):
+    if not codes:
+        return
+    if is_pythran_compiled:
+        apply_pointwise_chain(
+            arr.reshape(-1),
+            np.array(codes, dtype=int),
+            np.array(coefs, dtype=np.float64),
+        )
+    else:
+        _apply_chain_numpy(arr, codes, coefs)
+
+
+def _iter_images(arr):
+    if arr.ndim == 2:
+        yield arr
+    else:
+        yield from arr
+
+
+def apply_pointwise_tools(arr, tools, dtype_input=np.float32):
+    """Apply in place a chain of point-wise tools on a float32 buffer.
+
+    For a stack of images, the chain is applied image by image (as the tools
+    without fusion), so the statistics are computed for each image.
+
+    Parameters
+    ----------
+
+    arr : np.ndarray
+
+      C-contiguous float32 array (one image or a stack of images).
+
+    tools : list
+
+      List of tuples ``(name, kwargs)`` (the names have to be in
+      :data:`tools_fusable`).
+
+    dtype_input : dtype
+
+      dtype that the images would have before these tools without fusion
+      (see :func:`get_dtype_unfused`), used for ``gamma_correction`` (as in
+      ``skimage.exposure.adjust_gamma``).
+
+    """
+    for img in _iter_images(arr):
+        _apply_pointwise_tools_image(img, tools, dtype_input)
+
+
+def _apply_pointwise_tools_image(arr, tools, dtype_input):
+    codes = []
+    coefs = []
+
+    for tool, kwargs in tools:
+        if tool == "global_threshold":
+            codes.append(CODE_CLIP)
+            coefs.append((kwargs["minima"], kwargs["maxima"], 0.0))
+        elif tool == "gamma_correction":
+            codes.append(CODE_GAMMA)
+            coefs.append(
+                (
+                    _compute_scale_dtype(dtype_input),
+                    kwargs["gamma"],
+                    kwargs["gain"],
+                )
+            )
+        elif tool == "rescale_intensity":
+            # statistics of the image after the previous operations
+            _apply_chain(arr, codes, coefs)
+            codes, coefs = [], []
+            minimum = float(arr.min())
+            maximum = float(arr.max())
+            out_min, out_max = kwargs["minima"], kwargs["maxima"]
+            if maximum > minimum:
+                coef = (out_max - out_min) / (maximum - minimum)
+            else:
+                coef = 0.0
+            codes.append(CODE_AFFINE)
+            coefs.append((coef, out_min - coef * minimum, 0.0))
+        elif tool == "rescale_intensity_tanh":
+            _apply_chain(arr, codes, coefs)
+            codes, coefs = [], []
+            threshold = kwargs["threshold"]
+            if threshold is None:
+                flat = arr.reshape(-1)
+                threshold = 2 * np.sqrt(
+                    np.einsum("i,i->", flat, flat, dtype=np.float64) / flat.size
+                )
+            if threshold == 0:
+                continue
+            maximum = float(arr.max())
+            if maximum == 0:
+                coef = 0.0
+            else:
+                coef = maximum / np.tanh(maximum / threshold)
+            codes.append(CODE_TANH)
+            coefs.append((coef, threshold, 0.0))
+        else:
+            raise ValueError(f"{tool} is not a point-wise tool.")
+
+    _apply_chain(arr, codes, coefs)
+
+
+def apply_tool_inplace(tool, kwargs, arr):
+    """Apply in place a sliding filter or ``sharpen`` on a float32 buffer.
+
+    Only one temporary image is used (for the filtered image).
+
+    Returns
+    -------
+
+    applied : bool
+
+      False if the tool can not be applied in place.
+
+    """
+    if tool == "sliding_median":
+        filter_ = ndi.median_filter
+        args = ()
+    elif tool == "sliding_minima":
+        filter_ = ndi.minimum_filter
+        args = ()
+    elif tool == "sliding_percentile":
+        filter_ = ndi.percentile_filter
+        args = (kwargs["percentile"],)
+    elif tool != "sharpen":
+        return False
+
+    tmp = None
+    for img in _iter_images(arr):
+        if tmp is None:
+            tmp = np.empty_like(img)
+
+        if tool == "sharpen":
+            # blurred + alpha * (blurred - filter_blurred)
+            alpha = kwargs["alpha"]
+            ndi.gaussian_filter(img, kwargs["sigma1"], output=tmp)
+            ndi.gaussian_filter(tmp, kwargs["sigma2"], output=img)
+            img *= -alpha
+            tmp *= 1 + alpha
+            img += tmp
+        else:
+            filter_(
+                img,
+                *args,
+                size=kwargs["window_size"],
+                mode=kwargs["boundary_condition"],
+                output=tmp,
+            )
+            tmp *= kwargs["weight"]
+            img -= tmp
+            np.maximum(img, 0, out=img)
+
+    return True
@@ -0,0 +1,44 @@
+"""Fused point-wise preprocessing tools (Pythran)
+================================================
+
+A chain of point-wise operations is applied in only one pass over the image
+(the value of each pixel is transformed by all the operations before being
+written). The operations are given by codes (see
+:mod:`fluidimage.preproc.fused`) and their coefficients:
+
+- 0: clip between ``coefs[0]`` and ``coefs[1]``,
+- 1: gamma correction ``(x / coefs[0]) ** coefs[1] * coefs[0] * coefs[2]``,
+- 2: affine transform ``coefs[0] * x + coefs[1]``,
+- 3: tanh rescaling ``floor(coefs[0] * tanh(x / coefs[1]))``.
+
+"""
+
+import numpy as np
+
+
+# pythran export apply_pointwise_chain(float32[:], int[:], float64[:, :])
+
+
+def apply_pointwise_chain(arr, codes, coefs):
+    """Apply the operations in place on a 1d (flattened) array"""
+    nb_ops = codes.size
+    for index in range(arr.size):
+        value = float(arr[index])
+        for iop in range(nb_ops):
+            code = codes[iop]
+            if code == 0:
+                if value < coefs[iop, 0]:
+                    value = coefs[iop, 0]
+                if value > coefs[iop, 1]:
+                    value = coefs[iop, 1]
+            elif code == 1:
+                value = (
+                    (value / coefs[iop, 0]) ** coefs[iop, 1]
+                    * coefs[iop, 0]
+                    * coefs[iop, 2]
+                )
+            elif code == 2:
+                value = coefs[iop, 0] * value + coefs[iop, 1]
+            elif code == 3:
+                value = np.floor(coefs[iop, 0] * np.tanh(value / coefs[iop, 1]))
+        arr[index] = value
@@ -0,0 +1,488 @@
+"""Streaming temporal filters (:mod:`fluidimage.preproc.streaming`)
+==================================================================
+
+The temporal filters of :mod:`fluidimage.preproc._toolbox_py` (for example
+``temporal_median``) are applied on 3D stacks of images. To filter a long
+series with a topology, one stack has to be built for each output image, so
+that each image is held in many stacks and the filter is computed again for
+each window.
+
+The objects of this module filter a series image by image: the images are
+pushed one at a time in a rolling window (of ``window_size`` images) and one
+output image is produced for each input image. The statistics over the window
+are updated incrementally:
+
+- minima: van Herk / Gil-Werman algorithm (suffix minima of the previous block
+  of ``window_size`` images and running minimum of the current block), i.e.
+  about 3 operations per pixel and per image, whatever the window size,
+
+- median and percentiles: the window is kept sorted along the time axis and
+  updated in place with one deletion and one insertion per image (no sort
+  and no branch, by chunks of pixels).
+
+The results are the same as with the temporal filters of
+:mod:`fluidimage.preproc._toolbox_py` applied on the whole series with the
+window ``(window_size, 1, 1)`` (the boundaries of the series are treated as
+with the mode "reflect" of :mod:`scipy.ndimage`).
+
+.. autoclass:: TemporalFilterStream
+   :members:
+
+.. autoclass:: TemporalFiltersChain
+   :members:
+
+.. autofunction:: make_temporal_filters_chain
+
+.. autofunction:: check_temporal_tools_first
+
+"""
+
+from collections import deque
+
+import numpy as np
+import scipy.ndimage as ndi
+
+kinds_temporal_tools = {
+    "temporal_minima": "minima",
+    "temporal_median": "median",
+    "temporal_percentile": "percentile",
+}
+
+
+class _RollingMinima:
+    """Minima over the last images (van Herk / Gil-Werman algorithm)."""
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self._nb_frames = 0
+        self._block = []
+        self._prefix_minimum = None
+        self._suffix_minima = None
+
+    def push(self, frame):
+        """Push a frame and return the minimum over the window (or None)."""
+        size = self.window_size
+        index_in_block = self._nb_frames % size
+        self._nb_frames += 1
+        self._block.append(frame)
+
+        if index_in_block == 0:
+            self._prefix_minimum = frame.copy()
+        else:
+            np.minimum(self._prefix_minimum, frame, out=self._prefix_minimum)
+
+        if index_in_block == size - 1:
+            # the window is the whole block, we compute the suffix minima used
+            # for the next windows
+            suffix_minima = np.empty((size,) + frame.shape, dtype=frame.dtype)
+            suffix_minima[-1] = frame
+            for index in range(size - 2, -1, -1):
+                np.minimum(
+                    suffix_minima[index + 1],
+                    self._block[index],
+                    out=suffix_minima[index],
+                )
+            self._suffix_minima = suffix_minima
+            self._block = []
+            return self._prefix_minimum
+
+        if self._suffix_minima is None:
+            return None
+
+        return np.minimum(
+            self._suffix_minima[index_in_block + 1], self._prefix_minimum
+        )
+
+
+def _select(out, where, values_true, values_false, where_not, tmp):
+    """Branchless and exact ``np.where`` (``where`` is an uint8 array)
+
+    With random masks, ``np.copyto(..., where=...)``, ``np.where`` and
+    ``np.minimum`` are much slower than multiplications (branch
+    mispredictions). ``out`` can be ``values_true`` or ``values_false``.
+
+    """
+    np.logical_not(where, out=where_not)
+    np.multiply(values_false, where_not, out=tmp)
+    np.multiply(values_true, where, out=out)
+    out += tmp
+
+
+class _RollingRank:
+    """Order statistic over the last images (window kept sorted)."""
+
+    # number of pixels updated together (so that the data stay in the cache)
+    size_chunk = 2 ** 14
+
+    def __init__(self, window_size, rank):
+        self.window_size = window_size
+        self.rank = rank
+        self._frames = deque()
+        self._sorted = None
+
+    def push(self, frame):
+        """Push a frame and return the statistic over the window (or None).
+
+        The returned array is overwritten by the next call.
+
+        """
+        frames = self._frames
+        frames.append(frame)
+
+        if self._sorted is None:
+            if len(frames) < self.window_size:
+                return None
+            self._sorted = np.sort(np.array(frames), axis=0)
+            size_chunk = min(self.size_chunk, frame.size)
+            self._buffers = np.empty((3, size_chunk), dtype=self._sorted.dtype)
+            self._masks = np.empty((2, size_chunk), dtype=np.uint8)
+        else:
+            self._replace(frames.popleft(), frame)
+
+        return self._sorted[self.rank]
+
+    def _replace(self, old, new):
+        """Remove ``old`` from the sorted window and insert ``new`` (in place).
+
+        The sorted window is updated chunk by chunk of pixels and level by
+        level (from the smallest values), so that the temporary arrays are
+        small. Without old, the value at the level ``index`` is
+        ``sorted[index]`` if it is smaller than old and ``sorted[index + 1]``
+        otherwise. Then, the value with new is
+        ``max(without_old[index - 1], min(without_old[index], new))``.
+
+        """
+        sorted_ = self._sorted.reshape(self.window_size, -1)
+        old = np.ravel(old)
+        new = np.ravel(new)
+        last = self.window_size - 1
+
+        for start in range(0, old.size, self.size_chunk):
+            chunk = slice(start, start + self.size_chunk)
+            sorted_chunk = sorted_[:, chunk]
+            old_chunk = old[chunk]
+            new_chunk = new[chunk]
+            size = old_chunk.size
+            without_old, without_old_previous, tmp = self._buffers[:, :size]
+            where, where_not = self._masks[:, :size]
+
+            for index in range(last + 1):
+                values = sorted_chunk[index]
+                if index < last:
+                    # value of the sorted window without old
+                    np.less(values, old_chunk, out=where)
+                    _select(
+                        without_old,
+                        where,
+                        values,
+                        sorted_chunk[index + 1],
+                        where_not,
+                        tmp,
+                    )
+                    # min(without_old, new) (sorted_chunk[index + 1] is not
+                    # yet modified)
+                    np.less(without_old, new_chunk, out=where)
+                    _select(
+                        values, where, without_old, new_chunk, where_not, tmp
+                    )
+                else:
+                    values[...] = new_chunk
+                if index > 0:
+                    # max(values, without_old_previous)
+                    np.less(values, without_old_previous, out=where)
+                    _select(
+                        values,
+                        where,
+                        without_old_previous,
+                        values,
+                        where_not,
+                        tmp,
+                    )
+                without_old, without_old_previous = (
+                    without_old_previous,
+                    without_old,
+                )
+
+
+class TemporalFilterStream:
+    """Temporal filter applied image by image on a series of images.
+
+    Parameters
+    ----------
+
+    kind : str {'minima', 'median', 'percentile'}
+
+    window_size : int
+
+      Number of images in the rolling window (centered as for the filters of
+      :mod:`scipy.ndimage`).
+
+    weight : float
+
+      Fraction of the statistics to be subtracted from each pixel.
+
+    percentile : float
+
+      Percentile (only for ``kind='percentile'``).
+
+    spatial_size : None or tuple
+
+      Spatial size of the window (only supported for the minima, since the
+      minimum over a box can be computed in time and then in space).
+
+    Notes
+    -----
+
+    The images are given one at a time with :func:`push` and the filtered
+    images are returned in the same order (but with a delay of about half the
+    window size). The last filtered images are returned by :func:`flush`,
+    which has to be called at the end of the series.
+
+    """
+
+    def __init__(
+        self,
+        kind,
+        window_size,
+        weight=1.0,
+        percentile=None,
+        spatial_size=None,
+    ):
+        window_size = int(window_size)
+        if window_size <= 1:
+            raise ValueError(
+                "Need more than one image to apply temporal filtering "
+                "(use sliding filter?)."
+            )
+
+        if spatial_size is not None and all(n == 1 for n in spatial_size):
+            spatial_size = None
+
+        if spatial_size is not None and kind != "minima":
+            raise NotImplementedError(
+                "Streaming temporal filters with a spatial window are only "
+                "implemented for the minima."
+            )
+
+        if kind == "minima":
+            self._statistic = _RollingMinima(window_size)
+        elif kind == "median":
+            self._statistic = _RollingRank(window_size, window_size // 2)
+        elif kind == "percentile":
+            if percentile == 100:
+                rank = window_size - 1
+            else:
+                rank = int(window_size * percentile / 100.0)
+            self._statistic = _RollingRank(window_size, rank)
+        else:
+            raise ValueError(
+                "kind should be in ['minima', 'median', 'percentile']"
+            )
+
+        self.kind = kind
+        self.window_size = window_size
+        self.weight = weight
+        self.percentile = percentile
+        self.spatial_size = spatial_size
+
+        self._half = window_size // 2
+        self._window = deque(maxlen=window_size)
+        # the first images are kept to reflect the series at its beginning
+        self._first_frames = []
+
+    def push(self, frame):
+        """Push an image and return a list of filtered images (maybe empty)."""
+        if self._first_frames is None:
+            return self._push_virtual(frame)
+
+        self._first_frames.append(frame)
+        if len(self._first_frames) < self.window_size:
+            return []
+
+        frames = self._first_frames
+        self._first_frames = None
+        results = []
+        for frame_virtual in frames[: self._half][::-1] + frames:
+            results.extend(self._push_virtual(frame_virtual))
+        return results
+
+    def flush(self):
+        """Return the last filtered images (end of the series)."""
+        if self._first_frames is not None:
+            # less images than the window size
+            frames = self._first_frames
+            self._first_frames = None
+            if not frames:
+                return []
+            statistics = self._filter_stack(np.array(frames))
+            return [
+                self._compute_output(frame, statistic)
+                for frame, statistic in zip(frames, statistics)
+            ]
+
+        nb_frames_end = self.window_size - self._half - 1
+        frames_end = list(self._window)[::-1][:nb_frames_end]
+        results = []
+        for frame_virtual in frames_end:
+            results.extend(self._push_virtual(frame_virtual))
+        return results
+
+    def _push_virtual(self, frame):
+        """Push an image of the series extended by reflection."""
+        self._window.append(frame)
+        statistic = self._statistic.push(frame)
+        if statistic is None:
+            return []
+        return [self._compute_output(self._window[self._half], statistic)]
+
+    def _compute_output(self, frame, statistic):
+        if self.spatial_size is not None:
+            statistic = ndi.minimum_filter(statistic, size=self.spatial_size)
+        return frame - self.weight * statistic
+
+    def _filter_stack(self, stack):
+        """Compute the statistics with scipy.ndimage (short series)."""
+        size = (self.window_size,) + (1,) * (stack.ndim - 1)
+        if self.kind == "minima":
+            return ndi.minimum_filter(stack, size=size)
+        elif self.kind == "median":
+            return ndi.median_filter(stack, size=size)
+        else:
+            return ndi.percentile_filter(stack, self.percentile, size=size)
+
+
+class TemporalFiltersChain:
+    """Chain of streaming temporal filters.
+
+    Parameters
+    ----------
+
+    filters : list of :class:`TemporalFilterStream`
+
+    """
+
+    def __init__(self, filters):
+        self.filters = filters
+
+    def push(self, frame):
+        """Push an image and return a list of filtered images (maybe empty)."""
+        return self._push_from(0, [frame])
+
+    def flush(self):
+        """Return the last filtered images (end of the series)."""
+        frames = []
+        for filter_ in self.filters:
+            frames = self._push_in(filter_, frames) + filter_.flush()
+        return frames
+
+    def _push_from(self, index_filter, frames):
+        for filter_ in self.filters[index_filter:]:
+            frames = self._push_in(filter_, frames)
+        return frames
+
+    @staticmethod
+    def _push_in(filter_, frames):
+        return [result for frame in frames for result in filter_.push(frame)]
+
+
+def check_temporal_tools_first(params_tools):
+    """Check that the enabled temporal tools are before the other tools.
+
+    The streaming filters are applied before the other tools, so a sequence
+    with an enabled temporal tool after another enabled tool (including the
+    default sequence ``available_tools``) can not be processed in streaming
+    mode.
+
+    Raises
+    ------
+
+    ValueError
+
+    """
+    sequence = params_tools.sequence
+    if sequence is None:
+        sequence = params_tools.available_tools
+
+    tool_not_temporal = None
+    for tool in sequence:
+        if not params_tools[tool].enable:
+            continue
+        if tool not in kinds_temporal_tools:
+            if tool_not_temporal is None:
+                tool_not_temporal = tool
+        elif tool_not_temporal is not None:
+            raise ValueError(
+                f"The temporal tool {tool} is after the tool "
+                f"{tool_not_temporal} but the temporal tools are applied "
+                "first in streaming mode (reorder "
+                "params.preproc.tools.sequence)."
+            )
+
+
+def make_temporal_filters_chain(params_tools, nb_images_default=None):
+    """Create a chain of streaming filters from the preprocessing parameters.
+
+    Parameters
+    ----------
+
+    params_tools : :class:`fluiddyn.util.paramcontainer.ParamContainer`
+
+      The parameters ``params.preproc.tools``. The enabled temporal tools are
+      used in the order of ``sequence``.
+
+    nb_images_default : None or int
+
+      Number of images in the window when the parameter ``window_shape`` of a
+      tool does not define it.
+
+    Raises
+    ------
+
+    ValueError
+
+      If an enabled temporal tool is after another enabled tool (see
+      :func:`check_temporal_tools_first`).
+
+    """
+    check_temporal_tools_first(params_tools)
+
+    sequence = params_tools.sequence
+    if sequence is None:
+        sequence = params_tools.available_tools
+
+    filters = []
+    for tool in sequence:
+        if tool not in kinds_temporal_tools or not params_tools[tool].enable:
+            continue
+
+        params_tool = params_tools[tool]
+        window_shape = params_tool.window_shape
+        spatial_size = None
+        if window_shape is None:
+            window_size = nb_images_default
+        elif isinstance(window_shape, int):
+            window_size = window_shape
+        elif len(window_shape) == 2:
+            window_size = nb_images_default
+            spatial_size = tuple(window_shape)
+        else:
+            window_size = window_shape[0]
+            spatial_size = tuple(window_shape[1:])
+
+        if window_size is None:
+            raise ValueError(
+                f"The window size of the tool {tool} has to be given "
+                f"(params.preproc.tools.{tool}.window_shape)."
+            )
+
+        filters.append(
+            TemporalFilterStream(
+                kinds_temporal_tools[tool],
+                window_size,
+                weight=params_tool.weight,
+                percentile=getattr(params_tool, "percentile", None),
+                spatial_size=spatial_size,
+            )
+        )
+
+    return TemporalFiltersChain(filters)
@@ -0,0 +1,99 @@
+import numpy as np
+
+from .base import PreprocBase
+from .fused import _apply_chain_numpy, apply_pointwise_chain
+
+
+def test_fused():
+    img = 100 * np.random.rand(40, 50)
+
+    params = PreprocBase.create_default_params()
+    params.preproc.tools.sequence = [
+        "global_threshold",
+        "sliding_median",
+        "gamma_correction",
+        "rescale_intensity",
+        "sharpen",
+        "rescale_intensity_tanh",
+        "sliding_minima",
+        "equalize_hist_global",
+    ]
+    for tool in params.preproc.tools.sequence:
+        params.preproc.tools[tool].enable = True
+    params.preproc.tools.global_threshold.maxima = 90.0
+    params.preproc.tools.gamma_correction.gamma = 0.8
+    params.preproc.tools.rescale_intensity.maxima = 100.0
+    params.preproc.tools.rescale_intensity_tanh.threshold = 40.0
+
+    tools = PreprocBase._Tools(params)
+    # without equalize_hist_global (less sensitive to rounding)
+    params.preproc.tools.equalize_hist_global.enable = False
+    result = tools(img.copy())
+
+    params.preproc.tools.fused = True
+    result_fused = tools(img.copy())
+    assert result_fused.dtype == np.float32
+    # floor in rescale_intensity_tanh
+    assert abs(result_fused - result).max() <= 1.0
+    assert np.allclose(result_fused, result, atol=1.0)
+    assert abs(result_fused - result).mean() < 0.1
+
+    # multiple images (with different statistics)
+    imgs = 100 * np.random.rand(2, 40, 50)
+    imgs[1] *= 0.5
+    params.preproc.tools.fused = False
+    result = tools(imgs.copy())
+    params.preproc.tools.fused = True
+    result_fused = tools(imgs.copy())
+    assert result_fused.shape == imgs.shape
+    assert np.allclose(result_fused, result, atol=1.0)
+    assert abs(result_fused - result).mean() < 0.1
+
+    # with tiles and multiple images
+    params.preproc.tools.equalize_hist_global.enable = True
+    params.preproc.tools.tile_shape = 16
+    imgs = np.random.randint(0, 256, (2, 40, 50)).astype(np.uint8)
+    result_fused = tools(imgs)
+    assert result_fused.dtype == np.float32
+    assert result_fused.shape == imgs.shape
+
+
+def test_fused_gamma_integer():
+    """The scale of gamma_correction is given by the dtype of the images at
+    this point of the chain without fusion (float after sliding_median)"""
+    img = np.random.randint(0, 60000, (40, 50)).astype(np.uint16)
+
+    params = PreprocBase.create_default_params()
+    params.preproc.tools.sequence = ["sliding_median", "gamma_correction"]
+    for tool in params.preproc.tools.sequence:
+        params.preproc.tools[tool].enable = True
+    params.preproc.tools.sliding_median.window_size = 5
+    params.preproc.tools.gamma_correction.gamma = 0.5
+
+    tools = PreprocBase._Tools(params)
+    result = tools(img.copy())
+    params.preproc.tools.fused = True
+    result_fused = tools(img.copy())
+    assert np.allclose(result_fused, result, rtol=1e-4, atol=1e-2)
+
+    # stack of images: the results are written in the uint16 array
+    imgs = np.random.randint(0, 60000, (2, 40, 50)).astype(np.uint16)
+    params.preproc.tools.fused = False
+    result = tools(imgs.copy())
+    assert result.dtype == np.uint16
+    params.preproc.tools.fused = True
+    result_fused = tools(imgs.copy())
+    assert np.allclose(result_fused, result, atol=1.0)
+
+
+def test_apply_pointwise_chain():
+    arr = np.random.rand(100).astype(np.float32)
+    codes = np.array([0, 1, 2, 3])
+    coefs = np.array(
+        [[0.1, 0.9, 0.0], [1.0, 0.5, 2.0], [3.0, 1.0, 0.0], [10.0, 5.0, 0.0]]
+    )
+    arr_numpy = arr.copy()
+    _apply_chain_numpy(arr_numpy, codes, coefs)
+    apply_pointwise_chain(arr, codes, coefs)
+    # floor in the last operation
+    assert np.allclose(arr, arr_numpy, atol=1.0)
@@ -0,0 +1,75 @@
+import numpy as np
+import scipy.ndimage as ndi
+
+import pytest
+
+from fluidimage.preproc.base import PreprocBase
+
+from .streaming import (
+    TemporalFilterStream,
+    TemporalFiltersChain,
+    make_temporal_filters_chain,
+)
+
+
+def _filter_stream(filter_stream, stack):
+    results = []
+    for frame in stack:
+        results.extend(filter_stream.push(frame))
+    results.extend(filter_stream.flush())
+    return np.array(results)
+
+
+def test_streaming_vs_ndimage():
+    stack = np.random.randint(0, 50, (20, 4, 5)).astype(np.uint16)
+    for nb_images in (3, 20):
+        for window_size in (2, 5, 8):
+            size = (window_size, 1, 1)
+            stats = {
+                "minima": ndi.minimum_filter(stack[:nb_images], size=size),
+                "median": ndi.median_filter(stack[:nb_images], size=size),
+                "percentile": ndi.percentile_filter(
+                    stack[:nb_images], 20, size=size
+                ),
+            }
+            for kind, stat in stats.items():
+                filter_stream = TemporalFilterStream(
+                    kind, window_size, weight=0.5, percentile=20
+                )
+                result = _filter_stream(filter_stream, stack[:nb_images])
+                assert np.allclose(result, stack[:nb_images] - 0.5 * stat)
+
+
+def test_streaming_chain():
+    stack = np.random.rand(12, 6, 6)
+    chain = TemporalFiltersChain(
+        [
+            TemporalFilterStream("median", 3),
+            TemporalFilterStream("minima", 4, spatial_size=(3, 3)),
+        ]
+    )
+    result = _filter_stream(chain, stack)
+
+    tmp = stack - ndi.median_filter(stack, size=(3, 1, 1))
+    expected = tmp - ndi.minimum_filter(tmp, size=(4, 3, 3))
+    assert np.allclose(result, expected)
+
+
+def test_streaming_temporal_tools_first():
+    params = PreprocBase.create_default_params()
+    tools = params.preproc.tools
+    tools.temporal_median.enable = True
+    tools.temporal_median.window_shape = 3
+    tools.sliding_median.enable = True
+
+    tools.sequence = ["temporal_median", "sliding_median"]
+    assert len(make_temporal_filters_chain(tools).filters) == 1
+
+    tools.sequence = ["sliding_median", "temporal_median"]
+    with pytest.raises(ValueError):
+        make_temporal_filters_chain(tools)
+
+    # default sequence (sliding tools before temporal tools)
+    tools.sequence = None
+    with pytest.raises(ValueError):
+        make_temporal_filters_chain(tools)
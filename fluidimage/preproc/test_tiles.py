@@ -0,0 +1,44 @@
+import numpy as np
+
+from .base import PreprocBase
+from .tiles import apply_tiled, group_tools
+
+
+def test_apply_tiled():
+    img = np.random.rand(50, 70)
+    tools = [
+        ("sliding_median", {"window_size": 5}),
+        ("global_threshold", {"minima": 0.1, "maxima": 0.9}),
+        ("sharpen", {"sigma1": 2.0, "sigma2": 1.0}),
+        ("rescale_intensity", {}),
+    ]
+    groups = group_tools(tools)
+    assert [halo for halo, _ in groups] == [2 + 0 + 8 + 4, None]
+
+    params = PreprocBase.create_default_params()
+    params.preproc.tools.sequence = [tool for tool, _ in tools]
+    for tool in ("sliding_median", "global_threshold", "sharpen"):
+        params.preproc.tools[tool].enable = True
+    params.preproc.tools.sliding_median.window_size = 5
+    params.preproc.tools.global_threshold.maxima = 0.9
+    params.preproc.tools.sharpen.sigma1 = 2.0
+
+    tools = PreprocBase._Tools(params)
+    result = tools(img.copy())
+
+    params.preproc.tools.tile_shape = (16, 20)
+    for nb_workers in (1, 2):
+        params.preproc.tools.nb_workers = nb_workers
+        assert np.allclose(tools(img.copy()), result)
+
+    # multiple images
+    imgs = np.random.randint(0, 256, (2, 50, 70)).astype(np.uint8)
+    params.preproc.tools.tile_shape = None
+    result = tools(imgs.copy())
+    params.preproc.tools.tile_shape = 16
+    assert np.array_equal(tools(imgs.copy()), result)
+
+
+def test_apply_tiled_small_image():
+    img = np.random.rand(10, 10)
+    assert np.array_equal(apply_tiled(np.sqrt, img, 0, 32), np.sqrt(img))
@@ -0,0 +1,163 @@
+"""Tiled preprocessing (:mod:`fluidimage.preproc.tiles`)
+=======================================================
+
+The spatial filters of :mod:`fluidimage.preproc._toolbox_py` can be applied
+tile by tile. The image is split in tiles and each tile is extended by a halo
+large enough so that the result on the tile (without the halo) is exactly the
+result obtained on the whole image. The tiles are small enough to stay in the
+CPU cache during a chain of tools and they are computed in parallel in a pool
+of threads (the functions of :mod:`scipy.ndimage` release the GIL).
+
+.. autofunction:: compute_halo
+
+.. autofunction:: group_tools
+
+.. autofunction:: apply_tiled
+
+"""
+
+import numpy as np
+
+from ..util.util import get_thread_pool
+
+#: Tools depending only on the value of each pixel
+tools_pointwise = ("global_threshold", "gamma_correction")
+
+
+def _radius_gaussian(sigma, truncate=4.0):
+    """Radius of the kernel of scipy.ndimage.gaussian_filter"""
+    return int(truncate * float(sigma) + 0.5)
+
+
+def compute_halo(tool, kwargs):
+    """Compute the halo needed to apply a tool on tiles.
+
+    Returns None if the tool can not be applied on tiles (for example when it
+    depends on global statistics of the image).
+
+    """
+    if tool in tools_pointwise:
+        return 0
+    elif tool.startswith("sliding_"):
+        if kwargs.get("boundary_condition") == "wrap":
+            return None
+        return int(np.max(kwargs["window_size"])) // 2
+    elif tool == "sharpen":
+        return _radius_gaussian(kwargs["sigma1"]) + _radius_gaussian(
+            kwargs["sigma2"]
+        )
+    return None
+
+
+def group_tools(tools):
+    """Group the consecutive tools which can be applied on tiles.
+
+    Parameters
+    ----------
+
+    tools : list
+
+      List of tuples ``(name, kwargs)``.
+
+    Returns
+    -------
+
+    groups : list
+
+      List of tuples ``(halo, tools)``. The halo is None for the tools that
+      have to be applied on the whole image (one tool per group).
+
+    """
+    groups = []
+    for tool, kwargs in tools:
+        halo = compute_halo(tool, kwargs)
+        if halo is None:
+            groups.append((None, [(tool, kwargs)]))
+        elif groups and groups[-1][0] is not None:
+            halo_group, tools_group = groups[-1]
+            groups[-1] = (halo_group + halo, tools_group + [(tool, kwargs)])
+        else:
+            groups.append((halo, [(tool, kwargs)]))
+    return groups
+
+
+def _compute_tile_slices(start, stop, halo, size):
+    """Slices of the extended tile and of the tile in the extended tile."""
+    start_ext = max(start - halo, 0)
+    stop_ext = min(stop + halo, size)
+    return (
+        slice(start_ext, stop_ext),
+        slice(start - start_ext, stop - start_ext),
+    )
+
+
+def apply_tiled(func, img, halo, tile_shape, nb_workers=1):
+    """Apply a function on a 2d image tile by tile.
+
+    Parameters
+    ----------
+
+    func : callable
+
+      Function taking and returning a 2d array of the same shape. It must not
+      modify its argument (the extended tiles overlap).
+
+    img : np.ndarray
+
+      2d array.
+
+    halo : int
+
+      Number of pixels added around each tile.
+
+    tile_shape : int or tuple
+
+      Shape of the tiles (without the halo).
+
+    nb_workers : int
+
+      Number of threads used to compute the tiles.
+
+    """
+    if isinstance(tile_shape, int):
+        tile_shape = (tile_shape, tile_shape)
+
+    ny, nx = img.shape
+    tile_ny, tile_nx = tile_shape
+    if tile_ny >= ny and tile_nx >= nx:
+        return func(img)
+
+    tiles = [
+        (slice(iy, min(iy + tile_ny, ny)), slice(ix, min(ix + tile_nx, nx)))
+        for iy in range(0, ny, tile_ny)
+        for ix in range(0, nx, tile_nx)
+    ]
+
+    def compute_tile(tile):
+        slice_y, slice_x = tile
+        slice_y_ext, slice_y_in_ext = _compute_tile_slices(
+            slice_y.start, slice_y.stop, halo, ny
+        )
+        slice_x_ext, slice_x_in_ext = _compute_tile_slices(
+            slice_x.start, slice_x.stop, halo, nx
+        )
+        result = func(img[slice_y_ext, slice_x_ext])
+        return result[slice_y_in_ext, slice_x_in_ext]
+
+    # the first tile gives the dtype of the output
+    result = compute_tile(tiles[0])
+    img_out = np.empty(img.shape, dtype=result.dtype)
+    img_out[tiles[0]] = result
+
+    def compute_and_write_tile(tile):
+        img_out[tile] = compute_tile(tile)
+
+    if nb_workers == 1:
+        for tile in tiles[1:]:
+            compute_and_write_tile(tile)
+    else:
+        pool = get_thread_pool(nb_workers, "preproc")
+        # list to get the exceptions raised in the threads
+        list(pool.map(compute_and_write_tile, tiles[1:]))
+
+    return img_out
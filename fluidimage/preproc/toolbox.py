@@ -18,7 +18,17 @@ Provides:
 """
 
 import inspect
+
+import numpy as np
+
 from ..util import logger
+from .tiles import group_tools, apply_tiled
+from .fused import (
+    tools_fusable,
+    get_dtype_unfused,
+    apply_pointwise_tools,
+    apply_tool_inplace,
+)
 
 
 class PreprocToolsBase:
@@ -87,7 +97,7 @@ class PreprocToolsBase:
     def __init__(self, params):
         self.params = params.preproc.tools
 
-    def __call__(self, img):
+    def __call__(self, img, skip_temporal=False):
         """
         Apply all preprocessing tools for which `enable` is `True`.
         Return the preprocessed image (numpy array).
@@ -96,29 +106,56 @@ class PreprocToolsBase:
         ----------
         img : array_like
             Single image as numpy array or multiple images as array-like object
+        skip_temporal : bool
+            If True, the temporal tools are not applied (they are applied
+            before with streaming filters, see
+            :mod:`fluidimage.preproc.streaming`).
 
         """
+        for tool, kwargs in self._get_enabled_tools(skip_temporal):
+            img = self._apply_tool(tool, kwargs, img)
+
+        return img
+
+    def _get_enabled_tools(self, skip_temporal=False):
+        """List of tuples ``(name, kwargs)`` of the enabled tools (in order)."""
         sequence = self.params.sequence
         if sequence is None:
             sequence = self.params.available_tools
 
+        tools = []
         for tool in sequence:
+            if skip_temporal and tool.startswith("temporal_"):
+                continue
             tool_params = self.params[tool]
             if tool_params.enable:
-                logger.debug("Apply " + tool)
                 kwargs = tool_params._make_dict_attribs()
                 for k in list(kwargs.keys()):
                     if k == "enable":
                         kwargs.pop(k)
+                tools.append((tool, kwargs))
+        return tools
 
-                cls = self.__class__
-                img = cls.__dict__[tool](img, **kwargs)
+    def _apply_tool(self, tool, kwargs, img):
+        logger.debug("Apply " + tool)
+        return self._get_tool_function(tool)(img, **kwargs)
 
-        return img
+    def _get_tool_function(self, tool):
+        return self.__class__.__dict__[tool]
 
 
 class PreprocToolsPy(PreprocToolsBase):
-    """Wrapper class for functions in _toolbox_py module."""
+    """Wrapper class for functions in _toolbox_py module.
+
+    If ``params.preproc.tools.tile_shape`` is not None, the consecutive
+    enabled tools which can be applied on tiles are applied together tile by
+    tile (see :mod:`fluidimage.preproc.tiles`).
+
+    If ``params.preproc.tools.fused`` is True, the images are processed in a
+    float32 buffer and the consecutive point-wise tools are fused (see
+    :mod:`fluidimage.preproc.fused`).
+
+    """
 
     @classmethod
     def _get_backend(cls):
@@ -126,6 +163,152 @@ class PreprocToolsPy(PreprocToolsBase):
 
         return tools
 
+    @classmethod
+    def create_default_params(cls, params):
+        """Create default parameters from the function argument list.
+
+        """
+        super().create_default_params(params)
+        params.preproc.tools._set_attribs(
+            {"tile_shape": None, "nb_workers": 1, "fused": False}
+        )
+        params.preproc.tools._set_doc(
+            """
+Parameters of the preprocessing tools.
+
+sequence : None or list
+    Order in which the enabled tools are applied. If None, the order of
+    `available_tools` is used.
+
+tile_shape : None, int or tuple
+    If it is not None, the spatial filters and the point-wise tools are
+    applied tile by tile (the tiles are extended by halos depending on the
+    sizes of the filters, so that the result is the same). Tiles of a few
+    hundred pixels stay in the CPU cache for a chain of tools.
+
+nb_workers : int (1)
+    Number of threads used to compute the tiles.
+
+fused : bool (False)
+    If True, the images are processed in a float32 buffer (the output images
+    are float32 arrays), the consecutive point-wise tools are applied in only
+    one pass over the image and the sliding filters work in place.
+
+"""
+        )
+
+    def __call__(self, img, skip_temporal=False):
+        """
+        Apply all preprocessing tools for which `enable` is `True`.
+        Return the preprocessed image (numpy array).
+
+        Parameters
+        ----------
+        img : array_like
+            Single image as numpy array or multiple images as array-like object
+        skip_temporal : bool
+            If True, the temporal tools are not applied.
+
+        """
+        tile_shape = self.params.tile_shape
+        fused = self.params.fused
+        if tile_shape is None and not fused:
+            return super().__call__(img, skip_temporal)
+
+        tools = self._get_enabled_tools(skip_temporal)
+        if tile_shape is None:
+            groups = [(None, [tool]) for tool in tools]
+        else:
+            groups = group_tools(tools)
+
+        if not fused:
+            for halo, tools in groups:
+                if halo is None:
+                    for tool, kwargs in tools:
+                        img = self._apply_tool(tool, kwargs, img)
+                else:
+                    img = self._apply_tools_tiled(tools, img, halo, tile_shape)
+            return img
+
+        # dtype of the images at each step without fusion (for the scale of
+        # gamma_correction)
+        if isinstance(img, np.ndarray):
+            dtype_unfused = img.dtype
+            in_place = img.ndim == 3
+        else:
+            dtype_unfused = np.asarray(img[0]).dtype
+            in_place = False
+        # the buffer modified in place
+        img = np.array(img, dtype=np.float32)
+
+        for halo, tools in self._group_fusable_tools(groups):
+            if halo == "fused":
+                logger.debug(
+                    "Apply fused " + ", ".join(tool for tool, _ in tools)
+                )
+                apply_pointwise_tools(img, tools, dtype_unfused)
+                continue
+
+            for tool, _ in tools:
+                dtype_unfused = get_dtype_unfused(tool, dtype_unfused, in_place)
+
+            if halo is not None:
+                img = self._apply_tools_tiled(tools, img, halo, tile_shape)
+                img = np.asarray(img, dtype=np.float32)
+            else:
+                tool, kwargs = tools[0]
+                if not apply_tool_inplace(tool, kwargs, img):
+                    img = self._apply_tool(tool, kwargs, img)
+                    img = np.ascontiguousarray(img, dtype=np.float32)
+
+        return img
+
+    @staticmethod
+    def _group_fusable_tools(groups):
+        """Group the consecutive point-wise tools (the halo is "fused")."""
+        groups_fused = []
+        for halo, tools in groups:
+            if all(tool in tools_fusable for tool, _ in tools):
+                if groups_fused and groups_fused[-1][0] == "fused":
+                    groups_fused[-1][1].extend(tools)
+                else:
+                    groups_fused.append(("fused", list(tools)))
+            else:
+                groups_fused.append((halo, tools))
+        return groups_fused
+
+    def _apply_tools_tiled(self, tools, img, halo, tile_shape):
+        """Apply tools on tiles of one image or of multiple images."""
+        nb_workers = self.params.nb_workers
+        logger.debug("Apply on tiles " + ", ".join(tool for tool, _ in tools))
+        functions = [
+            (self._get_tool_function(tool), kwargs) for tool, kwargs in tools
+        ]
+
+        if isinstance(img, np.ndarray) and img.ndim == 2:
+
+            def func(tile):
+                for function, kwargs in functions:
+                    tile = function(tile, **kwargs)
+                return tile
+
+            return apply_tiled(func, img, halo, tile_shape, nb_workers)
+
+        # as with the decorator iterate_multiple_imgs, the results of each
+        # tool are written in the input array (so with its dtype)
+        dtype = getattr(img, "dtype", None)
+
+        def func(tile):
+            for function, kwargs in functions:
+                tile = function(tile, **kwargs)
+                if dtype is not None:
+                    tile = tile.astype(dtype, copy=False)
+            return tile
+
+        for index, image in enumerate(img):
+            img[index] = apply_tiled(func, image, halo, tile_shape, nb_workers)
+        return img
+
 
 PreprocToolsPy._complete_class_with_tools()
 
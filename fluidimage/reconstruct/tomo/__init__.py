@@ -7,11 +7,25 @@ Provides:
    :toctree:
 
    mlos
+   mart
 
 .. autoclass:: TomoMLOSCV
    :members:
    :private-members:
 
+.. autoclass:: TomoMLOSCVBilinear
+   :members:
+   :private-members:
+
+.. autoclass:: TomoMLOSCVBicubic
+   :members:
+   :private-members:
+
+.. autoclass:: TomoMARTCV
+   :members:
+   :private-members:
+
 
 """
-from .mlos import TomoMLOSCV
+from .mlos import TomoMLOSCV, TomoMLOSCVBilinear, TomoMLOSCVBicubic
+from .mart import TomoMARTCV
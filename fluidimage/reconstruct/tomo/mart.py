@@ -0,0 +1,221 @@
+"""MART (Multiplicative Algebraic Reconstruction Technique)
+==========================================================
+
+Iterative reconstruction initialized with MLOS and computed only on the
+active voxels (see :func:`TomoMLOSBase.reconstruct_sparse`).
+
+Each voxel contributes to the 4 pixels surrounding its projection on a camera
+(bilinear weights computed from the cached projection maps). At each
+iteration, the images are projected from the voxel intensities and the
+intensities are corrected multiplicatively::
+
+    E <- E * prod_pixels (I / P) ** (mu * w)
+
+where ``I`` is the recorded image, ``P`` the projected image, ``w`` the weight
+of the pixel for the voxel and ``mu`` the relaxation parameter. The
+corrections are applied camera by camera (MART) or simultaneously for all
+cameras (SMART, geometric mean of the corrections). The voxels of zero
+intensity are removed from the active set after each iteration.
+
+Reference::
+
+    G. E. Elsinga, F. Scarano, B. Wieneke and B. W. van Oudheusden,
+    “Tomographic particle image velocimetry,” Exp Fluids, vol. 41, no. 6,
+    p. 933, 2006.
+
+.. autoclass:: TomoMARTBase
+   :members:
+   :private-members:
+
+.. autoclass:: TomoMARTCV
+   :members:
+   :private-members:
+
+"""
+
+import numpy as np
+
+from fluidimage.util import imread, get_thread_pool
+from .mlos import TomoMLOSBase, TomoMLOSCVBilinear, _iter_chunks
+
+
+def _compute_footprints(pix, shape):
+    """Flat indices of the 4 pixels around projected points and their
+    bilinear weights (zero outside the image)."""
+    ny, nx = shape
+    x = np.asarray(pix[:, 0], dtype=np.float64)
+    y = np.asarray(pix[:, 1], dtype=np.float64)
+    ix0 = np.floor(x)
+    iy0 = np.floor(y)
+    fx = x - ix0
+    fy = y - iy0
+    ix0 = ix0.astype(np.intp)
+    iy0 = iy0.astype(np.intp)
+
+    indices = np.empty((len(x), 4), dtype=np.intp)
+    weights = np.empty((len(x), 4))
+    corners = (
+        (0, 0, (1 - fx) * (1 - fy)),
+        (0, 1, fx * (1 - fy)),
+        (1, 0, (1 - fx) * fy),
+        (1, 1, fx * fy),
+    )
+    for index, (dy, dx, weight) in enumerate(corners):
+        ix = ix0 + dx
+        iy = iy0 + dy
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        indices[:, index] = np.where(inside, iy * nx + ix, 0)
+        weights[:, index] = np.where(inside, weight, 0.0)
+    return indices, weights
+
+
+class TomoMARTBase(TomoMLOSBase):
+    """Iterative MART / SMART reconstruction on the active voxels."""
+
+    #: Number of threads used for the corrections of the voxels
+    nb_workers = 1
+
+    def reconstruct_mart(
+        self,
+        images: dict,
+        threshold=None,
+        nb_iterations=5,
+        relaxation=1.0,
+        simultaneous=False,
+        chunk_size=2 ** 20,
+        save=False,
+    ):
+        """Performs MART (or SMART) reconstruction of one instant.
+
+        The volume is initialized with
+        :func:`TomoMLOSBase.reconstruct_sparse`. The result is stored in
+        ``self.array.indices_active`` and ``self.array.I_active`` and the
+        relative residuals of the projections (before each iteration and after
+        the last one) in ``self.residuals``.
+
+        Parameters
+        ----------
+        images : dict
+            Paths of the images indexed by the names of the cameras.
+
+        threshold : float
+            Intensity below which the pixels are set to zero.
+
+        nb_iterations : int
+            Number of iterations.
+
+        relaxation : float
+            Relaxation parameter (``mu``), usually between 0 and 1.
+
+        simultaneous : bool
+            If True, SMART: the corrections of all cameras are computed from
+            the same volume and applied together.
+
+        chunk_size : int
+            Number of voxels processed at once.
+
+        save : bool
+            Save the active voxels in the HDF5 file.
+
+        """
+        self.reconstruct_sparse(images, threshold, chunk_size)
+        indices = self.array.indices_active
+        values = np.array(self.array.I_active, dtype=np.float64)
+
+        cameras = []
+        for cam, image in images.items():
+            im = imread(image).astype(np.float64)
+            if threshold is not None:
+                im[im < threshold] = 0.0
+            projection_map = self.get_projection_map(cam, chunk_size)
+            footprints = _compute_footprints(projection_map[indices], im.shape)
+            cameras.append([im.ravel(), *footprints])
+
+        self.residuals = []
+        for _ in range(nb_iterations):
+            self.residuals.append(self._compute_residual(cameras, values))
+            if simultaneous:
+                log_corrections = sum(
+                    self._compute_log_corrections(*camera, values)
+                    for camera in cameras
+                )
+                values *= np.exp(relaxation / len(cameras) * log_corrections)
+            else:
+                for camera in cameras:
+                    log_corrections = self._compute_log_corrections(
+                        *camera, values
+                    )
+                    values *= np.exp(relaxation * log_corrections)
+
+            # removal of the voxels of zero intensity
+            active = np.flatnonzero(values)
+            if len(active) < len(values):
+                indices = indices[active]
+                values = values[active]
+                for camera in cameras:
+                    camera[1] = camera[1][active]
+                    camera[2] = camera[2][active]
+
+        self.residuals.append(self._compute_residual(cameras, values))
+
+        self.array.indices_active = indices
+        self.array.I_active = values.astype(self.array.dtype)
+        self.array.I = None
+        if save:
+            self.array.save(sparse=True)
+
+    @staticmethod
+    def _project(im, indices_pix, weights, values):
+        """Projection of the active voxels on the image of a camera."""
+        return np.bincount(
+            indices_pix.ravel(),
+            weights=(weights * values[:, np.newaxis]).ravel(),
+            minlength=im.size,
+        )
+
+    def _compute_log_corrections(self, im, indices_pix, weights, values):
+        """Logarithms of the multiplicative corrections of the voxels."""
+        projection = self._project(im, indices_pix, weights, values)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_ratios = np.log(im / projection)
+        # no correction for the pixels without voxels
+        log_ratios[projection == 0] = 0.0
+
+        log_corrections = np.empty(len(values))
+
+        def compute(start_stop):
+            start, stop = start_stop
+            weights_chunk = weights[start:stop]
+            with np.errstate(invalid="ignore"):
+                # -inf for the voxels seen by a dark pixel
+                log_corrections[start:stop] = np.where(
+                    weights_chunk > 0,
+                    weights_chunk * log_ratios[indices_pix[start:stop]],
+                    0.0,
+                ).sum(axis=1)
+
+        chunks = list(_iter_chunks(len(values), 2 ** 16))
+        if self.nb_workers == 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                compute(chunk)
+        else:
+            pool = get_thread_pool(self.nb_workers, "tomo")
+            list(pool.map(compute, chunks))
+        return log_corrections
+
+    def _compute_residual(self, cameras, values):
+        """Relative L2 residual of the projections (over all cameras and the
+        pixels seen by the active voxels)."""
+        norm_residual = norm_images = 0.0
+        for im, indices_pix, weights in cameras:
+            projection = self._project(im, indices_pix, weights, values)
+            seen = np.unique(indices_pix[weights > 0])
+            norm_residual += np.sum((im[seen] - projection[seen]) ** 2)
+            norm_images += np.sum(im[seen] ** 2)
+        if norm_images == 0:
+            return 0.0
+        return np.sqrt(norm_residual / norm_images)
+
+
+class TomoMARTCV(TomoMARTBase, TomoMLOSCVBilinear):
+    """MART with OpenCV calibration (bilinear MLOS initialization)."""
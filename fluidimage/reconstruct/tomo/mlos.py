@@ -20,26 +20,47 @@ Reference::
    :members:
    :private-members:
 
+.. autoclass:: TomoMLOSBilinear
+   :members:
+   :private-members:
+
+.. autoclass:: TomoMLOSBicubic
+   :members:
+   :private-members:
+
 .. autoclass:: TomoMLOSCV
    :members:
    :private-members:
 
+.. autoclass:: TomoMLOSCVBilinear
+   :members:
+   :private-members:
+
+.. autoclass:: TomoMLOSCVBicubic
+   :members:
+   :private-members:
+
+.. autoclass:: PixelGridInterpolator
+   :members:
+
 """
 
 import os
+import hashlib
 from pathlib import Path
 
 from psutil import virtual_memory
 
 import numpy as np
 from scipy import interpolate, sparse
+import scipy.ndimage as ndi
 import matplotlib.pyplot as plt
 import dask.array as da
 from dask.diagnostics import ProgressBar
 
 import cv2
 
-from fluidimage.util import imread
+from fluidimage.util import imread, get_thread_pool
 from fluidimage.calibration.calib_cv import CalibCV
 from fluidimage.data_objects.tomo import ArrayTomoCV
 
@@ -54,10 +75,26 @@ class TomoMLOSBase:
     3. Project back the interpolated intesities onto world coordinates and
        apply them multiplicatively.
 
+    The projections (step 1) only depend on the calibrations and on the grid.
+    They are computed once per camera and kept in memory (float32 pixel
+    coordinates, see :func:`get_projection_map`). If `path_dir_cache` is
+    given, they are saved in this directory as cache files loaded as
+    memory-mapped arrays.
+
     """
 
-    def __init__(self, cls_calib, cls_array, *cams, **kwargs):
+    #: Radius (in pixels, around the nearest pixel) of the pixels used by the
+    #: interpolator for a point (see :func:`reconstruct_sparse`)
+    _radius_stencil = 0
+
+    def __init__(
+        self, cls_calib, cls_array, *cams, path_dir_cache=None, **kwargs
+    ):
         self.array = cls_array(params=None, **kwargs)
+        if path_dir_cache is not None:
+            path_dir_cache = str(path_dir_cache)
+        self.path_dir_cache = path_dir_cache
+        self._projection_maps = {}
         self.cams = []
         for cam in cams:
             cam_name = Path(cam).name.split(".")[0]
@@ -76,28 +113,212 @@ class TomoMLOSBase:
         reconstruction is done in memory when `save=False` and in the
         filesystem when `save=True`.
 
+        `pix` can be the name of a camera, in which case its cached projection
+        map is used (computed only for the first reconstruction).
+
+        With `save=True`, the HDF5 dataset is updated in place chunk by chunk
+        (see :func:`ArrayTomoBase.open_dataset_chunked`).
+
         """
         self.array.image_path = image
+        if isinstance(pix, str):
+            pix = self.phys2pix(pix)
         interp = self.get_interpolator(image, threshold)
+        exponent = 1.0 / len(self.cams)
+        if save:
+            chunk_size = chunks if isinstance(chunks, int) else chunks[0]
+            f, dset = self.array.open_dataset_chunked(chunk_size)
+            with f:
+                for start, stop in _iter_chunks(dset.shape[0], chunk_size):
+                    i_vox = interp(pix["x"][start:stop], pix["y"][start:stop])
+                    dset[start:stop] = dset[start:stop] * i_vox ** exponent
+            return
+
         with ProgressBar():
             x_pix = da.from_array(pix["x"], chunks=chunks)
             y_pix = da.from_array(pix["y"], chunks=chunks)
             i_vox = da.map_blocks(interp, x_pix, y_pix)
-            i_vox = i_vox ** (1.0 / len(self.cams))
-            if save:
-                if os.path.exists(self.array.h5file_path):
-                    # Create a temporary copy to read from
-                    f, dset, h5file_tmp = self.array.load_dataset(copy=True)
-                    self.array.I = da.from_array(dset, chunks=chunks)
-                    self.array.I *= i_vox
-                    self.array.save()
-                    f.close()
-                    os.remove(h5file_tmp)
-                else:
-                    self.array.I = i_vox
-                    self.array.save()
+            i_vox = i_vox ** exponent
+            self.array.I *= i_vox.compute()
+
+    def reconstruct_out_of_core(
+        self, images: dict, threshold=None, chunk_size=2 ** 20
+    ):
+        """Performs MLOS reconstruction of one instant out-of-core.
+
+        All cameras are applied in one sweep over the voxels: for each chunk of
+        the (flattened) HDF5 dataset, the intensities are read, the intensities
+        of the cameras are interpolated at the projections of the voxels (read
+        from the cached projection maps), multiplied and the chunk is written
+        in place. Neither the voxel grid nor the intensities are held in
+        memory.
+
+        Parameters
+        ----------
+        images : dict
+            Paths of the images indexed by the names of the cameras.
+
+        threshold : float
+            Intensity below which the pixels are set to zero.
+
+        chunk_size : int
+            Number of voxels processed at once.
+
+        """
+        interps = {
+            cam: self.get_interpolator(image, threshold)
+            for cam, image in images.items()
+        }
+        projection_maps = {
+            cam: self.get_projection_map(cam, chunk_size) for cam in images
+        }
+        exponent = 1.0 / len(self.cams)
+        f, dset = self.array.open_dataset_chunked(chunk_size)
+        with f:
+            for start, stop in _iter_chunks(dset.shape[0], chunk_size):
+                intensities = dset[start:stop]
+                for cam, interp in interps.items():
+                    pix = projection_maps[cam][start:stop]
+                    intensities *= interp(pix[:, 0], pix[:, 1]) ** exponent
+                dset[start:stop] = intensities
+
+    def reconstruct_sparse(
+        self, images: dict, threshold=None, chunk_size=2 ** 20, save=False
+    ):
+        """Performs MLOS reconstruction of one instant with active voxels.
+
+        Since the intensities are multiplied, a voxel projected on a dark
+        region of one camera has a zero intensity. For each camera, the
+        intensities are only interpolated for the voxels whose nearest pixel
+        is close to a non-zero pixel (after thresholding), i.e. for which the
+        stencil of the interpolator (of radius ``_radius_stencil``) contains
+        a non-zero pixel, and the voxels with a zero interpolated intensity
+        are removed. The first camera is applied on all voxels (chunk by
+        chunk) and the active voxels (a list of flat indices and
+        intensities) are pruned after each camera, so that the active voxels
+        are the non-zero voxels of the dense reconstruction.
+
+        The result is stored in ``self.array.indices_active`` and
+        ``self.array.I_active`` (see
+        :func:`ArrayTomoBase.get_dense_intensities`) and saved sparsely in the
+        HDF5 file if `save` is True.
+
+        Parameters
+        ----------
+        images : dict
+            Paths of the images indexed by the names of the cameras (applied
+            in this order).
+
+        threshold : float
+            Intensity below which the pixels are set to zero.
+
+        chunk_size : int
+            Number of voxels processed at once for the first camera.
+
+        save : bool
+            Save the active voxels in the HDF5 file.
+
+        """
+        exponent = 1.0 / len(self.cams)
+        radius = self._radius_stencil
+        indices = values = None
+        for cam, image in images.items():
+            interp = self.get_interpolator(image, threshold)
+            bright = _get_bright_pixels(image, threshold, radius)
+            projection_map = self.get_projection_map(cam, chunk_size)
+            if indices is None:
+                indices_chunks = []
+                values_chunks = []
+                for start, stop in _iter_chunks(len(projection_map), chunk_size):
+                    pix = projection_map[start:stop]
+                    indices_chunk = start + np.flatnonzero(
+                        _is_projected_on(bright, pix, radius)
+                    )
+                    pix = projection_map[indices_chunk]
+                    values_chunk = (
+                        interp(pix[:, 0], pix[:, 1]) ** exponent
+                    ).astype(self.array.dtype)
+                    nonzero = values_chunk != 0
+                    indices_chunks.append(indices_chunk[nonzero])
+                    values_chunks.append(values_chunk[nonzero])
+                indices = np.concatenate(indices_chunks)
+                values = np.concatenate(values_chunks)
             else:
-                self.array.I *= i_vox.compute()
+                pix = projection_map[indices]
+                active = _is_projected_on(bright, pix, radius)
+                indices = indices[active]
+                values = values[active]
+                pix = pix[active]
+                values *= interp(pix[:, 0], pix[:, 1]) ** exponent
+                nonzero = values != 0
+                indices = indices[nonzero]
+                values = values[nonzero]
+
+        self.array.indices_active = indices
+        self.array.I_active = values
+        self.array.I = None
+        if save:
+            self.array.save(sparse=True)
+
+    def get_projection_map(self, cam_name: str, chunk_size=2 ** 20):
+        """Get the pixel coordinates of all voxels for one camera.
+
+        The map (a float32 array of shape ``(nb_voxels, 2)``) is computed chunk
+        by chunk. Without cache directory (`path_dir_cache` is None), it is
+        only kept in memory. Otherwise, it is loaded as a memory-mapped array
+        from a cache file, or saved if the file does not exist. The name of the
+        file contains a hash of the calibration file and of the grid.
+
+        """
+        try:
+            return self._projection_maps[cam_name]
+        except KeyError:
+            pass
+
+        array = self.array
+        nb_voxels = array.nx * array.ny * array.nz
+
+        if self.path_dir_cache is None:
+            projection_map = np.empty((nb_voxels, 2), dtype=np.float32)
+            self._compute_projection_map(cam_name, projection_map, chunk_size)
+            self._projection_maps[cam_name] = projection_map
+            return projection_map
+
+        path = os.path.join(
+            self.path_dir_cache,
+            f"projection_{cam_name}_{self._hash_projection(cam_name)}.npy",
+        )
+        if not os.path.exists(path):
+            os.makedirs(self.path_dir_cache, exist_ok=True)
+            path_tmp = path + f".{os.getpid()}.tmp"
+            projection_map = np.lib.format.open_memmap(
+                path_tmp, mode="w+", dtype=np.float32, shape=(nb_voxels, 2)
+            )
+            self._compute_projection_map(cam_name, projection_map, chunk_size)
+            projection_map.flush()
+            del projection_map
+            # atomic: a file in the cache is always complete
+            os.replace(path_tmp, path)
+
+        projection_map = np.load(path, mmap_mode="r")
+        self._projection_maps[cam_name] = projection_map
+        return projection_map
+
+    def _compute_projection_map(self, cam_name, projection_map, chunk_size):
+        """Fill the projection map of a camera chunk by chunk."""
+        for start, stop in _iter_chunks(len(projection_map), chunk_size):
+            pix = self.phys2pix(cam_name, self.array.get_grid(start, stop))
+            projection_map[start:stop, 0] = pix["x"]
+            projection_map[start:stop, 1] = pix["y"]
+
+    def _hash_projection(self, cam_name):
+        """Hash of the calibration file of a camera and of the grid."""
+        sha = hashlib.sha1()
+        with open(getattr(self, cam_name).path_file, "rb") as file:
+            sha.update(file.read())
+        for coords in (self.array.xs, self.array.ys, self.array.zs):
+            sha.update(np.ascontiguousarray(coords, dtype=np.float64).data)
+        return sha.hexdigest()[:16]
 
     def verify_projection(self, cam="cam0", skip=1):
         """Graphically verify the projection performed by `phys2pix` method."""
@@ -162,25 +383,134 @@ class TomoMLOSNeighbour(TomoMLOSBase):
         )
 
 
+class PixelGridInterpolator:
+    """Interpolate an image (a regular grid of pixels) at arbitrary points.
+
+    The image is sampled directly with :func:`scipy.ndimage.map_coordinates`
+    (bilinear for ``order=1``, cubic B-spline for ``order=3``), which is
+    vectorized over the points and releases the GIL, so that large arrays of
+    points are split in chunks interpolated in a pool of threads. The
+    intensity is zero outside the image.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        2D array.
+
+    order : int
+        Order of the spline interpolation (1: bilinear, 3: bicubic).
+
+    nb_workers : int
+        Number of threads.
+
+    chunk_size : int
+        Number of points interpolated by a thread at once.
+
+    """
+
+    def __init__(self, image, order=1, nb_workers=1, chunk_size=2 ** 16):
+        image = np.asarray(image, dtype=np.float64)
+        if order > 1:
+            # the spline coefficients are computed once
+            image = ndi.spline_filter(image, order, output=np.float64)
+        self.coefficients = image
+        self.order = order
+        self.nb_workers = nb_workers
+        self.chunk_size = chunk_size
+
+    def __call__(self, x, y):
+        """Interpolate at the points (x, y) (column and row coordinates)."""
+        x = np.asarray(x)
+        y = np.asarray(y)
+        shape = x.shape
+        x = x.ravel()
+        y = y.ravel()
+        result = np.empty(x.size)
+
+        def compute(start_stop):
+            start, stop = start_stop
+            ndi.map_coordinates(
+                self.coefficients,
+                np.array((y[start:stop], x[start:stop])),
+                output=result[start:stop],
+                order=self.order,
+                mode="constant",
+                cval=0.0,
+                prefilter=False,
+            )
+
+        chunks = list(_iter_chunks(x.size, self.chunk_size))
+        if self.nb_workers == 1 or len(chunks) == 1:
+            for chunk in chunks:
+                compute(chunk)
+        else:
+            pool = get_thread_pool(self.nb_workers, "tomo")
+            list(pool.map(compute, chunks))
+
+        if self.order > 1:
+            # the cubic splines overshoot (negative intensities)
+            np.maximum(result, 0, out=result)
+        return result.reshape(shape)
+
+
+class TomoMLOSBilinear(TomoMLOSBase):
+    """Interpolation is calculated by bilinear sampling of the image (see
+    :class:`PixelGridInterpolator`).
+
+    """
+
+    #: Number of threads used for the interpolations
+    nb_workers = 1
+    _order_interpolation = 1
+    # floor and ceil neighbours
+    _radius_stencil = 1
+
+    def get_interpolator(self, image, threshold):
+        im = imread(image)
+
+        if threshold is not None:
+            im[im < threshold] = 0.0
+
+        return PixelGridInterpolator(
+            im, order=self._order_interpolation, nb_workers=self.nb_workers
+        )
+
+
+class TomoMLOSBicubic(TomoMLOSBilinear):
+    """Interpolation is calculated by bicubic (B-spline) sampling of the image
+    (see :class:`PixelGridInterpolator`).
+
+    """
+
+    _order_interpolation = 3
+    # the spline coefficients are negligible far from the bright pixels
+    _radius_stencil = 2
+
+
 class TomoMLOSCV(TomoMLOSNeighbour):
     def __init__(self, *cams, **kwargs):
         super().__init__(CalibCV, ArrayTomoCV, *cams, **kwargs)
 
-    def phys2pix(self, cam_name: str):
-        """Tranform the 'physical' world coordinates to 'pixel' coordinates."""
+    def phys2pix(self, cam_name: str, grid3d=None):
+        """Tranform the 'physical' world coordinates to 'pixel' coordinates.
+
+        If `grid3d` is None, the coordinates of all voxels are taken from the
+        cached projection map (see :func:`TomoMLOSBase.get_projection_map`).
+
+        """
+        if grid3d is None:
+            projection_map = self.get_projection_map(cam_name)
+            return {"x": projection_map[:, 0], "y": projection_map[:, 1]}
+
         cam = getattr(self, cam_name)
-        grid3d = self.array.grid
         pix = np.empty((len(grid3d), 1, 2))
 
-        for i, z in enumerate(self.array.zs):
-            grid_zslice = grid3d[grid3d[:, 2] == z]
-            n = len(grid_zslice)
-            istart = i * n
-            iend = (i + 1) * n
+        for z in np.unique(grid3d[:, 2]):
+            selection = grid3d[:, 2] == z
             rotation = cam.get_rotation(z)
             translate = cam.get_translate(z)
-            pix[istart:iend, ...], jac = cv2.projectPoints(
-                grid_zslice,
+            pix[selection, ...], jac = cv2.projectPoints(
+                grid3d[selection],
                 rotation,
                 translate,
                 cam.params.cam_mtx,
@@ -200,6 +530,8 @@ class TomoMLOSCV(TomoMLOSNeighbour):
         execute the parent method.
 
         """
+        if isinstance(pix, str):
+            pix = self.phys2pix(pix)
         if chunks is None:
             chunks = len(pix["x"]) // os.cpu_count()
             nmax = int(_estimate_max_array_size(self.array.dtype)) // 6
@@ -209,6 +541,50 @@ class TomoMLOSCV(TomoMLOSNeighbour):
         super().reconstruct(pix, image, threshold, chunks, save)
 
 
+def _get_bright_pixels(image, threshold, radius=0):
+    """Mask of the pixels at a distance `radius` (or less) of a non-zero pixel
+    of an image (after thresholding).
+
+    The mask is padded with `radius` pixels on each side.
+
+    """
+    im = imread(image)
+    if threshold is not None:
+        im[im < threshold] = 0
+    mask = im != 0
+    if radius:
+        mask = np.pad(mask, radius, mode="constant")
+        mask = ndi.maximum_filter(mask, size=2 * radius + 1, mode="constant")
+    return mask
+
+
+def _is_projected_on(mask_pixels, pix, radius=0):
+    """Check if the nearest pixels of projected points are in a mask (padded
+    with `radius` pixels, see :func:`_get_bright_pixels`)."""
+    ny, nx = mask_pixels.shape
+    ix = np.rint(pix[:, 0]) + radius
+    iy = np.rint(pix[:, 1]) + radius
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    result = np.zeros(len(pix), dtype=bool)
+    result[inside] = mask_pixels[
+        iy[inside].astype(np.intp), ix[inside].astype(np.intp)
+    ]
+    return result
+
+
+def _iter_chunks(size, chunk_size):
+    for start in range(0, size, chunk_size):
+        yield start, min(start + chunk_size, size)
+
+
+class TomoMLOSCVBilinear(TomoMLOSBilinear, TomoMLOSCV):
+    """OpenCV calibration with bilinear interpolation."""
+
+
+class TomoMLOSCVBicubic(TomoMLOSBicubic, TomoMLOSCV):
+    """OpenCV calibration with bicubic interpolation."""
+
+
 def _estimate_max_array_size(dtype=np.float64):
     mem = virtual_memory()
     nbytes = np.array([0], dtype=dtype).nbytes
@@ -3,12 +3,20 @@ from tempfile import gettempdir
 from pathlib import Path
 import shutil
 
+import numpy as np
+
 import matplotlib
 
 matplotlib.use("agg")
 
 from fluiddyn.io import stdout_redirected
-from fluidimage.reconstruct.tomo import TomoMLOSCV
+from fluidimage.reconstruct.tomo import (
+    TomoMLOSCV,
+    TomoMLOSCVBilinear,
+    TomoMLOSCVBicubic,
+    TomoMARTCV,
+)
+from fluidimage.reconstruct.tomo.mlos import PixelGridInterpolator
 from fluidimage.data_objects.tomo import ArrayTomoCV
 
 from fluidimage import path_image_samples
@@ -19,6 +27,7 @@ path_particle = str(
     path_image_samples / "TomoPIV" / "particle" / "cam0.pre" / "im00001a.tif"
 )
 path_output = Path(gettempdir()) / "fluidimage_test_mlos"
+path_cache = Path(gettempdir()) / "fluidimage_test_mlos_cache"
 
 
 class TestMLOS(unittest.TestCase):
@@ -26,6 +35,7 @@ class TestMLOS(unittest.TestCase):
 
     def tearDown(self):
         shutil.rmtree(path_output)
+        shutil.rmtree(path_cache, ignore_errors=True)
 
     def test(self):
         """Test classes TomoMLOSCV and ArrayTomoCV."""
@@ -36,6 +46,7 @@ class TestMLOS(unittest.TestCase):
                 ylims=(-10, 10),
                 zlims=(-5, 5),
                 nb_voxels=(11, 11, 5),
+                path_dir_cache=path_cache,
             )
             tomo.verify_projection()
             pix = tomo.phys2pix("cam0")
@@ -49,6 +60,190 @@ class TestMLOS(unittest.TestCase):
             array.plot_slices(0, 1)
             array.clear()
 
+    def test_out_of_core(self):
+        """Compare the out-of-core and the in-memory reconstructions."""
+        with stdout_redirected():
+            tomo = TomoMLOSCV(
+                path_calib,
+                xlims=(-10, 10),
+                ylims=(-10, 10),
+                zlims=(-5, 5),
+                nb_voxels=(11, 11, 5),
+                path_dir_cache=path_cache,
+            )
+            pix = tomo.phys2pix("cam0")
+            assert np.allclose(
+                tomo.phys2pix("cam0", tomo.array.get_grid(100, 200))["x"],
+                pix["x"][100:200],
+            )
+            tomo.reconstruct(pix, path_particle, chunks=100)
+            intensities = tomo.array.I
+
+            tomo.array.init_paths(path_particle, path_output)
+            for _ in range(2):
+                tomo.reconstruct_out_of_core(
+                    {"cam0": path_particle}, chunk_size=100
+                )
+
+            path_result = list(path_output.glob("*"))[0]
+            array = ArrayTomoCV(h5file_path=path_result)
+            assert np.allclose(array.I, intensities ** 2)
+
+            # the projection map is loaded from the cache
+            assert len(list(path_cache.glob("projection_cam0_*.npy"))) == 1
+            tomo = TomoMLOSCV(
+                path_calib,
+                xlims=(-10, 10),
+                ylims=(-10, 10),
+                zlims=(-5, 5),
+                nb_voxels=(11, 11, 5),
+                path_dir_cache=path_cache,
+            )
+            tomo.reconstruct("cam0", path_particle, chunks=100)
+            assert np.allclose(tomo.array.I, intensities)
+
+            # without cache directory, the projection map is kept in memory
+            tomo = TomoMLOSCV(
+                path_calib,
+                xlims=(-10, 10),
+                ylims=(-10, 10),
+                zlims=(-5, 5),
+                nb_voxels=(11, 11, 5),
+            )
+            projection_map = tomo.get_projection_map("cam0")
+            assert not isinstance(projection_map, np.memmap)
+            assert np.array_equal(
+                projection_map, np.load(next(path_cache.glob("*.npy")))
+            )
+
+    def test_sparse(self):
+        """Compare the sparse and the out-of-core reconstructions (the
+        intensities of the active voxels are the same)."""
+        paths_calib = [path_calib, path_calib.replace("cam0", "cam1")]
+        images = {
+            cam: path_particle.replace("cam0", cam) for cam in ("cam0", "cam1")
+        }
+        with stdout_redirected():
+            tomo = TomoMLOSCV(
+                *paths_calib,
+                xlims=(-10, 10),
+                ylims=(-10, 10),
+                zlims=(-5, 5),
+                nb_voxels=(21, 21, 11),
+                path_dir_cache=path_cache,
+            )
+            tomo.array.init_paths(path_particle, path_output)
+            tomo.reconstruct_out_of_core(images, chunk_size=1000)
+            path_result = list(path_output.glob("*"))[0]
+            intensities = ArrayTomoCV(h5file_path=path_result).I
+            path_result.unlink()
+
+            tomo.reconstruct_sparse(images, chunk_size=100, save=True)
+            array = tomo.array
+            indices = array.indices_active
+            assert 0 < len(indices) < len(intensities)
+            assert np.allclose(array.I_active, intensities[indices])
+
+            array = ArrayTomoCV(h5file_path=path_result)
+            assert np.array_equal(array.indices_active, indices)
+            assert np.allclose(array.I[indices], intensities[indices])
+            assert array.I.sum() < intensities.sum()
+
+    def test_sparse_bilinear(self):
+        """The active voxels of the sparse reconstruction are the non-zero
+        voxels of the dense reconstruction (bilinear interpolation)."""
+        paths_calib = [path_calib, path_calib.replace("cam0", "cam1")]
+        images = {
+            cam: path_particle.replace("cam0", cam) for cam in ("cam0", "cam1")
+        }
+        with stdout_redirected():
+            tomo = TomoMLOSCVBilinear(
+                *paths_calib,
+                xlims=(-10, 10),
+                ylims=(-10, 10),
+                zlims=(-5, 5),
+                nb_voxels=(41, 41, 21),
+                path_dir_cache=path_cache,
+            )
+            tomo.array.init_paths(path_particle, path_output)
+            tomo.reconstruct_out_of_core(images, chunk_size=10000)
+            path_result = list(path_output.glob("*"))[0]
+            intensities = ArrayTomoCV(h5file_path=path_result).I
+
+            tomo.reconstruct_sparse(images, chunk_size=10000)
+            array = tomo.array
+            indices_nonzero = np.flatnonzero(intensities)
+            assert 0 < len(indices_nonzero) < len(intensities)
+            assert np.array_equal(array.indices_active, indices_nonzero)
+            assert np.allclose(array.I_active, intensities[indices_nonzero])
+
+    def test_pixel_grid(self):
+        """Test the bilinear and bicubic interpolations."""
+        path_output.mkdir(exist_ok=True)
+        image = np.random.rand(20, 30)
+        y, x = np.random.rand(2, 1000) * [[19], [29]]
+        interp = PixelGridInterpolator(image, chunk_size=100)
+        result = interp(x, y)
+        iy, ix = y.astype(int), x.astype(int)
+        assert np.allclose(interp(ix, iy), image[iy, ix])
+        fx, fy = x - ix, y - iy
+        expected = (
+            image[iy, ix] * (1 - fx) * (1 - fy)
+            + image[iy, ix + 1] * fx * (1 - fy)
+            + image[iy + 1, ix] * (1 - fx) * fy
+            + image[iy + 1, ix + 1] * fx * fy
+        )
+        assert np.allclose(result, expected)
+        interp.nb_workers = 2
+        assert np.array_equal(interp(x, y), result)
+        assert interp(np.array([-5.0]), np.array([3.0]))[0] == 0
+
+        interp = PixelGridInterpolator(image, order=3)
+        assert np.allclose(interp(ix, iy), image[iy, ix])
+
+        for cls in (TomoMLOSCVBilinear, TomoMLOSCVBicubic):
+            with stdout_redirected():
+                tomo = cls(
+                    path_calib,
+                    xlims=(-10, 10),
+                    ylims=(-10, 10),
+                    zlims=(-5, 5),
+                    nb_voxels=(11, 11, 5),
+                    path_dir_cache=path_cache,
+                )
+                tomo.reconstruct("cam0", path_particle, chunks=100)
+            assert tomo.array.I.min() >= 0
+            assert tomo.array.I.max() > 0
+
+    def test_mart(self):
+        """Test MART and SMART (the residuals decrease)."""
+        paths_calib = [path_calib, path_calib.replace("cam0", "cam1")]
+        images = {
+            cam: path_particle.replace("cam0", cam) for cam in ("cam0", "cam1")
+        }
+        with stdout_redirected():
+            tomo = TomoMARTCV(
+                *paths_calib,
+                xlims=(-10, 10),
+                ylims=(-10, 10),
+                zlims=(-5, 5),
+                nb_voxels=(21, 21, 11),
+                path_dir_cache=path_cache,
+            )
+            tomo.array.init_paths(path_particle, path_output)
+            for simultaneous in (False, True):
+                tomo.reconstruct_mart(
+                    images, nb_iterations=3, simultaneous=simultaneous, save=True
+                )
+                residuals = tomo.residuals
+                assert len(residuals) == 4
+                assert residuals[-1] < residuals[0]
+                assert len(tomo.array.indices_active) > 0
+
+            path_result = list(path_output.glob("*"))[0]
+            array = ArrayTomoCV(h5file_path=path_result)
+            assert np.allclose(array.I_active, tomo.array.I_active)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -5,6 +5,9 @@
    :members:
    :private-members:
 
+.. autoclass:: KeysBatch
+   :members:
+
 .. autoclass:: Queue
    :members:
    :private-members:
@@ -23,8 +26,20 @@ from fluidimage.util import logger, cstring
 from ..executors import executors, ExecutorBase
 
 
+class KeysBatch(tuple):
+    """Keys of a batch of items (see :func:`Work.pop_input`)"""
+
+    def __str__(self):
+        return "+".join(str(key) for key in self)
+
+
 class Work:
-    """Represent a work"""
+    """Represent a work
+
+    If `batch_size` is not None, `func_or_cls` is called with a list of (at
+    most `batch_size`) objects and has to return the list of the results.
+
+    """
 
     def __init__(
         self,
@@ -34,7 +49,10 @@ class Work:
         input_queue=None,
         output_queue=None,
         kind: str = None,
+        batch_size: int = None,
     ):
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size has to be None or positive")
         self._kwargs = dict(
             name=name,
             func_or_cls=func_or_cls,
@@ -42,6 +60,7 @@ class Work:
             input_queue=input_queue,
             output_queue=output_queue,
             kind=kind,
+            batch_size=batch_size,
         )
         # to avoid a pylint warning
         self.name = None
@@ -69,15 +88,102 @@ class Work:
             return True
         return False
 
+    def pop_input(self):
+        """Pop the first item of the input queue
+
+        For a batch work, pop up to `batch_size` items (the exceptions are
+        directly transmitted) and return a :class:`KeysBatch` and the list of
+        the objects.
+
+        Raises a KeyError if there is nothing to process.
+
+        """
+        if self.batch_size is None:
+            return self.input_queue.pop_first_item()
+
+        keys = []
+        objs = []
+        while self.input_queue and len(keys) < self.batch_size:
+            key, obj = self.input_queue.pop_first_item()
+            if not self.check_exception(key, obj):
+                keys.append(key)
+                objs.append(obj)
+        if not keys:
+            raise KeyError("No items to process")
+        return KeysBatch(keys), objs
+
+    def put_output(self, key, result):
+        """Put a result (or the results of a batch) in the output queue"""
+        if self.output_queue is None:
+            return
+
+        if not isinstance(key, KeysBatch):
+            self.output_queue[key] = result
+            return
+
+        if isinstance(result, Exception):
+            pass
+        elif not isinstance(result, (list, tuple)):
+            result = TypeError(
+                f"work {self.name_no_space} returned a {type(result).__name__} "
+                f"instead of a list of results for a batch"
+            )
+        elif len(result) != len(key):
+            result = ValueError(
+                f"work {self.name_no_space} returned {len(result)} results "
+                f"for a batch of {len(key)} items"
+            )
+        if isinstance(result, Exception):
+            result = [result] * len(key)
+        for key_item, result_item in zip(key, result):
+            self.output_queue[key_item] = result_item
+
 
 class Queue(OrderedDict):
-    """Represent a queue"""
+    """Represent a queue
+
+    A function (for example to wake up an executor) can be registered with
+    :func:`set_callback_change`. It is called each time items are added or
+    removed.
+
+    """
 
     def __init__(self, name, kind=None):
         self.name = name
         self.kind = kind
+        self._callback_change = None
         super().__init__()
 
+    def set_callback_change(self, callback):
+        """Register the function called when the queue changes (or None)."""
+        self._callback_change = callback
+
+    def _notify_change(self):
+        if self._callback_change is not None:
+            self._callback_change()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._notify_change()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._notify_change()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._notify_change()
+        return result
+
+    def popitem(self, last=True):
+        result = super().popitem(last=last)
+        self._notify_change()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._notify_change()
+
     def __repr__(self):
         return f'\nqueue "{self.name}": ' + super().__repr__()
 
@@ -137,11 +243,20 @@ class TopologyBase:
         input_queue=None,
         output_queue=None,
         kind: str = None,
+        batch_size: int = None,
     ):
-        """Create a new work relating queues."""
+        """Create a new work relating queues.
+
+        If `batch_size` is given, `func_or_cls` is called with lists of
+        objects (see :class:`Work`).
+
+        """
         if func_or_cls is None:
             warn(f'func_or_cls is None for work "{name}"')
 
+        if batch_size is not None and kind is not None and "global" in kind:
+            raise ValueError("A global work can not be a batch work")
+
         work = Work(
             name=name,
             input_queue=input_queue,
@@ -149,6 +264,7 @@ class TopologyBase:
             params_cls=params_cls,
             output_queue=output_queue,
             kind=kind,
+            batch_size=batch_size,
         )
         self.works.append(work)
 
@@ -29,6 +29,11 @@ class TopologyBOS(TopologyBase):
     The most useful methods for the user (in particular :func:`compute`) are
     defined in the base class :class:`fluidimage.topologies.base.TopologyBase`.
 
+    Only one work PIV is used for all the images. Since the reference image
+    is always the image 0, the spectra of its interrogation windows (first
+    pass) are computed only once (see
+    :class:`fluidimage.works.piv.multipass.WorkPIV`).
+
     Parameters
     ----------
 
@@ -179,6 +184,8 @@ postfix : str
         self.path_reference = path_reference
         self.image_reference = imread(path_reference)
 
+        self.work = WorkPIV(self.params, fixed_im0=True)
+
         super().__init__(
             path_dir_result=path_dir_result,
             logging_level=logging_level,
@@ -227,7 +234,7 @@ postfix : str
             "compute bos",
             func_or_cls=self.calcul,
             params_cls=params,
-            input_queue=queue_arrays,
+            input_queue=queue_arrays1,
             output_queue=queue_bos,
         )
 
@@ -253,7 +260,7 @@ postfix : str
             serie=self.serie,
             paths=[self.path_reference, self.path_dir_src / name],
         )
-        return WorkPIV(self.params).calcul(array_couple)
+        return self.work.calcul(array_couple)
 
     def fill_queue_paths(self, input_queue, output_queue):
         """Fill the first queue (paths)"""
@@ -10,13 +10,20 @@ import os
 import json
 import copy
 import sys
+from collections import deque
 from typing import List, Tuple, Dict
 from fluiddyn.util.paramcontainer import ParamContainer
 
 from fluidimage import SeriesOfArrays
 from fluidimage.util import imread, logger, DEBUG
+from fluidimage.executors import executors
+from fluidimage.executors.multi_exec_async import MultiExecutorAsync
 
 from fluidimage.works.preproc import WorkPreproc
+from fluidimage.preproc.streaming import (
+    check_temporal_tools_first,
+    make_temporal_filters_chain,
+)
 from fluidimage.data_objects.preproc import (
     get_name_preproc,
     ArraySerie as ArraySubset,
@@ -83,6 +90,7 @@ class TopologyPreproc(TopologyBase):
                 "ind_start": 0,
                 "ind_stop": None,
                 "ind_step": 1,
+                "streaming": False,
             }
         )
 
@@ -121,6 +129,20 @@ ind_step : int
     Step index for the whole series of images being loaded.
     For more details: see `class SeriesOfArrays`.
 
+streaming : bool (False)
+    If True, the images of the subsets (without repetition, in the order of
+    the subsets) are processed one at a time: the enabled temporal tools are
+    applied first with rolling windows updated image by image (see
+    :mod:`fluidimage.preproc.streaming`) and then the other tools are applied
+    on each image (a ValueError is raised if an enabled temporal tool is
+    after another enabled tool in `tools.sequence`). Each image is loaded and filtered only once and all the
+    images are saved. When `window_shape` of a temporal tool is None, the
+    number of images in the window is the number of images in a subset.
+    Since the filters are applied in one process, the executors splitting the
+    series between processes (``multi_exec_async`` and
+    ``multi_exec_async_stealing``) can not be used and the default executor
+    is ``exec_async``.
+
 """
         )
 
@@ -221,23 +243,39 @@ postfix : str
 
         self.params.saving.path = self.path_dir_result
 
+        self.streaming = params.preproc.series.streaming
+        if self.streaming:
+            check_temporal_tools_first(params.preproc.tools)
+
         # Define waiting queues
-        queue_subsets_of_names = self.add_queue("subsets of filenames")
+        if not self.streaming:
+            queue_subsets_of_names = self.add_queue("subsets of filenames")
         queue_paths = self.add_queue("image paths")
         queue_arrays = queue_arrays1 = self.add_queue("arrays")
-        queue_subsets_of_arrays = self.add_queue("subsets of arrays")
+        if self.streaming:
+            queue_filtered = self.add_queue("arrays filtered in time")
+        else:
+            queue_subsets_of_arrays = self.add_queue("subsets of arrays")
         queue_preproc_objects = self.add_queue("preproc results")
 
         if params.im2im.im2im is not None:
             queue_arrays1 = self.add_queue("arrays1")
 
         # Define works
-        self.add_work(
-            "fill (subsets_of_names, paths)",
-            func_or_cls=self.fill_subsets_of_names_and_paths,
-            output_queue=(queue_subsets_of_names, queue_paths),
-            kind=("global", "one shot"),
-        )
+        if self.streaming:
+            self.add_work(
+                "fill paths",
+                func_or_cls=self.fill_paths_streaming,
+                output_queue=queue_paths,
+                kind=("global", "one shot"),
+            )
+        else:
+            self.add_work(
+                "fill (subsets_of_names, paths)",
+                func_or_cls=self.fill_subsets_of_names_and_paths,
+                output_queue=(queue_subsets_of_names, queue_paths),
+                kind=("global", "one shot"),
+            )
 
         self.add_work(
             "imread",
@@ -259,21 +297,38 @@ postfix : str
                 output_queue=queue_arrays1,
             )
 
-        self.add_work(
-            "make subsets of arrays",
-            func_or_cls=self.make_subsets,
-            input_queue=(queue_subsets_of_names, queue_arrays1),
-            output_queue=queue_subsets_of_arrays,
-            kind="global",
-        )
+        if self.streaming:
+            self.add_work(
+                "filter arrays in time",
+                func_or_cls=self.filter_in_time,
+                input_queue=queue_arrays1,
+                output_queue=queue_filtered,
+                kind="global",
+            )
 
-        self.add_work(
-            "preproc a subset of arrays",
-            func_or_cls=self.preproc_work.calcul,
-            params_cls=params,
-            input_queue=queue_subsets_of_arrays,
-            output_queue=queue_preproc_objects,
-        )
+            self.add_work(
+                "preproc an array",
+                func_or_cls=self.preproc_work.calcul_frame,
+                params_cls=params,
+                input_queue=queue_filtered,
+                output_queue=queue_preproc_objects,
+            )
+        else:
+            self.add_work(
+                "make subsets of arrays",
+                func_or_cls=self.make_subsets,
+                input_queue=(queue_subsets_of_names, queue_arrays1),
+                output_queue=queue_subsets_of_arrays,
+                kind="global",
+            )
+
+            self.add_work(
+                "preproc a subset of arrays",
+                func_or_cls=self.preproc_work.calcul,
+                params_cls=params,
+                input_queue=queue_subsets_of_arrays,
+                output_queue=queue_preproc_objects,
+            )
 
         self.add_work(
             "save images",
@@ -282,6 +337,44 @@ postfix : str
             kind="io",
         )
 
+    def compute(
+        self,
+        executor=None,
+        nb_max_workers=None,
+        sleep_time=0.01,
+        sequential=False,
+        stop_if_error=False,
+    ):
+        """Compute (run the works until all queues are empty).
+
+        In streaming mode, the series can not be split between processes (the
+        filters need all the images in order), so the executor has to use
+        only one process for the global works (default ``exec_async``).
+
+        """
+        if self.streaming and not sequential:
+            if executor is None:
+                executor = "exec_async"
+            if isinstance(executor, str):
+                exec_class = executors.get(executor)
+            else:
+                exec_class = type(executor)
+            if exec_class is not None and issubclass(
+                exec_class, MultiExecutorAsync
+            ):
+                raise ValueError(
+                    f"executor {executor} can not be used in streaming mode "
+                    "(params.preproc.series.streaming = True)"
+                )
+
+        super().compute(
+            executor,
+            nb_max_workers=nb_max_workers,
+            sleep_time=sleep_time,
+            sequential=sequential,
+            stop_if_error=stop_if_error,
+        )
+
     def save_preproc_object(self, obj: ArraySubset):
         """Save a preprocessing object"""
         ret = obj.save(path=self.path_dir_result)
@@ -339,6 +432,65 @@ postfix : str
             for name, path in subset.get_name_path_arrays():
                 queue_paths[name] = path
 
+    def fill_paths_streaming(self, input_queue: None, output_queue: Dict) -> None:
+        """Fill the queue of paths (streaming mode)
+
+        The images of all the subsets are used, in order and only once.
+
+        """
+        assert input_queue is None
+
+        names_paths = {}
+        for subset in self.series:
+            for name, path in subset.get_name_path_arrays():
+                names_paths.setdefault(name, path)
+
+        if not names_paths:
+            logger.warning("encountered empty series. No images to preprocess.")
+
+        self._names_streaming = deque(names_paths)
+        self._names_filtered = deque(names_paths)
+        self._temporal_filters = make_temporal_filters_chain(
+            self.params.tools, self.nb_items_per_serie
+        )
+
+        for name, path in names_paths.items():
+            output_queue[name] = path
+
+        nb_images = len(names_paths)
+        logger.info(f"Add {nb_images} images to compute.")
+
+    def filter_in_time(self, input_queue: Dict, output_queue: Dict) -> None:
+        """Apply the streaming temporal filters (streaming mode)
+
+        The arrays are pushed in the filters in the order of the series, as
+        soon as they are available.
+
+        """
+        names = self._names_streaming
+        filtered = []
+        while names and names[0] in input_queue:
+            name = names.popleft()
+            array = input_queue.pop(name)
+            if isinstance(array, Exception):
+                logger.error(f"Image {name} skipped ({array!r})")
+                self._names_filtered.remove(name)
+                continue
+            filtered.extend(self._temporal_filters.push(array))
+
+        if not names and self._temporal_filters is not None:
+            filtered.extend(self._temporal_filters.flush())
+            self._temporal_filters = None
+
+        for array in filtered:
+            name = self._names_filtered.popleft()
+            if (
+                self.how_saving == "complete"
+                and (self.path_dir_result / name).exists()
+            ):
+                continue
+            output_queue[name] = (array, name)
+
     def make_subsets(self, input_queues: Tuple[Dict], output_queue: Dict) -> bool:
         """Create the subsets of images"""
         queue_subsets_of_names, queue_arrays = input_queues
@@ -0,0 +1,149 @@
+from time import sleep
+
+import pytest
+
+from .base import TopologyBase, KeysBatch
+
+
+class TopologyBatch(TopologyBase):
+    def __init__(self, path_dir_result, batch_size=3):
+        super().__init__(path_dir_result=path_dir_result)
+        self.batch_sizes = []
+        self.results = {}
+
+        queue_numbers = self.add_queue("numbers")
+        queue_squares = self.add_queue("squares")
+
+        self.add_work(
+            "fill numbers",
+            func_or_cls=self.fill_numbers,
+            output_queue=queue_numbers,
+            kind=("global", "one shot"),
+        )
+        self.add_work(
+            "squares",
+            func_or_cls=self.compute_squares,
+            input_queue=queue_numbers,
+            output_queue=queue_squares,
+            batch_size=batch_size,
+        )
+        self.add_work(
+            "save", func_or_cls=self.save, input_queue=queue_squares, kind="io"
+        )
+
+    def fill_numbers(self, input_queue, output_queue):
+        for number in range(8):
+            output_queue[f"n{number}"] = number
+        output_queue["error"] = ValueError("For testing")
+
+    def compute_squares(self, numbers):
+        self.batch_sizes.append(len(numbers))
+        return [number ** 2 for number in numbers]
+
+    def save(self, square):
+        self.results[square] = square
+
+
+class TopologyPairs(TopologyBase):
+    def __init__(self, path_dir_result):
+        super().__init__(path_dir_result=path_dir_result)
+        self.nb_calls_make_pairs = 0
+        self.results = {}
+
+        queue_numbers = self.add_queue("numbers")
+        queue_doubles = self.add_queue("doubles")
+        queue_pairs = self.add_queue("pairs")
+
+        self.add_work(
+            "fill numbers",
+            func_or_cls=self.fill_numbers,
+            output_queue=queue_numbers,
+            kind=("global", "one shot"),
+        )
+        self.add_work(
+            "doubles",
+            func_or_cls=self.compute_double,
+            input_queue=queue_numbers,
+            output_queue=queue_doubles,
+        )
+        self.add_work(
+            "make pairs",
+            func_or_cls=self.make_pairs,
+            input_queue=queue_doubles,
+            output_queue=queue_pairs,
+            kind="global",
+        )
+        self.add_work(
+            "save", func_or_cls=self.save, input_queue=queue_pairs, kind="io"
+        )
+
+    def fill_numbers(self, input_queue, output_queue):
+        for number in range(6):
+            output_queue[number] = number
+
+    def compute_double(self, number):
+        # the pairs stay incomplete for some time
+        sleep(0.1 * (number % 2))
+        return 2 * number
+
+    def make_pairs(self, input_queue, output_queue):
+        """Consume the doubles only when the 2 doubles of a pair are there"""
+        self.nb_calls_make_pairs += 1
+        for key in sorted(input_queue.keys()):
+            key_other = key + 1 if key % 2 == 0 else key - 1
+            if key_other in input_queue:
+                pair = (input_queue.pop(key), input_queue.pop(key_other))
+                output_queue[f"pair{key // 2}"] = tuple(sorted(pair))
+                return
+
+    def save(self, pair):
+        self.results[pair[0]] = pair
+
+
+def test_global_work_waiting(tmp_path):
+    topology = TopologyPairs(tmp_path)
+    topology.compute("exec_async", nb_max_workers=1)
+
+    assert topology.results == {0: (0, 2), 4: (4, 6), 8: (8, 10)}
+    # no busy loop while the pairs are incomplete
+    assert topology.nb_calls_make_pairs < 30
+
+
+def test_keys_batch():
+    assert str(KeysBatch(("a", "b"))) == "a+b"
+
+
+@pytest.mark.parametrize(
+    "executor", ["exec_sequential", "exec_async", "exec_async_pool"]
+)
+def test_batch(tmp_path, executor):
+    topology = TopologyBatch(tmp_path)
+    topology.compute(executor, nb_max_workers=2)
+
+    assert sorted(topology.results) == [number ** 2 for number in range(8)]
+    if executor != "exec_async_pool":
+        assert sum(topology.batch_sizes) == 8
+        assert max(topology.batch_sizes) <= 3
+
+
+@pytest.mark.parametrize("result", [None, 4, "abc", [1, 4]])
+def test_batch_bad_result(result):
+    topology = TopologyBase()
+    queue = topology.add_queue("squares")
+    topology.add_work(
+        "squares", func_or_cls=print, output_queue=queue, batch_size=3
+    )
+    work = topology.works_dict["squares"]
+    keys = KeysBatch(("a", "b", "c"))
+    work.put_output(keys, result)
+
+    assert list(queue.keys()) == list(keys)
+    errors = list(queue.values())
+    assert isinstance(errors[0], (TypeError, ValueError))
+    assert all(error is errors[0] for error in errors)
+
+
+def test_batch_size_bad():
+    topology = TopologyBase()
+    with pytest.raises(ValueError):
+        topology.add_work("bad", func_or_cls=print, batch_size=0)
@@ -15,9 +15,12 @@ executors = [
     "exec_async_sequential",
     "exec_async",
     "multi_exec_async",
+    "multi_exec_async_stealing",
     "exec_async_multi",
+    "exec_async_pool",
     "exec_async_servers",
     "exec_async_servers_threading",
+    "exec_async_servers_socket",
 ]
 
 
@@ -65,6 +65,10 @@ class TestPivNew(unittest.TestCase):
         topology = TopologyPIV(params, logging_level="info")
         topology.compute(nb_max_workers=2)
 
+        topology = TopologyPIV(params, logging_level="info")
+        topology.compute("multi_exec_async_stealing", nb_max_workers=2)
+        assert len(topology.results) == topology.series.nb_series
+
         # remove one file to test params.saving.how = "complete"
         path_files = list(Path(topology.path_dir_result).glob("piv*"))
 
@@ -56,6 +56,76 @@ class TestPreprocTemporal(unittest.TestCase):
         topology.compute("exec_async_sequential")
         assert len(topology.results) == 0
 
+    def test_preproc_streaming(self):
+        """Test the streaming temporal filters with a topology."""
+        params = TopologyPreproc.create_default_params()
+
+        params.preproc.series.path = self._work_dir
+        params.preproc.series.strcouple = "i:i+2,1"
+        params.preproc.series.ind_start = 60
+        params.preproc.series.streaming = True
+
+        params.preproc.tools.temporal_median.enable = True
+        params.preproc.tools.temporal_minima.enable = True
+        params.preproc.tools.temporal_minima.window_shape = (2, 3, 3)
+        params.preproc.tools.global_threshold.enable = True
+
+        params.preproc.saving.how = "recompute"
+        params.preproc.saving.postfix = "preproc_test_streaming"
+
+        topology = TopologyPreproc(params, logging_level="debug")
+        topology.compute("exec_async_sequential")
+        nb_images = len(topology.results)
+        assert nb_images == 2
+
+        topology = TopologyPreproc(params, logging_level="debug")
+        topology.compute("exec_sequential")
+        assert len(topology.results) == nb_images
+
+        for executor in ("multi_exec_async", "multi_exec_async_stealing"):
+            with self.assertRaises(ValueError):
+                topology.compute(executor)
+
+        # the temporal tools are applied first in streaming mode
+        params.preproc.tools.sequence = ["global_threshold", "temporal_median"]
+        with self.assertRaises(ValueError):
+            TopologyPreproc(params)
+
+    def test_preproc_streaming_vs_subsets(self):
+        """Compare the streaming temporal filters with the temporal tools."""
+        params = TopologyPreproc.create_default_params()
+
+        params.preproc.series.path = self._work_dir
+        params.preproc.series.strcouple = "i:i+2,1"
+        params.preproc.series.ind_start = 60
+
+        params.preproc.tools.temporal_median.enable = True
+        params.preproc.tools.temporal_minima.enable = True
+        params.preproc.tools.temporal_minima.window_shape = (2, 3, 3)
+
+        params.preproc.saving.how = "recompute"
+        params.preproc.saving.postfix = "preproc_test_subsets"
+        topology = TopologyPreproc(params, logging_level="debug")
+        topology.compute("exec_sequential")
+        path_dir_subsets = Path(topology.path_dir_result)
+
+        params.preproc.series.streaming = True
+        # the path is set by the topology
+        params.preproc.saving.path = None
+        params.preproc.saving.postfix = "preproc_test_streaming_vs"
+        topology = TopologyPreproc(params, logging_level="debug")
+        # default executor in streaming mode
+        topology.compute()
+        path_dir_streaming = Path(topology.path_dir_result)
+
+        assert path_dir_streaming != path_dir_subsets
+        paths = sorted(path_dir_subsets.glob("c*"))
+        assert paths
+        for path in paths:
+            assert (
+                imread(path) == imread(path_dir_streaming / path.name)
+            ).all()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -20,7 +20,15 @@ from .log import (
     log_error,
     config_logging,
 )
-from .util import imread, imsave, print_memory_usage, cstring, str_short
+from .util import (
+    imread,
+    imsave,
+    print_memory_usage,
+    cstring,
+    str_short,
+    LRUCache,
+    get_thread_pool,
+)
 
 __all__ = [
     "imread",
@@ -32,6 +40,8 @@ __all__ = [
     "log_memory_usage",
     "cstring",
     "str_short",
+    "LRUCache",
+    "get_thread_pool",
     "DEBUG",
     "log_debug",
     "log_error",
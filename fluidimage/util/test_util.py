@@ -1,6 +1,23 @@
+import os
+import pickle
+import sys
 import unittest
+from multiprocessing import get_context
 
-from .util import imread, cprint, is_memory_full, str_short
+from .util import (
+    imread,
+    cprint,
+    is_memory_full,
+    str_short,
+    LRUCache,
+    get_thread_pool,
+)
+
+
+def _use_thread_pool(pool_parent):
+    pool = get_thread_pool(1, "test")
+    assert pool is not pool_parent
+    assert pool.submit(abs, -1).result(timeout=10) == 1
 
 
 class TestUtil(unittest.TestCase):
@@ -15,6 +32,49 @@ class TestUtil(unittest.TestCase):
         is_memory_full()
         str_short("string")
 
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache["a"], 1)
+        # "b" is the least recently used item
+        cache["c"] = 3
+        self.assertNotIn("b", cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_or_compute("c", lambda: 0), 3)
+        self.assertEqual(cache.get_or_compute("d", lambda: 4), 4)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.nb_hits, cache.nb_misses), (1, 1))
+
+        cache.ensure_maxsize(4)
+        self.assertEqual(cache.maxsize, 2)
+        cache = LRUCache(maxsize=2, growable=True)
+        cache.ensure_maxsize(4)
+        self.assertEqual(cache.maxsize, 4)
+
+        cache["a"] = 1
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(cache["a"], 1)
+        cache["b"] = 2
+        self.assertEqual(len(cache), 2)
+
+    @unittest.skipIf(
+        sys.platform == "win32" or not hasattr(os, "register_at_fork"),
+        "fork needed",
+    )
+    def test_thread_pool_fork(self):
+        pool = get_thread_pool(1, "test")
+        self.assertIs(get_thread_pool(1, "test"), pool)
+        # the thread of the pool is started before the fork
+        self.assertEqual(pool.submit(abs, -1).result(), 1)
+
+        process = get_context("fork").Process(
+            target=_use_thread_pool, args=(pool,)
+        )
+        process.start()
+        process.join(20)
+        self.assertEqual(process.exitcode, 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -16,9 +16,18 @@ Provides:
 
 .. autofunction:: str_short
 
+.. autoclass:: LRUCache
+   :members:
+
+.. autofunction:: get_thread_pool
+
 """
 
+import os
 import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import psutil
 from pathlib import Path
 
@@ -125,3 +134,133 @@ def str_short(obj):
         return obj.__module__ + "." + obj.__name__
     except AttributeError:
         return pretty(obj)
+
+
+class LRUCache:
+    """Thread-safe dict-like cache discarding the least recently used items.
+
+    Parameters
+    ----------
+
+    maxsize : int
+
+      Maximum number of items.
+
+    growable : bool
+
+      If True, ``maxsize`` can be increased by the users of the cache (see
+      :func:`ensure_maxsize`).
+
+    The numbers of items found and computed by :func:`get_or_compute` are
+    counted (``nb_hits`` and ``nb_misses``).
+
+    """
+
+    def __init__(self, maxsize=128, growable=False):
+        self.maxsize = maxsize
+        self.growable = growable
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # a lock can not be pickled
+        with self._lock:
+            state = self.__dict__.copy()
+            state["_data"] = self._data.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_or_compute(self, key, func, *args, **kwargs):
+        """Get an item or compute it with ``func(*args, **kwargs)``.
+
+        The lock is not held during the computation, so that different
+        threads can compute different items at the same time.
+
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.nb_misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.nb_hits += 1
+                return value
+        value = func(*args, **kwargs)
+        self[key] = value
+        return value
+
+    def ensure_maxsize(self, nb_items):
+        """Increase ``maxsize`` to `nb_items` (only for a growable cache)."""
+        if self.growable and nb_items > self.maxsize:
+            self.maxsize = nb_items
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_thread_pools = {}
+_lock_thread_pools = threading.Lock()
+
+
+def _reset_thread_pools():
+    """Forget the pools of the parent process (their threads do not exist in
+    a forked child and the lock could have been acquired during the fork)"""
+    global _thread_pools, _lock_thread_pools
+    _thread_pools = {}
+    _lock_thread_pools = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_thread_pools)
+
+
+def get_thread_pool(nb_workers, name="fluidimage"):
+    """Get a thread pool shared by all the users of the same name.
+
+    The pools are created at the first call (with ``nb_workers`` threads) and
+    then reused, so that the threads are not created for each computation. A
+    forked process creates its own pools.
+
+    """
+    key = (name, nb_workers)
+    with _lock_thread_pools:
+        try:
+            return _thread_pools[key]
+        except KeyError:
+            pool = _thread_pools[key] = ThreadPoolExecutor(
+                nb_workers, thread_name_prefix=name
+            )
+            return pool
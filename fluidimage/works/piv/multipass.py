@@ -17,6 +17,7 @@ from .fix import WorkFIX
 from .singlepass import FirstWorkPIV, WorkPIVFromDisplacement, InterpError
 
 from ...data_objects.piv import MultipassPIVResults
+from ...util import LRUCache
 
 
 class WorkPIV(BaseWork):
@@ -30,6 +31,13 @@ class WorkPIV(BaseWork):
       The default parameters are obtained from the class method
       :func:`WorkPIV.create_default_params`.
 
+    fixed_im0 : bool, optional
+
+      If True, the image 0 is the same for all the couples (for example the
+      reference image for BOS) and the spectra of its windows are computed
+      only once for the first pass (see
+      :class:`fluidimage.works.piv.singlepass.FirstWorkPIV`).
+
     Notes
     -----
 
@@ -44,10 +52,24 @@ class WorkPIV(BaseWork):
     - depending of the value of `params.multipass.number`, iteration to compute
       PIV displacements with the works
       :class:`fluidimage.works.piv.singlepass.WorkPIVFromDisplacement` and
-      :class:`fluidimage.works.piv.fix.WorkFIX`.
+      :class:`fluidimage.works.piv.fix.WorkFIX` (with window deformation if
+      `params.multipass.deform` is not None).
+
+    The matrices used for the TPS interpolation are kept in a cache
+    (``tps_cache``) shared by the works of the different passes, so that
+    they are reused for the next couples of images (when the centers are
+    the same, which is the case when the grid and the nan vectors do not
+    change). The matrices are not cached for the results of the passes with
+    displaced windows (passes >= 1 without deformation), whose centers change
+    with the couples.
 
     """
 
+    #: Initial maximum number of items in the cache of the TPS matrices (one
+    #: item is one matrix of one subdomain), used if
+    #: ``params.multipass.tps_cache_maxsize`` is None
+    tps_cache_maxsize = 128
+
     @classmethod
     def create_default_params(cls):
         "Create an object containing the default parameters (class method)."
@@ -70,6 +92,9 @@ class WorkPIV(BaseWork):
                 "subdom_size": 200,
                 "smoothing_coef": 0.5,
                 "threshold_tps": 1.0,
+                "nb_workers_tps": 1,
+                "tps_cache_maxsize": None,
+                "deform": None,
             },
         )
 
@@ -105,17 +130,46 @@ threshold_tps :  float
     Allowed difference of displacement (in pixels) between smoothed and input
     field for TPS filter.
 
+nb_workers_tps : int (default 1)
+
+    Number of threads used to compute the TPS subdomains in parallel. It can
+    be useful for large images, in particular with use_tps='last', since the
+    other works of a topology can be waiting for the last pass.
+
+tps_cache_maxsize : None or int (default None)
+
+    Maximum number of matrices (of one subdomain) kept in the cache of the TPS
+    matrices, which is shared by the passes and the couples of images. If
+    None, the size of the cache is increased with the number of subdomains,
+    so that the matrices of a few fields are kept.
+
+deform : None or str {'linear', 'cubic', 'tps_gradient'}
+
+    If it is not None, window deformation is used for the passes 1 to
+    `number - 1`: the images 0 and 1 are deformed by minus and plus half the
+    displacement interpolated from the previous pass (bilinear or cubic spline
+    interpolation) and the correlations give only the residual displacements.
+    With 'tps_gradient', the bilinear interpolation is corrected with the
+    gradients of the TPS interpolation (only for the passes for which the TPS
+    method is used). This is more accurate only for smooth and not too noisy
+    fields.
+
 """
         )
 
-    def __init__(self, params=None):
+    def __init__(self, params=None, fixed_im0=False):
 
         self.params = params
 
         self.works_piv = []
         self.works_fix = []
+        tps_cache_maxsize = params.multipass.tps_cache_maxsize
+        if tps_cache_maxsize is None:
+            self.tps_cache = LRUCache(self.tps_cache_maxsize, growable=True)
+        else:
+            self.tps_cache = LRUCache(tps_cache_maxsize)
 
-        work_piv = FirstWorkPIV(params)
+        work_piv = FirstWorkPIV(params, fixed_im0=fixed_im0)
         self.works_piv.append(work_piv)
         self.works_fix.append(WorkFIX(params.fix, work_piv))
 
@@ -177,6 +231,9 @@ threshold_tps :  float
             self.works_piv.append(work_piv)
             self.works_fix.append(WorkFIX(params.fix, work_piv))
 
+        for work_piv in self.works_piv:
+            work_piv.tps_cache = self.tps_cache
+
     def calcul(self, couple):
         """Compute a PIV field (multipass) from a couple of image."""
 
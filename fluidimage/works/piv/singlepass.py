@@ -25,6 +25,8 @@
 """
 
 from copy import deepcopy
+import hashlib
+import threading
 
 import numpy as np
 
@@ -41,8 +43,13 @@ from .. import BaseWork
 from ...calcul.interpolate.thin_plate_spline_subdom import ThinPlateSplineSubdom
 
 from ...calcul.interpolate.griddata import griddata
+from ...calcul.deform import (
+    compute_interp_matrices,
+    compute_dense_field,
+    deform_images,
+)
 from ...calcul.subpix import SubPix
-from ...calcul.errors import PIVError
+from ...calcul.errors import PIVError, ERROR_BAD_SHAPE, error_explanations
 
 
 class InterpError(ValueError):
@@ -60,6 +67,14 @@ class BaseWorkPIV(BaseWork):
 
     """
 
+    #: Cache (:class:`fluidimage.util.LRUCache`) of the TPS matrices (set by
+    #: :class:`fluidimage.works.piv.multipass.WorkPIV`)
+    tps_cache = None
+
+    #: If True, the image 0 is the same for all the couples (see
+    #: :class:`FirstWorkPIV`)
+    fixed_im0 = False
+
     @classmethod
     def _complete_params_with_default(cls, params):
         pass
@@ -204,20 +219,178 @@ class BaseWorkPIV(BaseWork):
         result.indices_no_displacement = self.correl.get_indices_no_displacement()
         result.displacement_max = self.correl.displacement_max
 
+    def __getstate__(self):
+        # the buffers of the threads can not be pickled (and are not needed
+        # in another process) and the key of the spectra of the image 0
+        # contains a data pointer
+        state = self.__dict__.copy()
+        state.pop("_thread_buffers", None)
+        state.pop("_spectra_im0", None)
+        return state
+
+    def _get_buffer(self, name, shape, dtype=np.float32):
+        """Get a buffer owned by the current thread.
+
+        The buffers are reused for the next calls (with the same shape), which
+        avoids allocating new arrays for each pass and each couple. Since the
+        executors can call a work in different threads at the same time, each
+        thread uses its own buffers.
+
+        """
+        try:
+            thread_buffers = self._thread_buffers
+        except AttributeError:
+            thread_buffers = self._thread_buffers = threading.local()
+
+        buffer = getattr(thread_buffers, name, None)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.zeros(shape, dtype=dtype)
+            setattr(thread_buffers, name, buffer)
+        return buffer
+
     def _pad_images(self, im0, im1):
         """Pad images with zeros.
 
+        The padded images are float32 buffers reused for the next couples.
+
         .. todo::
 
            Choose correctly the variable npad.
 
         """
         npad = self.npad = max(self._start_for_crop0 + self._stop_for_crop0)
-        tmp = [(npad, npad), (npad, npad)]
-        im0pad = np.pad(im0 - im0.min(), tmp, "constant")
-        im1pad = np.pad(im1 - im1.min(), tmp, "constant")
+        shape = (im0.shape[0] + 2 * npad, im0.shape[1] + 2 * npad)
+        im0pad = self._get_buffer("im0pad", shape)
+        im1pad = self._get_buffer("im1pad", shape)
+        # only the center of the buffers is written so the borders stay zero
+        center = (
+            slice(npad, npad + im0.shape[0]),
+            slice(npad, npad + im0.shape[1]),
+        )
+        np.subtract(im0, im0.min(), out=im0pad[center])
+        np.subtract(im1, im1.min(), out=im1pad[center])
         return im0pad, im1pad
 
+    def _crop_windows(self, impad, ixs_pad, iys_pad, start, stop, name):
+        """Crop all the windows of a padded image in one buffer.
+
+        The windows are gathered with :func:`numpy.take` (on the flat indices
+        of the origins of the windows) from a strided view of the padded image
+        (of shape ``(nb_origins, ny, nx)``, see
+        :func:`numpy.lib.stride_tricks.as_strided`) in a float32 buffer of
+        shape ``(nb_vec, ny, nx)`` reused for the next calls. The mean of each
+        window is subtracted.
+
+        Returns
+        -------
+
+        windows : np.ndarray
+
+        outside : np.ndarray of bool
+
+          True for the windows not included in the padded image (their values
+          are set to zero).
+
+        """
+        nb_vec = len(ixs_pad)
+        shape = (start[0] + stop[0], start[1] + stop[1])
+        ny_pad, nx_pad = impad.shape
+
+        iys_start = iys_pad - start[0]
+        ixs_start = ixs_pad - start[1]
+        outside = (
+            (iys_start < 0)
+            | (iys_pad + stop[0] > ny_pad)
+            | (ixs_start < 0)
+            | (ixs_pad + stop[1] > nx_pad)
+        )
+
+        # windows starting at each flat index of the padded image (the last
+        # one ends at the end of the image)
+        nb_origins = ny_pad * nx_pad - (shape[0] - 1) * nx_pad - shape[1] + 1
+        all_windows = np.lib.stride_tricks.as_strided(
+            impad.ravel(),
+            shape=(nb_origins,) + shape,
+            strides=(impad.strides[1],) + impad.strides,
+            writeable=False,
+        )
+        origins = np.clip(iys_start, 0, ny_pad - shape[0]) * nx_pad
+        origins += np.clip(ixs_start, 0, nx_pad - shape[1])
+
+        windows = self._get_buffer("windows_" + name, (nb_vec,) + shape)
+        # mode "clip" so that the output is not buffered
+        np.take(all_windows, origins, axis=0, out=windows, mode="clip")
+        windows[outside] = 0.0
+        windows -= windows.mean(axis=(1, 2), keepdims=True)
+        return windows, outside
+
+    def _get_spectra_im0(self, im0, im0pad, ixs0_pad, iys0_pad):
+        """Get the spectra of the windows of the image 0 (if it is fixed).
+
+        The spectra (computed by the correlation object) are kept with the
+        image 0, so they are computed only once when ``self.fixed_im0`` is
+        True. When the same array is given for all the couples (as in
+        :class:`fluidimage.topologies.bos.TopologyBOS`), it is recognized from
+        its memory (the fixed image must not be modified in place). Otherwise
+        (for example images read for each couple), the values of the image 0
+        are compared through a sha1 digest. Returns None if the image 0 is not
+        fixed or if the correlation method does not support it.
+
+        For multi correlations, the result is a tuple ``(spectrum0,
+        outside0)``. Otherwise, it is a list with one spectrum for each vector
+        (None for the windows with a bad shape).
+
+        """
+        if not self.fixed_im0 or not hasattr(
+            self.correl, "compute_spectrum0"
+        ):
+            return None
+
+        # the cached image is kept alive so that another array with the same
+        # data pointer is a view of the same memory
+        key_memory = (
+            im0.__array_interface__["data"][0],
+            im0.shape,
+            im0.strides,
+            im0.dtype.str,
+        )
+        cached = getattr(self, "_spectra_im0", None)
+        if cached is not None and cached[1] == key_memory:
+            return cached[3]
+
+        digest = (
+            im0.shape,
+            im0.dtype.str,
+            hashlib.sha1(np.ascontiguousarray(im0)).digest(),
+        )
+        if cached is not None and cached[2] == digest:
+            spectra = cached[3]
+            self._spectra_im0 = (im0, key_memory, digest, spectra)
+            return spectra
+
+        if self.correl.multi:
+            ims0, outside0 = self._crop_windows(
+                im0pad,
+                ixs0_pad,
+                iys0_pad,
+                self._start_for_crop0,
+                self._stop_for_crop0,
+                "im0",
+            )
+            spectra = (self.correl.compute_spectrum0(ims0), outside0.copy())
+        else:
+            spectra = []
+            for ixvec0, iyvec0 in zip(ixs0_pad, iys0_pad):
+                im0crop = self._crop_im0(ixvec0, iyvec0, im0pad)
+                if im0crop.shape != self.shape_crop_im0:
+                    spectra.append(None)
+                else:
+                    spectra.append(self.correl.compute_spectrum0(im0crop))
+
+        # the spectra are only read so they can be shared by the threads
+        self._spectra_im0 = (im0, key_memory, digest, spectra)
+        return spectra
+
     def _calcul_indices_vec(self, deltaxs_approx=None, deltays_approx=None):
         """Calcul the indices corresponding to the vectors and cropped windows.
 
@@ -268,12 +441,19 @@ class BaseWorkPIV(BaseWork):
     def _loop_vectors(self, im0, im1, deltaxs_approx=None, deltays_approx=None):
         """Loop over the vectors to compute them."""
 
+        if self.correl.multi:
+            return self._loop_vectors_multi(
+                im0, im1, deltaxs_approx, deltays_approx
+            )
+
         im0pad, im1pad = self._pad_images(im0, im1)
 
         xs, ys, ixs0_pad, iys0_pad, ixs1_pad, iys1_pad = self._calcul_indices_vec(
             deltaxs_approx=deltaxs_approx, deltays_approx=deltays_approx
         )
 
+        spectra0 = self._get_spectra_im0(im0, im0pad, ixs0_pad, iys0_pad)
+
         nb_vec = len(xs)
 
         correls = [None] * nb_vec
@@ -292,11 +472,17 @@ class BaseWorkPIV(BaseWork):
             ixvec1 = ixs1_pad[ivec]
             iyvec1 = iys1_pad[ivec]
 
-            im0crop = self._crop_im0(ixvec0, iyvec0, im0pad)
+            if spectra0 is None:
+                im0crop = self._crop_im0(ixvec0, iyvec0, im0pad)
+                shape_im0crop = im0crop.shape
+            elif spectra0[ivec] is None:
+                shape_im0crop = None
+            else:
+                shape_im0crop = self.shape_crop_im0
             im1crop = self._crop_im1(ixvec1, iyvec1, im1pad)
 
             if (
-                im0crop.shape != self.shape_crop_im0
+                shape_im0crop != self.shape_crop_im0
                 or im1crop.shape != self.shape_crop_im1
             ):
 
@@ -306,7 +492,7 @@ class BaseWorkPIV(BaseWork):
                     iyvec0,
                     ixvec1,
                     iyvec1,
-                    im0crop.shape,
+                    shape_im0crop,
                     self.shape_crop_im0,
                     im1crop.shape,
                     self.shape_crop_im1,
@@ -319,7 +505,12 @@ class BaseWorkPIV(BaseWork):
                 continue
 
             # compute and store correlation map
-            correl, norm = self.correl(im0crop, im1crop)
+            if spectra0 is None:
+                correl, norm = self.correl(im0crop, im1crop)
+            else:
+                correl, norm = self.correl.call_with_spectrum0(
+                    spectra0[ivec], im1crop
+                )
             if (
                 self.index_pass == 0
                 and self.params.piv0.coef_correl_no_displ is not None
@@ -370,6 +561,110 @@ class BaseWorkPIV(BaseWork):
             secondary_peaks,
         )
 
+    def _loop_vectors_multi(
+        self, im0, im1, deltaxs_approx=None, deltays_approx=None
+    ):
+        """Compute the vectors with one correlation call for all the windows.
+
+        The cropped images are stacked in 3D arrays and all correlations are
+        computed at once by the correlation object (with ``multi = True``).
+        The peaks and the subpixel displacements are then computed with
+        vectorized functions returning integer error codes.
+
+        """
+
+        im0pad, im1pad = self._pad_images(im0, im1)
+
+        xs, ys, ixs0_pad, iys0_pad, ixs1_pad, iys1_pad = self._calcul_indices_vec(
+            deltaxs_approx=deltaxs_approx, deltays_approx=deltays_approx
+        )
+
+        nb_vec = len(xs)
+
+        deltaxs = np.empty(xs.shape, dtype="float32")
+        deltays = np.empty_like(deltaxs)
+        correls_max = np.empty_like(deltaxs)
+
+        has_to_apply_subpix = self.index_pass == self.params.multipass.number - 1
+
+        spectra0 = self._get_spectra_im0(im0, im0pad, ixs0_pad, iys0_pad)
+        if spectra0 is None:
+            ims0, outside0 = self._crop_windows(
+                im0pad,
+                ixs0_pad,
+                iys0_pad,
+                self._start_for_crop0,
+                self._stop_for_crop0,
+                "im0",
+            )
+        else:
+            spectrum0, outside0 = spectra0
+
+        ims1, outside1 = self._crop_windows(
+            im1pad,
+            ixs1_pad,
+            iys1_pad,
+            self._start_for_crop1,
+            self._stop_for_crop1,
+            "im1",
+        )
+        bad_shapes = outside0 | outside1
+
+        if spectra0 is None:
+            correls, norms = self.correl(ims0, ims1)
+        else:
+            correls, norms = self.correl.call_with_spectrum0(spectrum0, ims1)
+
+        if (
+            self.index_pass == 0
+            and self.params.piv0.coef_correl_no_displ is not None
+        ):
+            iy0, ix0 = self.correl.get_indices_no_displacement()
+            correls[:, iy0, ix0] *= self.params.piv0.coef_correl_no_displ
+
+        (
+            deltaxs[:],
+            deltays[:],
+            correls_max[:],
+            error_codes,
+            secondary_peaks,
+        ) = self.correl.compute_displacements_subpix_from_correls(
+            correls, norms, apply_subpix=has_to_apply_subpix
+        )
+
+        if bad_shapes.any():
+            print("Warning: Bad im_crop shape.", np.nonzero(bad_shapes)[0])
+            deltaxs[bad_shapes] = np.nan
+            deltays[bad_shapes] = np.nan
+            correls_max[bad_shapes] = np.nan
+            error_codes[bad_shapes] = ERROR_BAD_SHAPE
+            if secondary_peaks is not None:
+                for ivec in np.nonzero(bad_shapes)[0]:
+                    secondary_peaks[ivec] = None
+
+        if secondary_peaks is None:
+            secondary_peaks = [None] * nb_vec
+
+        errors = {
+            int(ivec): error_explanations[error_codes[ivec]]
+            for ivec in np.nonzero(error_codes)[0]
+        }
+
+        if deltaxs_approx is not None:
+            deltaxs += deltaxs_approx
+            deltays += deltays_approx
+
+        return (
+            deltaxs,
+            deltays,
+            xs,
+            ys,
+            correls_max,
+            correls,
+            errors,
+            secondary_peaks,
+        )
+
     def _init_crop(self):
         """Initialize the cropping of the images."""
 
@@ -497,20 +792,27 @@ class BaseWorkPIV(BaseWork):
             subdom_size = self.params.multipass.subdom_size
             threshold = self.params.multipass.threshold_tps
 
+            # the centers of windows displaced by the previous pass change
+            # with the couples of images, so their matrices are not cached
+            if getattr(piv_results, "windows_displaced", False):
+                cache = None
+            else:
+                cache = self.tps_cache
+
             tps = ThinPlateSplineSubdom(
                 centers,
                 subdom_size,
                 smoothing_coef,
                 threshold=threshold,
                 percent_buffer_area=0.25,
+                cache=cache,
+                nb_workers=self.params.multipass.nb_workers_tps,
             )
             try:
-                deltaxs_smooth, deltaxs_tps = tps.compute_tps_coeff_subdom(
-                    deltaxs
-                )
-                deltays_smooth, deltays_tps = tps.compute_tps_coeff_subdom(
-                    deltays
-                )
+                (
+                    (deltaxs_smooth, deltays_smooth),
+                    (deltaxs_tps, deltays_tps),
+                ) = tps.compute_tps_coeffs_subdom((deltaxs, deltays))
             except np.linalg.LinAlgError:
                 print("compute delta_approx with griddata (in tps)")
                 deltaxs_approx = griddata(
@@ -531,6 +833,14 @@ class BaseWorkPIV(BaseWork):
 
                 deltaxs_approx = tps.compute_eval(deltaxs_tps)
                 deltays_approx = tps.compute_eval(deltays_tps)
+
+                if not last and self.params.multipass.deform == "tps_gradient":
+                    piv_results.gradients_deltaxs_approx = tps.compute_gradient(
+                        deltaxs_tps
+                    )
+                    piv_results.gradients_deltays_approx = tps.compute_gradient(
+                        deltays_tps
+                    )
         else:
             deltaxs_approx = griddata(
                 centers, deltaxs, (self.iyvecs, self.ixvecs)
@@ -558,6 +868,13 @@ class FirstWorkPIV(BaseWorkPIV):
       ParamContainer object produced by the function
       :func:`fluidimage.works.piv.multipass.WorkPIV.create_default_params`.
 
+    fixed_im0 : bool, optional
+
+      If True, the image 0 is the same for all the couples (for example the
+      reference image for BOS). With the fftw correlation methods, the
+      spectra of its windows are then computed only once and only the
+      windows of the image 1 are transformed.
+
     """
 
     index_pass = 0
@@ -657,9 +974,10 @@ strcrop : None, str
 """
         )
 
-    def __init__(self, params):
+    def __init__(self, params, fixed_im0=False):
 
         self.params = params
+        self.fixed_im0 = fixed_im0
 
         self.overlap = params.piv0.grid.overlap
         if self.overlap >= 1:
@@ -724,9 +1042,10 @@ class WorkPIVFromDisplacement(BaseWorkPIV):
     def calcul(self, piv_results):
         """Calcul the PIV (one pass) from a couple of images and displacement.
 
-        .. todo::
-
-           Use the derivatives of the velocity to distort the image 1.
+        If `params.multipass.deform` is None, the windows are only shifted by
+        the rounded displacement. Otherwise, the images are deformed (see
+        :meth:`_deform_images`) and the correlations give the residual
+        displacements.
 
         """
         if not isinstance(piv_results, HeavyPIVResults):
@@ -743,21 +1062,39 @@ class WorkPIVFromDisplacement(BaseWorkPIV):
         deltaxs_approx = piv_results.deltaxs_approx
         deltays_approx = piv_results.deltays_approx
 
-        deltaxs_approx = np.round(deltaxs_approx).astype("int32")
-        deltays_approx = np.round(deltays_approx).astype("int32")
-
-        (
-            deltaxs,
-            deltays,
-            xs,
-            ys,
-            correls_max,
-            correls,
-            errors,
-            secondary_peaks,
-        ) = self._loop_vectors(
-            im0, im1, deltaxs_approx=deltaxs_approx, deltays_approx=deltays_approx
-        )
+        if self.params.multipass.deform:
+            im0, im1 = self._deform_images(im0, im1, piv_results)
+            (
+                deltaxs,
+                deltays,
+                xs,
+                ys,
+                correls_max,
+                correls,
+                errors,
+                secondary_peaks,
+            ) = self._loop_vectors(im0, im1)
+            deltaxs += deltaxs_approx
+            deltays += deltays_approx
+        else:
+            deltaxs_approx = np.round(deltaxs_approx).astype("int32")
+            deltays_approx = np.round(deltays_approx).astype("int32")
+
+            (
+                deltaxs,
+                deltays,
+                xs,
+                ys,
+                correls_max,
+                correls,
+                errors,
+                secondary_peaks,
+            ) = self._loop_vectors(
+                im0,
+                im1,
+                deltaxs_approx=deltaxs_approx,
+                deltays_approx=deltays_approx,
+            )
 
         xs, ys = self._xyoriginalimage_from_xymasked(xs, ys)
 
@@ -777,9 +1114,50 @@ class WorkPIVFromDisplacement(BaseWorkPIV):
         self._complete_result(result)
         result.deltaxs_approx0 = deltaxs_approx
         result.deltays_approx0 = deltays_approx
+        # without deformation, the windows are displaced (and not on the grid)
+        result.windows_displaced = not self.params.multipass.deform
 
         return result
 
+    def _deform_images(self, im0, im1, piv_results):
+        """Deform the images with the displacement of the previous pass.
+
+        The displacement interpolated on the grid is interpolated on all the
+        pixels (with the TPS gradients if they have been computed) and the
+        images 0 and 1 are deformed by minus and plus half this displacement.
+
+        """
+        method = self.params.multipass.deform
+        if method == "tps_gradient":
+            method = "linear"
+        # the interpolation matrices are reused for the next couples
+        key = (im0.shape, method)
+        cached = getattr(self, "_interp_matrices", None)
+        if cached is None or cached[0] != key:
+            cached = self._interp_matrices = (
+                key,
+                compute_interp_matrices(
+                    self.ixvecs, self.iyvecs, im0.shape, method
+                ),
+            )
+        interp_matrices = cached[1]
+
+        deltaxs = compute_dense_field(
+            piv_results.deltaxs_approx,
+            self.ixvecs,
+            self.iyvecs,
+            interp_matrices,
+            getattr(piv_results, "gradients_deltaxs_approx", None),
+        )
+        deltays = compute_dense_field(
+            piv_results.deltays_approx,
+            self.ixvecs,
+            self.iyvecs,
+            interp_matrices,
+            getattr(piv_results, "gradients_deltays_approx", None),
+        )
+        return deform_images(im0, im1, deltaxs, deltays, method)
+
     def _calcul_indices_vec(self, deltaxs_approx=None, deltays_approx=None):
         """Calcul the indices corresponding to the vectors and cropped windows.
 
@@ -813,6 +1191,10 @@ class WorkPIVFromDisplacement(BaseWorkPIV):
           y index of the center of the crop image 1 in the padded image 1.
 
         """
+        if deltaxs_approx is None:
+            # deformed images (no shift of the windows)
+            return super()._calcul_indices_vec()
+
         ixs0 = self.ixvecs_grid - deltaxs_approx // 2
         iys0 = self.iyvecs_grid - deltays_approx // 2
         ixs1 = ixs0 + deltaxs_approx
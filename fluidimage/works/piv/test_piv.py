@@ -1,5 +1,10 @@
+import hashlib
+import pickle
 import unittest
 from shutil import rmtree
+from unittest.mock import patch
+
+import numpy as np
 
 from fluiddyn.io import stdout_redirected
 
@@ -7,7 +12,11 @@ from fluidimage import SeriesOfArrays
 from fluidimage.works.piv import WorkPIV
 
 from fluidimage.data_objects.display_piv import DisplayPIV
-from fluidimage.data_objects.piv import MultipassPIVResults, LightPIVResults
+from fluidimage.data_objects.piv import (
+    ArrayCouple,
+    MultipassPIVResults,
+    LightPIVResults,
+)
 
 from fluidimage import path_image_samples
 
@@ -69,6 +78,193 @@ class TestPIV(unittest.TestCase):
 
         LightPIVResults(str_path=str(path_file))
 
+    def test_piv_multi(self):
+        """Compare the results with the correlation classes fftw (1 call per
+        window) and fftw.multi (1 call per pass)"""
+
+        params = WorkPIV.create_default_params()
+        params.piv0.shape_crop_im0 = 32
+        params.multipass.number = 2
+        params.multipass.use_tps = False
+
+        piv = WorkPIV(params=params)
+        with stdout_redirected():
+            result = piv.calcul(self.serie)
+
+        params.piv0.method_correl = "fftw.multi"
+        piv = WorkPIV(params=params)
+        with stdout_redirected():
+            result_multi = piv.calcul(self.serie)
+
+        for piv_pass, piv_pass_multi in zip(result.passes, result_multi.passes):
+            self.assertTrue(
+                np.allclose(
+                    piv_pass.deltaxs,
+                    piv_pass_multi.deltaxs,
+                    atol=1e-4,
+                    equal_nan=True,
+                )
+            )
+            self.assertTrue(
+                np.allclose(
+                    piv_pass.deltays,
+                    piv_pass_multi.deltays,
+                    atol=1e-4,
+                    equal_nan=True,
+                )
+            )
+
+        # the work (with the buffers of the threads) can be sent to processes
+        piv = pickle.loads(pickle.dumps(piv))
+        with stdout_redirected():
+            result_pickled = piv.calcul(self.serie)
+        self.assertTrue(
+            np.allclose(
+                result_pickled.passes[-1].deltaxs,
+                result_multi.passes[-1].deltaxs,
+                equal_nan=True,
+            )
+        )
+
+    def test_crop_windows(self):
+        piv = WorkPIV(WorkPIV.create_default_params()).works_piv[0]
+        impad = np.random.rand(40, 50).astype(np.float32)
+        iys = np.array([5, 0, 38, 20])
+        ixs = np.array([5, 3, 20, 49])
+        windows, outside = piv._crop_windows(
+            impad, ixs, iys, (4, 3), (4, 5), "im0"
+        )
+        self.assertEqual(windows.shape, (4, 8, 8))
+        self.assertEqual(list(outside), [False, True, True, True])
+        window = impad[1:9, 2:10]
+        self.assertTrue(np.allclose(windows[0], window - window.mean()))
+        self.assertTrue(np.all(windows[1:] == 0))
+
+        # the buffer is reused
+        windows_next, _ = piv._crop_windows(
+            impad, ixs, iys, (4, 3), (4, 5), "im0"
+        )
+        self.assertIs(windows_next, windows)
+
+    def test_piv_fixed_im0(self):
+        """Reuse the spectra of the image 0 (as for BOS)"""
+        params = WorkPIV.create_default_params()
+        params.piv0.shape_crop_im0 = 32
+        params.multipass.number = 2
+        params.multipass.use_tps = False
+
+        for method_correl in ("fftw", "fftw.multi"):
+            params.piv0.method_correl = method_correl
+            piv = WorkPIV(params=params)
+            piv_fixed = WorkPIV(params=params, fixed_im0=True)
+            with stdout_redirected():
+                result = piv.calcul(self.serie)
+                # the second call uses the cached spectra
+                for _ in range(2):
+                    result_fixed = piv_fixed.calcul(self.serie)
+
+            for piv_pass, piv_pass_fixed in zip(
+                result.passes, result_fixed.passes
+            ):
+                for key in ("deltaxs", "deltays"):
+                    self.assertTrue(
+                        np.allclose(
+                            getattr(piv_pass, key),
+                            getattr(piv_pass_fixed, key),
+                            atol=1e-4,
+                            equal_nan=True,
+                        )
+                    )
+
+    def test_piv_fixed_im0_same_array(self):
+        """The fixed image 0 given as the same array is hashed only once"""
+        params = WorkPIV.create_default_params()
+        params.piv0.shape_crop_im0 = 32
+        params.multipass.number = 1
+        params.multipass.use_tps = False
+        params.piv0.method_correl = "fftw.multi"
+
+        piv_fixed = WorkPIV(params=params, fixed_im0=True)
+        arrays = ArrayCouple(serie=self.serie).get_arrays()
+        with patch.object(
+            hashlib, "sha1", wraps=hashlib.sha1
+        ) as sha1, stdout_redirected():
+            for _ in range(3):
+                couple = ArrayCouple(arrays=arrays, serie=self.serie)
+                piv_fixed.calcul(couple)
+
+        self.assertEqual(sha1.call_count, 1)
+
+    def test_piv_tps_cache(self):
+        """The TPS matrices are reused for a second field (same centers)"""
+        params = WorkPIV.create_default_params()
+        params.piv0.shape_crop_im0 = 32
+        params.multipass.number = 2
+        params.multipass.use_tps = True
+        params.multipass.subdom_size = 20
+
+        piv = WorkPIV(params=params)
+        cache = piv.tps_cache
+        with stdout_redirected():
+            piv.calcul(self.serie)
+        nb_misses = cache.nb_misses
+        nbs_subdom = [
+            value["nb_subdom"]
+            for key, value in cache._data.items()
+            if key[0] == "indices"
+        ]
+        self.assertGreater(min(nbs_subdom), 1)
+        self.assertEqual(cache.nb_hits, 0)
+        # the cache has been enlarged for all the subdomains
+        self.assertEqual(len(cache), nb_misses)
+
+        with stdout_redirected():
+            piv.calcul(self.serie)
+        self.assertEqual(cache.nb_misses, nb_misses)
+        self.assertEqual(cache.nb_hits, nb_misses)
+
+        params.multipass.tps_cache_maxsize = 16
+        piv = WorkPIV(params=params)
+        with stdout_redirected():
+            piv.calcul(self.serie)
+        self.assertEqual(piv.tps_cache.maxsize, 16)
+
+        # centers of displaced windows: nothing is cached
+        params.multipass.use_tps = "last"
+        piv = WorkPIV(params=params)
+        with stdout_redirected():
+            piv.calcul(self.serie)
+        self.assertEqual(len(piv.tps_cache), 0)
+        self.assertEqual(piv.tps_cache.nb_misses, 0)
+
+    def test_piv_deform(self):
+        params = WorkPIV.create_default_params()
+        params.piv0.shape_crop_im0 = 32
+        params.piv0.method_correl = "fftw.multi"
+        params.multipass.number = 2
+        params.multipass.use_tps = False
+
+        piv = WorkPIV(params=params)
+        with stdout_redirected():
+            result = piv.calcul(self.serie)
+
+        for deform, use_tps in (
+            ("linear", False),
+            ("cubic", False),
+            ("tps_gradient", True),
+        ):
+            params.multipass.deform = deform
+            params.multipass.use_tps = use_tps
+            piv = WorkPIV(params=params)
+            with stdout_redirected():
+                result_deform = piv.calcul(self.serie)
+
+            diff = np.hypot(
+                result.passes[1].deltaxs - result_deform.passes[1].deltaxs,
+                result.passes[1].deltays - result_deform.passes[1].deltays,
+            )
+            self.assertLess(np.nanmedian(diff), 0.5)
+
     def test_piv_list(self):
 
         params = WorkPIV.create_default_params()
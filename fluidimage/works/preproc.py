@@ -45,6 +45,19 @@ class WorkPreproc(PreprocBase):
         )
         return result
 
+    def calcul_frame(self, frame_name):
+        """Apply the enabled tools (except the temporal tools) on one image.
+
+        Used with streaming temporal filters (see
+        :mod:`fluidimage.preproc.streaming`), which have already been applied
+        on the image.
+
+        """
+        image, name = frame_name
+        result = PreprocResults(self.params)
+        result.data[name] = self.tools(image, skip_temporal=True)
+        return result
+
     def _make_dict_to_save(self, array_serie, images):
         name_files = array_serie.names
         nb_series = array_serie.nb_series
@@ -102,6 +102,10 @@ def modification_date(filename):
     return datetime.fromtimestamp(t)
 
 
+# modules compiled with OpenMP
+modules_openmp = ["fluidimage.calcul.peaks_pythran"]
+
+
 def make_pythran_extensions(modules):
     develop = sys.argv[-1] == "develop"
     extensions = []
@@ -119,6 +123,9 @@ def make_pythran_extensions(modules):
             print('pythran extension "' + mod + '" needs to be built')
             pext = PythranExtension(mod, [py_file])
             pext.include_dirs.append(np.get_include())
+            if mod in modules_openmp:
+                pext.extra_compile_args.append("-fopenmp")
+                pext.extra_link_args.append("-fopenmp")
             extensions.append(pext)
     return extensions
 
@@ -128,7 +135,9 @@ if use_pythran:
         [
             "fluidimage.calcul.correl_pythran",
             "fluidimage.calcul.interpolate.tps_pythran",
+            "fluidimage.calcul.peaks_pythran",
             "fluidimage.calcul.subpix_pythran",
+            "fluidimage.preproc.pointwise_pythran",
             "fluidimage.topologies.example_pythran",
         ]
     )